@@ -0,0 +1,228 @@
+"""
+Contains the functions for building asset packs, and the class for reading
+them. An asset pack is a single file holding every texture and sound effect
+used by the game already decoded, as RGBA pixels and PCM samples in the
+mixer's format, after an index of where each asset is in the file. Packs are
+memory mapped when opened, and textures are created directly from the mapped
+pixels, so loading assets needs a single file opened rather than dozens read
+and decoded. Each asset records the size and modification time of the file
+it was decoded from, and any asset whose file has changed since the pack was
+built is ignored, so that the file is loaded instead.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from glob import glob
+from typing import Any, Dict, List, Optional, Tuple
+
+import pygame
+
+ASSET_PACK_PATH = os.path.join(os.path.dirname(__file__), "assets.mzassets")
+PACK_MAGIC = b"PYMZASST"
+PACK_VERSION = 1
+# Directories searched for assets, relative to the directory of the pack
+ASSET_DIRECTORIES = ("textures", "sounds")
+IMAGE_EXTENSION = ".png"
+SOUND_EXTENSION = ".wav"
+# Sounds played with pygame.mixer.music, which can only stream from a file
+STREAMED_SOUNDS = ("sounds/ambience.wav",)
+
+# Magic bytes, format version, and index length in bytes
+_PACK_HEADER = struct.Struct("<8sHxxI")
+# Every asset starts on a multiple of this many bytes
+_ALIGNMENT = 8
+
+
+def build_asset_pack(path: str = ASSET_PACK_PATH) -> int:
+    """
+    Decode every image and sound in ASSET_DIRECTORIES, relative to the
+    directory of the given path, and save them as an asset pack. The mixer
+    must already be initialised with the same settings as the game, or
+    sounds will not be included. Returns the number of assets saved. The
+    pack is written to a temporary file first, then moved over any existing
+    file, so a game with the old version of the pack open is unaffected.
+    """
+    root_directory = os.path.dirname(os.path.abspath(path))
+    sound_format = pygame.mixer.get_init()
+    assets: Dict[str, Dict[str, Any]] = {}
+    asset_data: List[bytes] = []
+    offset = 0
+    for source_path in sorted(
+            x for directory in ASSET_DIRECTORIES for x in glob(
+                os.path.join(root_directory, directory, "**", "*"),
+                recursive=True
+            )):
+        key = _get_key(root_directory, source_path)
+        extension = os.path.splitext(source_path)[1].lower()
+        entry: Dict[str, Any]
+        if extension == IMAGE_EXTENSION:
+            image = pygame.image.load(source_path)
+            entry = {"type": "image", "size": image.get_size()}
+            data = pygame.image.tostring(image, "RGBA")
+        elif (extension == SOUND_EXTENSION and sound_format is not None
+                and key not in STREAMED_SOUNDS):
+            entry = {"type": "sound"}
+            data = pygame.mixer.Sound(source_path).get_raw()
+        else:
+            continue
+        source_stat = os.stat(source_path)
+        entry.update({
+            "offset": offset, "length": len(data),
+            "source_size": source_stat.st_size,
+            "source_mtime": source_stat.st_mtime_ns
+        })
+        assets[key] = entry
+        asset_data.append(data)
+        offset += _align(len(data))
+    index = json.dumps({
+        "sound_format": sound_format, "assets": assets
+    }, separators=(',', ':')).encode()
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(_PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(index)))
+        file.write(index)
+        file.write(_padding(file.tell()))
+        for data in asset_data:
+            file.write(data)
+            file.write(_padding(len(data)))
+    os.replace(temp_path, path)
+    return len(assets)
+
+
+class AssetPack:
+    """
+    Opens an asset pack, reading only its index until an asset is loaded.
+    Loading an asset returns None if it isn't in the pack or its source file
+    has changed since the pack was built, in which case it should be loaded
+    from the source file instead. Images may be loaded from any thread.
+    """
+    def __init__(self, path: str = ASSET_PACK_PATH) -> None:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < _PACK_HEADER.size:
+                raise ValueError("File is too small to be an asset pack")
+            # Copy on write, as frombuffer needs a writable buffer to share.
+            # The map stays open for as long as any image views it.
+            pack_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._pack_view = memoryview(pack_map)
+        magic, version, index_length = _PACK_HEADER.unpack_from(
+            self._pack_view
+        )
+        if magic != PACK_MAGIC:
+            raise ValueError("File is not an asset pack")
+        if version != PACK_VERSION:
+            raise ValueError(f"Unsupported asset pack version: {version}")
+        data_start = _align(_PACK_HEADER.size + index_length)
+        if data_start > len(self._pack_view):
+            raise ValueError("Asset pack is truncated")
+        index = json.loads(bytes(
+            self._pack_view[_PACK_HEADER.size:_PACK_HEADER.size + index_length]
+        ))
+        self._data_view = self._pack_view[data_start:]
+        self._root_directory = os.path.dirname(os.path.abspath(path))
+        self._assets: Dict[str, Dict[str, Any]] = index['assets']
+        self._sound_format: Optional[List[int]] = index['sound_format']
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def load_image(self, source_path: str) -> Optional[pygame.Surface]:
+        """
+        Create a surface from the pixels decoded from an image file. The
+        surface shares memory with the pack, so should be converted with
+        convert or convert_alpha before being drawn on.
+        """
+        asset = self._get_asset(source_path, "image")
+        if asset is None:
+            return None
+        data, entry = asset
+        return pygame.image.frombuffer(data, tuple(entry['size']), "RGBA")
+
+    def load_sound(self, source_path: str) -> Optional[pygame.mixer.Sound]:
+        """
+        Create a sound from the samples decoded from a sound file. Returns
+        None if the mixer has different settings to when the pack was built.
+        """
+        current_format = pygame.mixer.get_init()
+        if (current_format is None or self._sound_format is None
+                or list(current_format) != self._sound_format):
+            return None
+        asset = self._get_asset(source_path, "sound")
+        if asset is None:
+            return None
+        return pygame.mixer.Sound(buffer=asset[0])
+
+    def _get_asset(self, source_path: str, asset_type: str
+                   ) -> Optional[Tuple[memoryview, Dict[str, Any]]]:
+        """
+        Get a view of an asset's data and its index entry, or None if there
+        is no asset of the given type for the source file, or the source file
+        has changed or no longer exists.
+        """
+        entry = self._assets.get(_get_key(self._root_directory, source_path))
+        if entry is None or entry['type'] != asset_type:
+            return None
+        try:
+            source_stat = os.stat(source_path)
+        except OSError:
+            return None
+        if (source_stat.st_size != entry['source_size']
+                or source_stat.st_mtime_ns != entry['source_mtime']
+                or entry['offset'] + entry['length'] > len(self._data_view)):
+            return None
+        return (
+            self._data_view[entry['offset']:entry['offset'] + entry['length']],
+            entry
+        )
+
+
+def open_asset_pack(path: str = ASSET_PACK_PATH) -> Optional[AssetPack]:
+    """
+    Open an asset pack, or get None if it doesn't exist or isn't valid.
+    """
+    try:
+        return AssetPack(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+def _get_key(root_directory: str, source_path: str) -> str:
+    """
+    Get the name of a source file's asset, which is its path relative to the
+    pack's directory with forward slashes on every platform.
+    """
+    return os.path.relpath(
+        os.path.abspath(source_path), root_directory
+    ).replace(os.sep, "/")
+
+
+def _align(size: int) -> int:
+    """
+    Round a size in bytes up to the next multiple of _ALIGNMENT.
+    """
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _padding(size: int) -> bytes:
+    """
+    Get the zero bytes needed after a section of the given size to align the
+    next section.
+    """
+    return bytes(_align(size) - size)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print(
+            "Usage: asset_pack.py [output path]\n"
+            + "Decodes every texture and sound used by the game into a single"
+            + f" asset pack, saved to {ASSET_PACK_PATH} by default. Should be"
+            + " run again after adding textures or sounds, as new files are"
+            + " only loaded from the pack once it has been rebuilt."
+        )
+        sys.exit(1)
+    pygame.init()
+    if pygame.mixer.get_init() is None:
+        print("Mixer could not be initialised, sounds will not be included")
+    print(f"Saved {build_asset_pack(*sys.argv[1:])} assets")
@@ -0,0 +1,463 @@
+"""
+Contains the class definition for ChunkedLevel, a CompactLevel that splits its
+flag and texture arrays into square chunks, each only created from the
+level's wall and collision maps when a tile inside it is first accessed.
+"""
+from array import array
+from dataclasses import dataclass
+from typing import (
+    Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+)
+
+from compact_level import (
+    CompactLevel, MONSTER_COLLIDE_FLAG, PLAYER_COLLIDE_FLAG, PLAYER_WALL_FLAG,
+    WALL_FLAG
+)
+from level import (
+    decode_collision_row, decode_run_length_row, get_json_format_version,
+    MONSTER_COLLIDE, PLAYER_COLLIDE, PRESENCE
+)
+
+# Chunks are CHUNK_SIZE×CHUNK_SIZE tiles
+CHUNK_SHIFT = 6
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+# The face textures of unmodified chunks more than this many chunks away (in
+# either axis) from every kept coordinate are freed by evict_distant_chunks.
+CHUNK_KEEP_DISTANCE = 3
+
+
+@dataclass
+class Chunk:
+    """
+    The tile flags and face texture ids for one square of a ChunkedLevel, in
+    the same format as the arrays of a CompactLevel, but indexed by
+    (local_y * CHUNK_SIZE + local_x). Chunks on the right and bottom edges
+    of a level still have space for every tile, with those outside the level
+    left empty. modified is True once any tile has been changed, as the
+    chunk can then no longer be recreated from the level's maps.
+    """
+    tile_flags: bytearray
+    face_textures: array
+    modified: bool = False
+
+
+class ChunkedCollisionGrid:
+    """
+    A flat collision grid in the same layout as those created by
+    Level.get_collision_grid, which reads each tile from the chunks of a
+    ChunkedLevel instead of holding a copy. Only tile flags are read, so
+    chunks are only loaded the first time any of their tiles is read, and
+    never again after evict_distant_chunks frees their face textures.
+    """
+    def __init__(self, chunked_level: 'ChunkedLevel', flags: int) -> None:
+        self.level = chunked_level
+        # Tiles with any of these flags set are collided with
+        self.flags = flags
+
+    def __len__(self) -> int:
+        return self.level.dimensions[0] * self.level.dimensions[1]
+
+    def __getitem__(self, index: int) -> int:
+        width = self.level.dimensions[0]
+        return int(bool(
+            self.level.get_tile_flags((index % width, index // width))
+            & self.flags
+        ))
+
+    def __setitem__(self, index: int, value: int) -> None:
+        # Nothing needs to be stored, as the level has already stored the
+        # change in its chunks before updating its collision grids.
+        pass
+
+
+class LazyRows(Sequence[List[Any]]):
+    """
+    The rows of an encoded map, such as from a version 2 level JSON
+    dictionary, with each row only being decoded when it is accessed, and
+    never kept. This lets a ChunkedLevel load chunks from an encoded map
+    without the whole map ever being decoded at once.
+    """
+    def __init__(self, row_count: int,
+                 decode_row: Callable[[int], List[Any]]) -> None:
+        self.row_count = row_count
+        self.decode_row = decode_row
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [
+                self.decode_row(x)
+                for x in range(*index.indices(self.row_count))
+            ]
+        if not -self.row_count <= index < self.row_count:
+            raise IndexError("Row index out of range")
+        return self.decode_row(index % self.row_count)
+
+
+class ChunkedLevel(CompactLevel):
+    """
+    A Level with the same interface as its parent classes, but with the wall
+    and collision maps only converted to compact flag and texture arrays one
+    CHUNK_SIZE×CHUNK_SIZE chunk at a time, as each chunk is first accessed.
+    This makes loading a very large level take time proportional to its
+    height rather than its size, and lets evict_distant_chunks free the face
+    textures of chunks that are far from every player, which are loaded
+    again when next drawn. The tile flags of a chunk are kept once it has
+    been loaded (one byte per tile), so collision, visibility, path finding,
+    and the map never cause a chunk to be converted more than once.
+    The maps given to __init__ (or set as wall_map and collision_map) are
+    kept as the source to load chunks from and are never modified, so must
+    not be changed elsewhere. Setting either map discards every loaded chunk,
+    including any changes made to them.
+    Collision grids from get_collision_grid read from the chunks directly,
+    rather than being copied into a bytearray.
+    """
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        # Every loaded chunk, keyed by (chunk_y * chunks per row + chunk_x)
+        self._chunks: Dict[int, Chunk] = {}
+        # The tile flags of chunks freed by evict_distant_chunks, by the same
+        # keys. Never changed, as changed chunks are never freed.
+        self._evicted_flags: Dict[int, bytearray] = {}
+        # Keys of loaded chunks shared with a forked level, which are copied
+        # before they are changed.
+        self._shared_chunks: Set[int] = set()
+        self._chunks_per_row = 0
+        self._wall_source: Sequence[Sequence[Any]] = []
+        self._collision_source: Sequence[Sequence[Sequence[bool]]] = []
+        # The chunks containing the kept coordinates in the last call to
+        # evict_distant_chunks
+        self._last_kept_chunks: Set[Tuple[int, int]] = set()
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def from_json_dict(cls, json_dict: Dict[str, Any]) -> 'ChunkedLevel':
+        """
+        Create a ChunkedLevel instance from a valid deserialized JSON
+        dictionary, keeping its maps to load chunks from.
+        """
+        # CompactLevel's version converts the whole level at once
+        return super(CompactLevel, cls).from_json_dict(  # type: ignore
+            json_dict
+        )
+
+    @classmethod
+    def _maps_from_json(cls, json_dict: Dict[str, Any]) -> Tuple[
+            Sequence[Sequence[Any]], Sequence[Sequence[Any]]]:
+        """
+        Use the wall and collision maps in a deserialized JSON dictionary
+        without converting them, as each chunk is converted when it is
+        loaded. Version 2 rows are expanded as they are read.
+        """
+        if get_json_format_version(json_dict) == 1:
+            return json_dict['wall_map'], json_dict['collision_map']
+        wall_map = json_dict['wall_map']
+        collision_map = json_dict['collision_map']
+        wall_palette = json_dict['wall_palette']
+        return (
+            LazyRows(
+                len(wall_map),
+                lambda y: decode_run_length_row(wall_map[y], wall_palette)
+            ),
+            LazyRows(
+                len(collision_map),
+                lambda y: decode_collision_row(collision_map[y], wall_map[y])
+            )
+        )
+
+    @property
+    def wall_map(self) -> List[List[
+            Optional[Union[Tuple[str, str, str, str], bool]]]]:
+        """
+        A nested list copy of the wall map in the same format used by Level.
+        Every chunk is loaded to create it.
+        """
+        return [
+            [self[(x, y), PRESENCE] for x in range(self.dimensions[0])]
+            for y in range(self.dimensions[1])
+        ]
+
+    @wall_map.setter
+    def wall_map(self, wall_map: Sequence[Sequence[Any]]) -> None:
+        self._wall_source = wall_map
+        self._discard_chunks()
+
+    @property
+    def collision_map(self) -> List[List[Tuple[bool, bool]]]:
+        """
+        A nested list copy of the collision map in the same format used by
+        Level. Every chunk is loaded to create it.
+        """
+        return [
+            [
+                (self[(x, y), PLAYER_COLLIDE], self[(x, y), MONSTER_COLLIDE])
+                for x in range(self.dimensions[0])
+            ]
+            for y in range(self.dimensions[1])
+        ]
+
+    @collision_map.setter
+    def collision_map(self, collision_map: Sequence[Sequence[Sequence[bool]]]
+                      ) -> None:
+        self._collision_source = collision_map
+        self._discard_chunks()
+
+    def __getitem__(self, index: Tuple[Tuple[float, float], int]
+                    ) -> Optional[Union[Tuple[str, str, str, str], bool]]:
+        """
+        Check for either the PRESENCE of a wall, or whether the player should
+        collide (PLAYER_COLLIDE), or whether the monster should collide
+        (MONSTER_COLLIDE). Returns values identically to Level.
+        """
+        flags = self.get_tile_flags(index[0])
+        if index[1] == PRESENCE:
+            if flags & PLAYER_WALL_FLAG:
+                return True
+            if not flags & WALL_FLAG:
+                return None
+            chunk, tile_index = self.get_chunk_tile(index[0])
+            face_index = tile_index * 4
+            palette = self.texture_palette
+            face_textures = chunk.face_textures
+            return (
+                palette[face_textures[face_index]],
+                palette[face_textures[face_index + 1]],
+                palette[face_textures[face_index + 2]],
+                palette[face_textures[face_index + 3]]
+            )
+        if index[1] == PLAYER_COLLIDE:
+            return bool(flags & PLAYER_COLLIDE_FLAG)
+        if index[1] == MONSTER_COLLIDE:
+            return bool(flags & MONSTER_COLLIDE_FLAG)
+        return None
+
+    def is_wall(self, coord: Tuple[float, float]) -> bool:
+        """
+        Check whether there is a wall (including a player placed one) at the
+        specified coordinates, reading only the tile flags.
+        """
+        return bool(
+            self.get_tile_flags(coord) & (WALL_FLAG | PLAYER_WALL_FLAG)
+        )
+
+    def get_face_texture_id(self, coord: Tuple[int, int], side: int) -> int:
+        """
+        Get the palette id of the texture on one side of the wall at the
+        specified coordinates, or -1 if there is no wall there with textures,
+        reading only the chunk containing it.
+        """
+        if (self.get_tile_flags(coord) & (WALL_FLAG | PLAYER_WALL_FLAG)
+                != WALL_FLAG):
+            return -1
+        chunk, tile_index = self.get_chunk_tile(coord)
+        return chunk.face_textures[tile_index * 4 + side]
+
+    def get_tile_flags(self, coord: Tuple[float, float]) -> int:
+        """
+        Get the bit flags of the tile at the specified coordinates, only
+        loading the chunk containing it if it has never been loaded.
+        """
+        x = coord[0].__trunc__()
+        y = coord[1].__trunc__()
+        chunk_key = (
+            (y >> CHUNK_SHIFT) * self._chunks_per_row + (x >> CHUNK_SHIFT)
+        )
+        chunk = self._chunks.get(chunk_key)
+        if chunk is not None:
+            tile_flags = chunk.tile_flags
+        else:
+            evicted_flags = self._evicted_flags.get(chunk_key)
+            tile_flags = (
+                self._load_chunk(chunk_key).tile_flags
+                if evicted_flags is None else evicted_flags
+            )
+        return tile_flags[(y & CHUNK_MASK) << CHUNK_SHIFT | (x & CHUNK_MASK)]
+
+    def get_chunk_tile(self, coord: Tuple[float, float]) -> Tuple[Chunk, int]:
+        """
+        Get the chunk containing the specified coordinates, loading it if
+        it isn't loaded or has been freed, along with the index of the tile
+        within that chunk.
+        """
+        x = coord[0].__trunc__()
+        y = coord[1].__trunc__()
+        chunk_key = (
+            (y >> CHUNK_SHIFT) * self._chunks_per_row + (x >> CHUNK_SHIFT)
+        )
+        chunk = self._chunks.get(chunk_key)
+        if chunk is None:
+            chunk = self._load_chunk(chunk_key)
+        return chunk, (y & CHUNK_MASK) << CHUNK_SHIFT | (x & CHUNK_MASK)
+
+    def get_loaded_chunk_count(self) -> int:
+        """
+        Get the number of chunks currently held in memory with their face
+        textures.
+        """
+        return len(self._chunks)
+
+    def evict_distant_chunks(self, keep_coords: Iterable[Tuple[float, float]],
+                             keep_distance: int = CHUNK_KEEP_DISTANCE
+                             ) -> int:
+        """
+        Free the face textures of every chunk more than keep_distance chunks
+        away (in either axis) from all of the given coordinates, returning
+        how many chunks were freed. Their tile flags are kept, as collision
+        grids and the other caches derived from the level read them from
+        anywhere in the level. Chunks that have been changed are always kept
+        whole, as they can't be loaded again from the level's maps. Loaded
+        chunks are only checked when a coordinate has moved into a different
+        chunk since the last call, so this is cheap enough to call every
+        frame.
+        """
+        kept_chunks = {
+            (x[0].__trunc__() >> CHUNK_SHIFT, x[1].__trunc__() >> CHUNK_SHIFT)
+            for x in keep_coords
+        }
+        if kept_chunks == self._last_kept_chunks:
+            return 0
+        self._last_kept_chunks = kept_chunks
+        evicted = 0
+        for chunk_key, chunk in list(self._chunks.items()):
+            if chunk.modified:
+                continue
+            chunk_x = chunk_key % self._chunks_per_row
+            chunk_y = chunk_key // self._chunks_per_row
+            if all(abs(chunk_x - x) > keep_distance
+                   or abs(chunk_y - y) > keep_distance
+                   for x, y in kept_chunks):
+                del self._chunks[chunk_key]
+                self._evicted_flags[chunk_key] = chunk.tile_flags
+                evicted += 1
+        return evicted
+
+    def _load_chunk(self, chunk_key: int) -> Chunk:
+        """
+        Convert the part of the wall and collision maps covered by a chunk to
+        flag and texture arrays, storing and returning the new chunk.
+        """
+        start_x = (chunk_key % self._chunks_per_row) << CHUNK_SHIFT
+        start_y = (chunk_key // self._chunks_per_row) << CHUNK_SHIFT
+        end_x = min(start_x + CHUNK_SIZE, self.dimensions[0])
+        tile_flags = bytearray(CHUNK_SIZE * CHUNK_SIZE)
+        face_textures = array(
+            'B' if len(self.texture_palette) <= 0x100 else 'H',
+            bytes(CHUNK_SIZE * CHUNK_SIZE * 4)
+        )
+        for local_y, (wall_row, collision_row) in enumerate(zip(
+                self._wall_source[start_y:start_y + CHUNK_SIZE],
+                self._collision_source[start_y:start_y + CHUNK_SIZE])):
+            tile_index = local_y << CHUNK_SHIFT
+            for wall, collision in zip(wall_row[start_x:end_x],
+                                       collision_row[start_x:end_x]):
+                flags = 0
+                if wall is True:
+                    flags = PLAYER_WALL_FLAG
+                elif wall is not None and wall is not False:
+                    flags = WALL_FLAG
+                    for side, texture_name in enumerate(wall):
+                        texture_id = self.get_texture_id(texture_name)
+                        if (texture_id > 0xFF
+                                and face_textures.typecode == 'B'):
+                            # Palette has outgrown single byte ids
+                            face_textures = array('H', face_textures)
+                        face_textures[tile_index * 4 + side] = texture_id
+                if collision[0]:
+                    flags |= PLAYER_COLLIDE_FLAG
+                if collision[1]:
+                    flags |= MONSTER_COLLIDE_FLAG
+                tile_flags[tile_index] = flags
+                tile_index += 1
+        chunk = Chunk(tile_flags, face_textures)
+        self._chunks[chunk_key] = chunk
+        # Both arrays are new, so no longer shared with a forked level
+        self._evicted_flags.pop(chunk_key, None)
+        self._shared_chunks.discard(chunk_key)
+        return chunk
+
+    def _discard_chunks(self) -> None:
+        """
+        Remove every loaded chunk, so that they are loaded again from the
+        current wall and collision maps.
+        """
+        self._chunks = {}
+        self._evicted_flags = {}
+        self._shared_chunks = set()
+        self._last_kept_chunks = set()
+        self._chunks_per_row = (
+            (self.dimensions[0] + CHUNK_MASK) >> CHUNK_SHIFT
+        )
+
+    def _build_collision_grid(self, index_type: int) -> ChunkedCollisionGrid:
+        """
+        Create a collision grid that reads from the chunks of this level.
+        """
+        return ChunkedCollisionGrid(self, {
+            PRESENCE: WALL_FLAG | PLAYER_WALL_FLAG,
+            PLAYER_COLLIDE: PLAYER_COLLIDE_FLAG,
+            MONSTER_COLLIDE: MONSTER_COLLIDE_FLAG
+        }[index_type])
+
+    def _store_tile(self, coord: Tuple[int, int], index_type: int,
+                    value: Optional[Union[Tuple[str, str, str, str], bool]]
+                    ) -> None:
+        """
+        Write a single wall or collision entry into the flag and texture
+        arrays of the chunk containing it.
+        """
+        chunk, tile_index = self.get_chunk_tile(coord)
+        chunk_key = (
+            (coord[1] >> CHUNK_SHIFT) * self._chunks_per_row
+            + (coord[0] >> CHUNK_SHIFT)
+        )
+        if chunk_key in self._shared_chunks:
+            # Copy on write, so that levels created by fork are unaffected
+            chunk = Chunk(
+                bytearray(chunk.tile_flags),
+                array(chunk.face_textures.typecode, chunk.face_textures)
+            )
+            self._chunks[chunk_key] = chunk
+            self._shared_chunks.discard(chunk_key)
+        chunk.modified = True
+        flags = chunk.tile_flags[tile_index]
+        if index_type == PRESENCE:
+            flags &= ~(WALL_FLAG | PLAYER_WALL_FLAG)
+            if value is True:
+                flags |= PLAYER_WALL_FLAG
+            elif value is not None and value is not False:
+                flags |= WALL_FLAG
+                for side, texture_name in enumerate(value):
+                    texture_id = self.get_texture_id(texture_name)
+                    if (texture_id > 0xFF
+                            and chunk.face_textures.typecode == 'B'):
+                        # Palette has outgrown single byte ids
+                        chunk.face_textures = array(
+                            'H', chunk.face_textures
+                        )
+                    chunk.face_textures[tile_index * 4 + side] = texture_id
+        elif index_type == PLAYER_COLLIDE:
+            flags = (
+                flags | PLAYER_COLLIDE_FLAG
+                if value else
+                flags & ~PLAYER_COLLIDE_FLAG
+            )
+        elif index_type == MONSTER_COLLIDE:
+            flags = (
+                flags | MONSTER_COLLIDE_FLAG
+                if value else
+                flags & ~MONSTER_COLLIDE_FLAG
+            )
+        chunk.tile_flags[tile_index] = flags
+
+    def _share_geometry(self) -> None:
+        """
+        Give this level its own set of loaded chunks, marking every one as
+        shared with a forked level, so that each is copied the first time
+        either level changes it. The source maps are never changed, and the
+        texture palette is only ever added to, so both can always be shared.
+        """
+        self._chunks = dict(self._chunks)
+        self._evicted_flags = dict(self._evicted_flags)
+        self._shared_chunks = set(self._chunks)
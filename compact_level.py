@@ -0,0 +1,372 @@
+"""
+Contains the class definition for CompactLevel, a Level that stores its wall
+and collision maps as flat arrays of bit flags and interned texture ids instead
+of nested lists of tuples.
+"""
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from level import (
+    get_json_format_version, Level, MONSTER_COLLIDE, PLAYER_COLLIDE, PRESENCE
+)
+
+# Bit flags stored for each tile in CompactLevel.tile_flags
+WALL_FLAG = 1
+PLAYER_WALL_FLAG = 2
+PLAYER_COLLIDE_FLAG = 4
+MONSTER_COLLIDE_FLAG = 8
+
+
+class CompactLevel(Level):
+    """
+    A Level with the same interface as its parent class, but with the wall and
+    collision maps held in flat arrays indexed by (y * width + x).
+    tile_flags holds one byte of bit flags per tile for wall presence, player
+    placed walls, and player/monster collision. face_textures holds four ids
+    per tile for the north, east, south, and west wall textures, each being an
+    index into texture_palette. This makes a 1000×1000 level take up around
+    5 MB rather than hundreds, and lets performance sensitive code such as the
+    raycaster read the arrays directly.
+    wall_map and collision_map are still available as attributes, but are
+    rebuilt as new lists whenever they are accessed, so modifying them will
+    not affect the level. Use __setitem__ to make changes instead.
+    """
+    tile_flags: bytearray
+    face_textures: array
+    texture_palette: List[str]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.tile_flags = bytearray()
+        self.face_textures = array('B')
+        self.texture_palette = []
+        self._texture_ids: Dict[str, int] = {}
+        # True if the arrays are shared with a forked level, and so must be
+        # copied before they are changed.
+        self._arrays_shared = False
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def from_arrays(cls, dimensions: Tuple[int, int], tile_flags: bytearray,
+                    face_textures: array, texture_palette: List[str],
+                    start_point: Tuple[int, int], end_point: Tuple[int, int],
+                    exit_keys: Set[Tuple[int, int]],
+                    key_sensors: Set[Tuple[int, int]],
+                    guns: Set[Tuple[int, int]],
+                    decorations: Dict[Tuple[int, int], str],
+                    monster: Optional[Tuple[int, int, float]],
+                    edge_wall_texture_name: str) -> 'CompactLevel':
+        """
+        Create a CompactLevel directly from already built flag and texture
+        arrays, in the same format as the attributes of the same name,
+        without ever creating nested lists. The arrays are used as given,
+        not copied. They may also be read only memoryviews (such as of a
+        memory mapped level pack), which are copied into new arrays the first
+        time a tile is changed. All other arguments are the same as for
+        Level.
+        """
+        tile_count = dimensions[0] * dimensions[1]
+        if (len(tile_flags) != tile_count
+                or len(face_textures) != tile_count * 4):
+            raise ValueError(
+                f"Arrays must be for {dimensions[0]}x{dimensions[1]} points"
+            )
+        new_level = cls.__new__(cls)
+        new_level.dimensions = dimensions
+        new_level.edge_wall_texture_name = edge_wall_texture_name
+        new_level.tile_flags = tile_flags
+        new_level.face_textures = face_textures
+        new_level.texture_palette = texture_palette
+        new_level._texture_ids = {
+            x: i for i, x in enumerate(texture_palette)
+        }
+        # Memoryviews are treated as shared so they are never written to
+        new_level._arrays_shared = (
+            isinstance(tile_flags, memoryview)
+            or isinstance(face_textures, memoryview)
+        )
+        new_level._initialise_contents(
+            start_point, end_point, exit_keys, key_sensors, guns,
+            decorations, monster
+        )
+        return new_level
+
+    @classmethod
+    def from_json_dict(cls, json_dict: Dict[str, Any]) -> 'CompactLevel':
+        """
+        Create a CompactLevel instance from a valid deserialized JSON
+        dictionary. Version 2 dictionaries are converted straight to the flag
+        and texture arrays a whole run of tiles at a time, without creating
+        nested lists.
+        """
+        if get_json_format_version(json_dict) == 1:
+            return super().from_json_dict(json_dict)  # type: ignore
+        width, height = json_dict['dimensions']
+        wall_palette = json_dict['wall_palette']
+        texture_palette = list(dict.fromkeys(
+            x for wall in wall_palette for x in wall
+        ))
+        texture_ids = {x: i for i, x in enumerate(texture_palette)}
+        typecode = 'B' if len(texture_palette) <= 0x100 else 'H'
+        # The flags and face texture bytes for each wall palette index
+        wall_flags = {None: b"\x00"}
+        wall_faces = {None: bytes(array(typecode, (0, 0, 0, 0)))}
+        for index, wall in enumerate(wall_palette):
+            wall_flags[index] = bytes([WALL_FLAG])
+            wall_faces[index] = bytes(
+                array(typecode, (texture_ids[x] for x in wall))
+            )
+        if (len(json_dict['wall_map']) != height
+                or len(json_dict['collision_map']) != height
+                or any(sum(x[1::2]) != width for x in json_dict['wall_map'])
+                or any(x is not None and sum(x[1::2]) != width
+                       for x in json_dict['collision_map'])):
+            raise ValueError(f"Maps must be {width}x{height} points")
+        wall_runs = [
+            (x[i], x[i + 1]) for x in json_dict['wall_map']
+            for i in range(0, len(x), 2)
+        ]
+        wall_tile_flags = b"".join(
+            wall_flags[x] * count for x, count in wall_runs
+        )
+        collision_runs: List[Tuple[int, int]] = []
+        for collision_row, wall_row in zip(json_dict['collision_map'],
+                                           json_dict['wall_map']):
+            if collision_row is None:
+                # Both collide with exactly the walls in the same row
+                collision_runs += [
+                    (0 if wall_row[i] is None else 3, wall_row[i + 1])
+                    for i in range(0, len(wall_row), 2)
+                ]
+            else:
+                collision_runs += [
+                    (collision_row[i], collision_row[i + 1])
+                    for i in range(0, len(collision_row), 2)
+                ]
+        # Collision values are the player and monster collide bits, so they
+        # only need shifting to line up with the tile flags.
+        collision_flags = b"".join(
+            bytes([x * PLAYER_COLLIDE_FLAG]) * count
+            for x, count in collision_runs
+        )
+        tile_flags = bytearray((
+            int.from_bytes(wall_tile_flags, "little")
+            | int.from_bytes(collision_flags, "little")
+        ).to_bytes(width * height, "little"))
+        face_textures = array(typecode)
+        face_textures.frombytes(b"".join(
+            wall_faces[x] * count for x, count in wall_runs
+        ))
+        new_level = cls.from_arrays(
+            (width, height), tile_flags, face_textures, texture_palette,
+            *cls.contents_from_json_dict(json_dict),
+            json_dict['edge_wall_texture_name']
+        )
+        for monster_start in json_dict.get('extra_monster_starts', []):
+            new_level.add_monster(tuple(monster_start))
+        return new_level
+
+    @property
+    def wall_map(self) -> List[List[
+            Optional[Union[Tuple[str, str, str, str], bool]]]]:
+        """
+        A nested list copy of the wall map in the same format used by Level.
+        """
+        return [
+            [self[(x, y), PRESENCE] for x in range(self.dimensions[0])]
+            for y in range(self.dimensions[1])
+        ]
+
+    @wall_map.setter
+    def wall_map(self, wall_map: List[List[
+            Optional[Union[Tuple[str, str, str, str], bool]]]]) -> None:
+        self._resize_arrays()
+        for y, row in enumerate(wall_map):
+            for x, point in enumerate(row):
+                self._store_tile((x, y), PRESENCE, point)
+
+    @property
+    def collision_map(self) -> List[List[Tuple[bool, bool]]]:
+        """
+        A nested list copy of the collision map in the same format used by
+        Level.
+        """
+        width = self.dimensions[0]
+        return [
+            [
+                (
+                    bool(flags & PLAYER_COLLIDE_FLAG),
+                    bool(flags & MONSTER_COLLIDE_FLAG)
+                )
+                for flags in self.tile_flags[y * width:(y + 1) * width]
+            ]
+            for y in range(self.dimensions[1])
+        ]
+
+    @collision_map.setter
+    def collision_map(self, collision_map: List[List[Tuple[bool, bool]]]
+                      ) -> None:
+        self._resize_arrays()
+        for y, row in enumerate(collision_map):
+            for x, point in enumerate(row):
+                self._store_tile((x, y), PLAYER_COLLIDE, point[0])
+                self._store_tile((x, y), MONSTER_COLLIDE, point[1])
+
+    def __getitem__(self, index: Tuple[Tuple[float, float], int]
+                    ) -> Optional[Union[Tuple[str, str, str, str], bool]]:
+        """
+        Check for either the PRESENCE of a wall, or whether the player should
+        collide (PLAYER_COLLIDE), or whether the monster should collide
+        (MONSTER_COLLIDE). Returns values identically to Level.
+        """
+        tile_index = (
+            index[0][1].__trunc__() * self.dimensions[0]
+            + index[0][0].__trunc__()
+        )
+        flags = self.tile_flags[tile_index]
+        if index[1] == PRESENCE:
+            if flags & PLAYER_WALL_FLAG:
+                return True
+            if not flags & WALL_FLAG:
+                return None
+            face_index = tile_index * 4
+            palette = self.texture_palette
+            face_textures = self.face_textures
+            return (
+                palette[face_textures[face_index]],
+                palette[face_textures[face_index + 1]],
+                palette[face_textures[face_index + 2]],
+                palette[face_textures[face_index + 3]]
+            )
+        if index[1] == PLAYER_COLLIDE:
+            return bool(flags & PLAYER_COLLIDE_FLAG)
+        if index[1] == MONSTER_COLLIDE:
+            return bool(flags & MONSTER_COLLIDE_FLAG)
+        return None
+
+    def is_wall(self, coord: Tuple[float, float]) -> bool:
+        """
+        Check whether there is a wall (including a player placed one) at the
+        specified coordinates, reading only the tile flags.
+        """
+        return bool(self.tile_flags[
+            coord[1].__trunc__() * self.dimensions[0] + coord[0].__trunc__()
+        ] & (WALL_FLAG | PLAYER_WALL_FLAG))
+
+    def get_face_texture_id(self, coord: Tuple[int, int], side: int) -> int:
+        """
+        Get the palette id of the texture on one side (0 to 3, in the same
+        north, east, south, west order as wall tuples) of the wall at the
+        specified coordinates, or -1 if there is no wall there with textures,
+        such as a player placed wall.
+        """
+        tile_index = coord[1] * self.dimensions[0] + coord[0]
+        if (self.tile_flags[tile_index] & (WALL_FLAG | PLAYER_WALL_FLAG)
+                != WALL_FLAG):
+            return -1
+        return self.face_textures[tile_index * 4 + side]
+
+    def get_wall_texture_names(self) -> Set[str]:
+        """
+        Get the name of every texture in the texture palette, along with the
+        edge wall texture. The palette is never shrunk, so may include
+        textures that walls no longer use.
+        """
+        return {self.edge_wall_texture_name, *self.texture_palette}
+
+    def _build_collision_grid(self, index_type: int) -> bytearray:
+        """
+        Create a new flat collision grid by translating every tile's flags at
+        once, rather than checking each tile individually.
+        """
+        flag = {
+            PRESENCE: WALL_FLAG | PLAYER_WALL_FLAG,
+            PLAYER_COLLIDE: PLAYER_COLLIDE_FLAG,
+            MONSTER_COLLIDE: MONSTER_COLLIDE_FLAG
+        }[index_type]
+        return bytearray(self.tile_flags).translate(
+            bytes(int(bool(x & flag)) for x in range(256))
+        )
+
+    def get_texture_id(self, texture_name: str) -> int:
+        """
+        Get the palette id of a texture name, adding it to the palette if it
+        isn't already present.
+        """
+        texture_id = self._texture_ids.get(texture_name)
+        if texture_id is None:
+            texture_id = len(self.texture_palette)
+            self.texture_palette.append(texture_name)
+            self._texture_ids[texture_name] = texture_id
+            if (texture_id > 0xFF
+                    and self.face_textures.typecode == 'B'):
+                # Palette has outgrown single byte ids
+                self.face_textures = array('H', self.face_textures)
+        return texture_id
+
+    def _store_tile(self, coord: Tuple[int, int], index_type: int,
+                    value: Optional[Union[Tuple[str, str, str, str], bool]]
+                    ) -> None:
+        """
+        Write a single wall or collision entry into the flag and texture
+        arrays.
+        """
+        if self._arrays_shared:
+            # Copy on write, so that levels created by fork are unaffected
+            self.tile_flags = bytearray(self.tile_flags)
+            face_textures = array(
+                'B' if self.face_textures.itemsize == 1 else 'H'
+            )
+            face_textures.frombytes(
+                memoryview(self.face_textures).cast('B')
+            )
+            self.face_textures = face_textures
+            self.texture_palette = list(self.texture_palette)
+            self._texture_ids = dict(self._texture_ids)
+            self._arrays_shared = False
+        tile_index = coord[1] * self.dimensions[0] + coord[0]
+        flags = self.tile_flags[tile_index]
+        if index_type == PRESENCE:
+            flags &= ~(WALL_FLAG | PLAYER_WALL_FLAG)
+            if value is True:
+                flags |= PLAYER_WALL_FLAG
+            elif value is not None and value is not False:
+                flags |= WALL_FLAG
+                for side, texture_name in enumerate(value):
+                    self.face_textures[tile_index * 4 + side] = (
+                        self.get_texture_id(texture_name)
+                    )
+        elif index_type == PLAYER_COLLIDE:
+            flags = (
+                flags | PLAYER_COLLIDE_FLAG
+                if value else
+                flags & ~PLAYER_COLLIDE_FLAG
+            )
+        elif index_type == MONSTER_COLLIDE:
+            flags = (
+                flags | MONSTER_COLLIDE_FLAG
+                if value else
+                flags & ~MONSTER_COLLIDE_FLAG
+            )
+        self.tile_flags[tile_index] = flags
+
+    def _share_geometry(self) -> None:
+        """
+        Mark the flag and texture arrays as shared with a forked level. As
+        they are flat, they are copied whole (which is little more than a
+        memory copy) the first time either level changes a tile.
+        """
+        self._arrays_shared = True
+
+    def _resize_arrays(self) -> None:
+        """
+        Make sure the flag and texture arrays match the level dimensions,
+        keeping existing values if they already do.
+        """
+        tile_count = self.dimensions[0] * self.dimensions[1]
+        if len(self.tile_flags) != tile_count:
+            self.tile_flags = bytearray(tile_count)
+            self.face_textures = array(
+                self.face_textures.typecode, bytes(
+                    tile_count * 4 * self.face_textures.itemsize
+                )
+            )
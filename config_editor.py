@@ -590,6 +590,20 @@ class ConfigEditorApp:
         )
         self.gui_draw_maze_edge_check.pack(fill="x", anchor=tkinter.NW)
 
+        self.checkbuttons['USE_SPAN_TRACER'] = tkinter.IntVar()
+        self.gui_use_span_tracer_check = tkinter.Checkbutton(
+            self.gui_advanced_config_frame, anchor=tkinter.W,
+            variable=self.checkbuttons['USE_SPAN_TRACER'],
+            text="Trace visible wall faces instead of casting a ray per column"
+        )
+        if self.parse_bool('USE_SPAN_TRACER', False):
+            self.gui_use_span_tracer_check.select()
+        # Set command after select to prevent it from being called
+        self.gui_use_span_tracer_check.config(
+            command=lambda: self.on_checkbutton_click('USE_SPAN_TRACER')
+        )
+        self.gui_use_span_tracer_check.pack(fill="x", anchor=tkinter.NW)
+
         self.checkbuttons['ENABLE_COLLISION'] = tkinter.IntVar()
         self.gui_enable_collision_check = tkinter.Checkbutton(
             self.gui_advanced_config_frame, anchor=tkinter.W,
@@ -0,0 +1,398 @@
+"""
+Contains the HierarchicalPathfinder class, which finds paths through very
+large levels by searching a small graph of the entrances between square
+clusters of tiles (HPA*), rather than searching every tile.
+"""
+import heapq
+import math
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+DEFAULT_CLUSTER_SIZE = 16
+# Entrances at least this many tiles wide get a transition at each end,
+# narrower ones get a single transition in their middle.
+WIDE_ENTRANCE_LENGTH = 6
+# Levels with at most this many tiles are searched exactly, tile by tile, as
+# searching the whole level is no slower than searching the abstract graph.
+EXACT_SEARCH_TILES = 4096
+
+
+class HierarchicalPathfinder:
+    """
+    Splits a collision grid (as created by Level.get_collision_grid) into
+    square clusters, and finds the transitions between open tiles either side
+    of each cluster border. The tiles of these transitions are the nodes of
+    an abstract graph, connected to each other by the distances between them
+    within each cluster. Queries search the abstract graph, then refine each
+    step of the abstract path with a search limited to a single cluster, so
+    their cost depends on the number of clusters crossed rather than the
+    number of tiles in the level. Each section of the path through a pair of
+    neighbouring clusters is then searched again across both clusters,
+    removing most of the detours this causes. Paths through generated mazes
+    are then almost always the shortest possible, but in wide open areas
+    they may be up to around a fifth longer. Levels of at most
+    EXACT_SEARCH_TILES tiles are searched exactly instead.
+    Distances within a cluster are only calculated when a query first needs
+    them. The collision grid is held by reference, so update_tile must be
+    called whenever a tile in it changes, which will only recalculate the
+    cluster containing the tile and the borders it lies on.
+    """
+    def __init__(self, collision_grid: Sequence[int],
+                 dimensions: Tuple[int, int],
+                 cluster_size: int = DEFAULT_CLUSTER_SIZE) -> None:
+        self.collision_grid = collision_grid
+        self.dimensions = dimensions
+        self.cluster_size = cluster_size
+        self.cluster_dimensions = (
+            math.ceil(dimensions[0] / cluster_size),
+            math.ceil(dimensions[1] / cluster_size)
+        )
+        # Maps each pair of neighbouring clusters (in ascending order) to the
+        # pairs of tiles either side of their border that can be moved
+        # between.
+        self._transitions: Dict[
+            Tuple[Tuple[int, int], Tuple[int, int]],
+            List[Tuple[Tuple[int, int], Tuple[int, int]]]
+        ] = {}
+        # Maps each node to the nodes in neighbouring clusters one move away
+        self._crossings: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        self._cluster_nodes: Dict[Tuple[int, int], Set[Tuple[int, int]]] = {}
+        # Maps each cluster to the distances between each of its nodes,
+        # through the cluster only. Missing until a query needs them.
+        self._cluster_edges: Dict[
+            Tuple[int, int], Dict[Tuple[int, int], Dict[Tuple[int, int], int]]
+        ] = {}
+        for cluster_y in range(self.cluster_dimensions[1]):
+            for cluster_x in range(self.cluster_dimensions[0]):
+                if cluster_x + 1 < self.cluster_dimensions[0]:
+                    self._build_border(
+                        (cluster_x, cluster_y), (cluster_x + 1, cluster_y)
+                    )
+                if cluster_y + 1 < self.cluster_dimensions[1]:
+                    self._build_border(
+                        (cluster_x, cluster_y), (cluster_x, cluster_y + 1)
+                    )
+
+    def get_cluster(self, tile: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Get the coordinates of the cluster containing a tile.
+        """
+        return (tile[0] // self.cluster_size, tile[1] // self.cluster_size)
+
+    def find_path(self, start: Tuple[int, int], goal: Tuple[int, int]
+                  ) -> Optional[List[Tuple[int, int]]]:
+        """
+        Find a path from the start tile to the goal tile, including both, or
+        None if the goal cannot be reached.
+        """
+        width = self.dimensions[0]
+        if (self.collision_grid[start[1] * width + start[0]]
+                or self.collision_grid[goal[1] * width + goal[0]]):
+            return None
+        if start == goal:
+            return [start]
+        if self.dimensions[0] * self.dimensions[1] <= EXACT_SEARCH_TILES:
+            previous = self._bounded_search(
+                start, (0, 0), goal, (
+                    self.cluster_dimensions[0] - 1,
+                    self.cluster_dimensions[1] - 1
+                )
+            )[1]
+            return _trace_path(previous, goal) if goal in previous else None
+        start_cluster = self.get_cluster(start)
+        goal_cluster = self.get_cluster(goal)
+        start_distances, start_previous = self._bounded_search(
+            start, start_cluster
+        )
+        local_path = None
+        if start_cluster == goal_cluster and goal in start_previous:
+            local_path = _trace_path(start_previous, goal)
+        goal_distances = self._bounded_search(goal, goal_cluster)[0]
+        start_links = {
+            node: start_distances[node]
+            for node in self._cluster_nodes.get(start_cluster, ())
+            if node in start_distances
+        }
+        goal_links = {
+            node: goal_distances[node]
+            for node in self._cluster_nodes.get(goal_cluster, ())
+            if node in goal_distances
+        }
+        abstract_path = self._abstract_search(
+            start, goal, start_links, goal_links,
+            len(local_path) - 1 if local_path is not None else None
+        )
+        if abstract_path is None:
+            return local_path
+        path = [start]
+        for waypoint in abstract_path[1:]:
+            if self.get_cluster(waypoint) != self.get_cluster(path[-1]):
+                # Crossing a border, which is always a single move
+                path.append(waypoint)
+            else:
+                previous = self._bounded_search(
+                    path[-1], self.get_cluster(waypoint), waypoint
+                )[1]
+                path += _trace_path(previous, waypoint)[1:]
+        return self._refine_path(path)
+
+    def precompute(self) -> None:
+        """
+        Calculate the distances within every cluster ahead of time, so that
+        no query needs to calculate them during play.
+        """
+        for cluster_y in range(self.cluster_dimensions[1]):
+            for cluster_x in range(self.cluster_dimensions[0]):
+                self._get_cluster_edges((cluster_x, cluster_y))
+
+    def update_tile(self, tile: Tuple[int, int]) -> None:
+        """
+        Update the graph after the collision of a tile has changed. Only the
+        cluster containing the tile, along with any cluster on the other side
+        of a border the tile lies on, is affected.
+        """
+        cluster = self.get_cluster(tile)
+        self._cluster_edges.pop(cluster, None)
+        offset = (
+            tile[0] - cluster[0] * self.cluster_size,
+            tile[1] - cluster[1] * self.cluster_size
+        )
+        neighbours = []
+        if offset[0] == 0 and cluster[0] > 0:
+            neighbours.append((cluster[0] - 1, cluster[1]))
+        if (offset[0] == self.cluster_size - 1
+                and cluster[0] + 1 < self.cluster_dimensions[0]):
+            neighbours.append((cluster[0] + 1, cluster[1]))
+        if offset[1] == 0 and cluster[1] > 0:
+            neighbours.append((cluster[0], cluster[1] - 1))
+        if (offset[1] == self.cluster_size - 1
+                and cluster[1] + 1 < self.cluster_dimensions[1]):
+            neighbours.append((cluster[0], cluster[1] + 1))
+        for neighbour in neighbours:
+            self._cluster_edges.pop(neighbour, None)
+            self._build_border(
+                min(cluster, neighbour), max(cluster, neighbour)
+            )
+
+    def _abstract_search(self, start: Tuple[int, int], goal: Tuple[int, int],
+                         start_links: Dict[Tuple[int, int], int],
+                         goal_links: Dict[Tuple[int, int], int],
+                         max_distance: Optional[int]
+                         ) -> Optional[List[Tuple[int, int]]]:
+        """
+        Find the shortest path through the abstract graph from the start to
+        the goal with A*, where start_links and goal_links are the distances
+        to the nodes in the start and goal clusters. Returns the list of
+        nodes visited, or None if there is no path shorter than max_distance.
+        """
+        # Heap of (estimated total distance, distance so far, node)
+        open_nodes = [(_manhattan(start, goal), 0, start)]
+        best_distances = {start: 0}
+        previous: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        while open_nodes:
+            _, distance, node = heapq.heappop(open_nodes)
+            if node == goal:
+                return _trace_path(previous, goal, start)
+            if distance > best_distances[node]:
+                continue
+            links: List[Tuple[Tuple[int, int], int]] = []
+            if node == start:
+                links += start_links.items()
+            if node in self._crossings:
+                links += [(x, 1) for x in self._crossings[node]]
+                links += self._get_cluster_edges(
+                    self.get_cluster(node)
+                )[node].items()
+            if node in goal_links:
+                links.append((goal, goal_links[node]))
+            for neighbour, link_distance in links:
+                new_distance = distance + link_distance
+                if ((max_distance is not None
+                        and new_distance >= max_distance)
+                        or new_distance >= best_distances.get(
+                            neighbour, new_distance + 1)):
+                    continue
+                best_distances[neighbour] = new_distance
+                previous[neighbour] = node
+                heapq.heappush(open_nodes, (
+                    new_distance + _manhattan(neighbour, goal),
+                    new_distance, neighbour
+                ))
+        return None
+
+    def _refine_path(self, path: List[Tuple[int, int]]
+                     ) -> List[Tuple[int, int]]:
+        """
+        Shorten a path by searching again each section of it that passes
+        through a pair of neighbouring clusters, allowing the search to use
+        both clusters rather than one. This removes the detours caused by
+        each cluster being searched alone and by only moving between clusters
+        at transitions. Sections overlap, each starting where the path
+        leaves the first cluster of the section before.
+        """
+        index = 0
+        while True:
+            first_cluster = self.get_cluster(path[index])
+            middle = index
+            while (middle < len(path)
+                    and self.get_cluster(path[middle]) == first_cluster):
+                middle += 1
+            if middle == len(path):
+                return path
+            section_clusters = (first_cluster, self.get_cluster(path[middle]))
+            end = middle
+            while (end + 1 < len(path)
+                    and self.get_cluster(path[end + 1]) in section_clusters):
+                end += 1
+            previous = self._bounded_search(
+                path[index], min(section_clusters), path[end],
+                max(section_clusters)
+            )[1]
+            section = _trace_path(previous, path[end])
+            if len(section) < end - index + 1:
+                path[index:end + 1] = section
+            while self.get_cluster(path[index]) == first_cluster:
+                index += 1
+
+    def _get_cluster_edges(self, cluster: Tuple[int, int]) -> Dict[
+            Tuple[int, int], Dict[Tuple[int, int], int]]:
+        """
+        Get the distances between each of the nodes of a cluster through the
+        cluster only, calculating them if they aren't already known.
+        """
+        edges = self._cluster_edges.get(cluster)
+        if edges is None:
+            nodes = self._cluster_nodes.get(cluster, set())
+            edges = {}
+            for node in nodes:
+                distances = self._bounded_search(node, cluster)[0]
+                edges[node] = {
+                    other: distances[other] for other in nodes
+                    if other != node and other in distances
+                }
+            self._cluster_edges[cluster] = edges
+        return edges
+
+    def _bounded_search(self, start: Tuple[int, int],
+                        cluster: Tuple[int, int],
+                        goal: Optional[Tuple[int, int]] = None,
+                        last_cluster: Optional[Tuple[int, int]] = None
+                        ) -> Tuple[Dict[Tuple[int, int], int],
+                                   Dict[Tuple[int, int], Tuple[int, int]]]:
+        """
+        Breadth first search from the start tile without leaving a cluster,
+        stopping early if the goal is given and reached. Returns the distance
+        to, and the previous tile of, every tile reached. If last_cluster is
+        given, the search is instead limited to the rectangle of clusters
+        from cluster to last_cluster.
+        """
+        if last_cluster is None:
+            last_cluster = cluster
+        width = self.dimensions[0]
+        min_x = cluster[0] * self.cluster_size
+        min_y = cluster[1] * self.cluster_size
+        max_x = min(
+            (last_cluster[0] + 1) * self.cluster_size, self.dimensions[0]
+        )
+        max_y = min(
+            (last_cluster[1] + 1) * self.cluster_size, self.dimensions[1]
+        )
+        distances = {start: 0}
+        previous: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        queue: Deque[Tuple[int, int]] = deque([start])
+        while queue:
+            tile = queue.popleft()
+            if tile == goal:
+                break
+            for neighbour in (
+                    (tile[0], tile[1] - 1), (tile[0] + 1, tile[1]),
+                    (tile[0], tile[1] + 1), (tile[0] - 1, tile[1])):
+                if (min_x <= neighbour[0] < max_x
+                        and min_y <= neighbour[1] < max_y
+                        and neighbour not in distances
+                        and not self.collision_grid[
+                            neighbour[1] * width + neighbour[0]]):
+                    distances[neighbour] = distances[tile] + 1
+                    previous[neighbour] = tile
+                    queue.append(neighbour)
+        return distances, previous
+
+    def _build_border(self, first: Tuple[int, int],
+                      second: Tuple[int, int]) -> None:
+        """
+        (Re)calculate the transitions across the border between two
+        neighbouring clusters, with first being the cluster to the west or
+        north of second.
+        """
+        for pair in self._transitions.pop((first, second), []):
+            for node, other in (pair, pair[::-1]):
+                crossings = self._crossings[node]
+                crossings.discard(other)
+                if len(crossings) == 0:
+                    del self._crossings[node]
+                    self._cluster_nodes[self.get_cluster(node)].discard(node)
+        width = self.dimensions[0]
+        if second[0] != first[0]:
+            # Vertical border, scanned from north to south
+            border_x = second[0] * self.cluster_size
+            scan_range = range(
+                first[1] * self.cluster_size,
+                min((first[1] + 1) * self.cluster_size, self.dimensions[1])
+            )
+            pairs = [
+                ((border_x - 1, y), (border_x, y)) for y in scan_range
+            ]
+        else:
+            # Horizontal border, scanned from west to east
+            border_y = second[1] * self.cluster_size
+            scan_range = range(
+                first[0] * self.cluster_size,
+                min((first[0] + 1) * self.cluster_size, self.dimensions[0])
+            )
+            pairs = [
+                ((x, border_y - 1), (x, border_y)) for x in scan_range
+            ]
+        transitions = []
+        entrance: List[Tuple[Tuple[int, int], Tuple[int, int]]] = []
+        # A None on the end closes any entrance still open on the last pair
+        for pair in pairs + [None]:
+            if pair is not None and not (
+                    self.collision_grid[pair[0][1] * width + pair[0][0]]
+                    or self.collision_grid[pair[1][1] * width + pair[1][0]]):
+                entrance.append(pair)
+                continue
+            if len(entrance) >= WIDE_ENTRANCE_LENGTH:
+                transitions += [entrance[0], entrance[-1]]
+            elif len(entrance) > 0:
+                transitions.append(entrance[len(entrance) // 2])
+            entrance = []
+        self._transitions[first, second] = transitions
+        for pair in transitions:
+            for node, other in (pair, pair[::-1]):
+                self._crossings.setdefault(node, set()).add(other)
+                self._cluster_nodes.setdefault(
+                    self.get_cluster(node), set()
+                ).add(node)
+
+
+def _manhattan(first: Tuple[int, int], second: Tuple[int, int]) -> int:
+    """
+    Get the number of cardinal moves between two tiles ignoring collision.
+    """
+    return abs(first[0] - second[0]) + abs(first[1] - second[1])
+
+
+def _trace_path(previous: Dict[Tuple[int, int], Tuple[int, int]],
+                end: Tuple[int, int],
+                start: Optional[Tuple[int, int]] = None
+                ) -> List[Tuple[int, int]]:
+    """
+    Follow a map of each tile to the tile before it backwards from the end,
+    returning the path in forward order. The path starts with the first tile
+    that has no previous tile, or with start if it is given.
+    """
+    path = [end]
+    while path[-1] != start and path[-1] in previous:
+        path.append(previous[path[-1]])
+    path.reverse()
+    return path
@@ -2,8 +2,23 @@
 Contains the class definition for Level, which handles collision,
 player movement, victory checking, and path finding.
 """
+import copy
+import hashlib
+import itertools
+import json
+import math
 import random
-from typing import Any, Dict, List, no_type_check, Optional, Set, Tuple, Union
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any, Dict, FrozenSet, Iterable, List, no_type_check, Optional, Sequence,
+    Set, Tuple, Union
+)
+
+import monsters
+import pathfinding
+import visibility
+from hierarchical_pathfinding import HierarchicalPathfinder
 
 # Movement events
 MOVED = 0
@@ -21,6 +36,81 @@ PRESENCE = 0
 PLAYER_COLLIDE = 1
 MONSTER_COLLIDE = 2
 
+# The length of time in seconds simulated by each player movement step
+FIXED_TIMESTEP = 1 / 120
+# The most movement steps simulated by one call to advance_player. Any more
+# time than this covers is discarded, so a long stall cannot cause a burst of
+# catch-up steps.
+MAX_TIMESTEPS = 30
+
+# The number of free tiles randomise_player_coords picks between when trying
+# to spawn the player far away from other players
+SPAWN_CANDIDATE_COUNT = 8
+
+# The version of the JSON format written by Level.to_json_dict. Version 1
+# stores every wall as its four texture names and every collision entry as two
+# bools. Version 2 stores each distinct wall once in a palette, with every row
+# of both maps run-length encoded as alternating values and repeat counts.
+# Collision map rows where both the player and monster collide with exactly
+# the walls in that row are stored as null.
+JSON_FORMAT_VERSION = 2
+# The collision map entry for each value in version 2 collision map rows
+JSON_COLLISION_VALUES = (
+    (False, False), (True, False), (False, True), (True, True)
+)
+
+# The maximum number of solutions Level will keep cached at once
+SOLUTION_CACHE_SIZE = 256
+# The maximum number of key collection routes kept cached across all levels
+COLLECTION_ROUTE_CACHE_SIZE = 64
+
+# Maps (level geometry id, geometry generation, start, keys to collect) to
+# the best route found for them, least recently used first. Shared by every
+# Level, so that the total number of routes kept is bounded. Routes for an
+# older generation of a level are never looked up again, so are left to be
+# dropped as the least recently used.
+_collection_route_cache: OrderedDict[
+    Tuple[int, int, Tuple[int, int], FrozenSet[Tuple[int, int]]],
+    Optional[pathfinding.CollectionRoute]
+] = OrderedDict()
+# Gives each level's geometry a unique id for the collection route cache
+_geometry_ids = itertools.count()
+
+
+@dataclass(frozen=True)
+class LevelState:
+    """
+    The parts of a Level that change during play, as created by
+    Level.snapshot. Every collection is immutable, so a state can be kept
+    and restored any number of times, such as for checkpoints, replays, or
+    simulations. player_walls holds the coordinates of each player placed
+    wall. Monster positions are flat tile indices as stored by MonsterGroup.
+    """
+    player_coords: Tuple[float, float]
+    player_grid_coords: Tuple[int, int]
+    exit_keys: FrozenSet[Tuple[int, int]]
+    key_sensors: FrozenSet[Tuple[int, int]]
+    guns: FrozenSet[Tuple[int, int]]
+    player_flags: FrozenSet[Tuple[int, int]]
+    monster_positions: Tuple[int, ...]
+    last_monster_positions: Tuple[int, ...]
+    player_walls: FrozenSet[Tuple[int, int]]
+    won: bool
+    killed: bool
+
+
+@dataclass
+class DerivedLevelData:
+    """
+    The caches built from a Level's geometry that are slow to recreate, as
+    returned by Level.get_derived_data. Holds only plain data, so can be
+    pickled and given to Level.set_derived_data for any level with identical
+    geometry. Pathfinders are stored without their collision grids.
+    """
+    free_tiles: Optional[List[Tuple[int, int]]]
+    visibility: Dict[int, visibility.VisibilityIndex]
+    pathfinders: Dict[int, HierarchicalPathfinder]
+
 
 class Level:
     """
@@ -34,6 +124,8 @@ class Level:
     Decorations are a dictionary of coordinates to a decoration texture name.
     Monster can be set to None if you do not wish the level
     to have a monster, or if you do it should be a Tuple of (x, y, spawn_delay)
+    Additional monsters can be added with add_monster, and share the spawn
+    delay of the first. Every monster is stored in the monsters attribute.
     This class will not automatically move or spawn the monster by itself,
     however does provide the method required to do so.
     Note that the wall map may also contain 'True' values. These represent
@@ -69,6 +161,24 @@ class Level:
             )
         self.collision_map: List[List[Tuple[bool, bool]]] = collision_map
 
+        self._initialise_contents(
+            start_point, end_point, exit_keys, key_sensors, guns,
+            decorations, monster
+        )
+
+    def _initialise_contents(self, start_point: Tuple[int, int],
+                             end_point: Tuple[int, int],
+                             exit_keys: Set[Tuple[int, int]],
+                             key_sensors: Set[Tuple[int, int]],
+                             guns: Set[Tuple[int, int]],
+                             decorations: Dict[Tuple[int, int], str],
+                             monster: Optional[Tuple[int, int, float]]
+                             ) -> None:
+        """
+        Validate and store everything in the level other than its
+        dimensions, edge texture, and wall and collision maps, which must
+        already be set. Also creates the initial play state and caches.
+        """
         if not self.is_coord_in_bounds(start_point):
             raise ValueError("Out of bounds start point coordinates")
         if self[start_point, PRESENCE] or self[start_point, PLAYER_COLLIDE]:
@@ -130,7 +240,7 @@ class Level:
                 )
         self.decorations = decorations
 
-        self.monster_coords: Optional[Tuple[int, int]] = None
+        self.monsters = monsters.MonsterGroup(self.dimensions[0])
         if monster is not None:
             monster_start, monster_wait = monster[:2], monster[2]
             if not self.is_coord_in_bounds(monster_start):
@@ -142,21 +252,23 @@ class Level:
                 )
             self.monster_start: Optional[Tuple[int, int]] = monster_start
             self.monster_wait: Optional[float] = monster_wait
+            self.monsters.add(monster_start)
         else:
             self.monster_start = None
             self.monster_wait = None
 
         self.player_flags: Set[Tuple[int, int]] = set()
 
-        # Used to prevent the monster from backtracking
-        self._last_monster_position: Optional[Tuple[int, int]] = None
+        # Time given to advance_player not yet simulated as a whole step
+        self._unsimulated_time = 0.0
+
+        # Every tile holding a player placed wall
+        self._player_walls: Set[Tuple[int, int]] = set()
+        # Indices of the wall and collision map rows shared with other
+        # levels by fork, which must be copied before they are changed.
+        self._shared_rows: Set[int] = set()
 
-        # Maps coordinates to a list of lists of coordinates represented
-        # possible paths from a previous player position. Saves on unnecessary
-        # repeated calculations.
-        self._solution_cache: Dict[
-            Tuple[int, int], List[List[Tuple[int, int]]]
-        ] = {}
+        self._create_caches()
 
         self.won = False
         self.killed = False
@@ -169,13 +281,27 @@ class Level:
         Converts lists (JSON arrays) back to tuples and sets, and converts
         applicable string keys back to tuples.
         """
-        return cls(
+        new_level = cls(
             tuple(json_dict['dimensions']),
-            [
-                [None if x is None else tuple(x) for x in y]
-                for y in json_dict['wall_map']
-            ],
-            [[tuple(x) for x in y] for y in json_dict['collision_map']],
+            *cls._maps_from_json(json_dict),
+            *cls.contents_from_json_dict(json_dict),
+            json_dict['edge_wall_texture_name']
+        )
+        for monster_start in json_dict.get('extra_monster_starts', []):
+            new_level.add_monster(tuple(monster_start))
+        return new_level
+
+    @classmethod
+    def contents_from_json_dict(cls, json_dict: Dict[str, Any]) -> Tuple[
+            Tuple[int, int], Tuple[int, int], Set[Tuple[int, int]],
+            Set[Tuple[int, int]], Set[Tuple[int, int]],
+            Dict[Tuple[int, int], str], Optional[Tuple[int, int, float]]]:
+        """
+        Convert the start point, end point, exit keys, key sensors, guns,
+        decorations, and monster in a deserialized JSON dictionary to the
+        format taken by __init__, in that order.
+        """
+        return (
             tuple(json_dict['start_point']), tuple(json_dict['end_point']),
             {tuple(x) for x in json_dict['exit_keys']},
             {tuple(x) for x in json_dict['key_sensors']},
@@ -186,34 +312,119 @@ class Level:
             },
             None
             if json_dict['monster_start'] is None else
-            tuple(json_dict['monster_start'] + [json_dict['monster_wait']]),
-            json_dict['edge_wall_texture_name']
+            tuple(json_dict['monster_start'] + [json_dict['monster_wait']])
+        )
+
+    @classmethod
+    def _maps_from_json(cls, json_dict: Dict[str, Any]) -> Tuple[
+            List[List[Optional[Union[Tuple[str, str, str, str], bool]]]],
+            List[List[Tuple[bool, bool]]]]:
+        """
+        Convert the wall and collision maps in a deserialized JSON dictionary
+        of any supported format version to the format taken by __init__.
+        """
+        if get_json_format_version(json_dict) == 1:
+            return (
+                [
+                    [None if x is None else tuple(x) for x in y]
+                    for y in json_dict['wall_map']
+                ],
+                [[tuple(x) for x in y] for y in json_dict['collision_map']]
+            )
+        wall_values = [tuple(x) for x in json_dict['wall_palette']]
+        return (
+            [
+                decode_run_length_row(x, wall_values)
+                for x in json_dict['wall_map']
+            ],
+            [
+                decode_collision_row(x, y) for x, y in zip(
+                    json_dict['collision_map'], json_dict['wall_map']
+                )
+            ]
         )
 
     @no_type_check
-    def to_json_dict(self) -> Dict[str, Any]:
+    def to_json_dict(self, format_version: int = JSON_FORMAT_VERSION
+                     ) -> Dict[str, Any]:
         """
         Convert this level into a JSON compatible dictionary. All tuples and
         sets are converted to lists (JSON arrays), and all tuple dictionary
-        keys are converted to strings.
+        keys are converted to strings. Version 1 of the format can still be
+        written for programs that only support it.
         """
+        if format_version == 1:
+            return {
+                "dimensions": list(self.dimensions),
+                "wall_map": [
+                    # 'x' is True when a player placed wall is in that
+                    # position. These are only temporary and as such should
+                    # be serialized as empty space.
+                    [None if x is True or x is None else list(x) for x in y]
+                    for y in self.wall_map
+                ],
+                "collision_map": [
+                    [list(x) for x in y] for y in self.collision_map
+                ],
+                **self.contents_to_json_dict()
+            }
+        if format_version != 2:
+            raise ValueError(
+                f"Unsupported level format version: {format_version}"
+            )
+        # Maps each distinct wall to its index in the wall palette
+        wall_palette: Dict[Tuple[str, str, str, str], int] = {}
+        wall_map = []
+        collision_map: List[Optional[List[int]]] = []
+        for wall_row, collision_row in zip(self.wall_map, self.collision_map):
+            encoded_row = []
+            # Player placed walls are serialized as empty space
+            for wall, run in itertools.groupby(
+                    wall_row, key=lambda x: None if x is True else x):
+                encoded_row.append(
+                    None if wall is None else
+                    wall_palette.setdefault(tuple(wall), len(wall_palette))
+                )
+                encoded_row.append(sum(1 for _ in run))
+            wall_map.append(encoded_row)
+            if all(
+                    bool(x[0]) == bool(x[1]) == (y is not None
+                                                 and y is not True)
+                    for x, y in zip(collision_row, wall_row)):
+                collision_map.append(None)
+                continue
+            encoded_row = []
+            for collision, run in itertools.groupby(collision_row):
+                encoded_row.append(
+                    bool(collision[0]) | bool(collision[1]) << 1
+                )
+                encoded_row.append(sum(1 for _ in run))
+            collision_map.append(encoded_row)
         return {
+            "format_version": 2,
             "dimensions": list(self.dimensions),
-            "wall_map": [
-                # 'x' is True when a player placed wall is in that position.
-                # These are only temporary and as such should be serialized as
-                # empty space.
-                [None if x is True or x is None else list(x) for x in y]
-                for y in self.wall_map
-            ],
-            "collision_map": [
-                [list(x) for x in y] for y in self.collision_map
-            ],
+            "wall_palette": [list(x) for x in wall_palette],
+            "wall_map": wall_map,
+            "collision_map": collision_map,
+            **self.contents_to_json_dict()
+        }
+
+    @no_type_check
+    def contents_to_json_dict(self) -> Dict[str, Any]:
+        """
+        Convert everything in this level other than its dimensions, wall map,
+        and collision map into a JSON compatible dictionary, in the same
+        format as to_json_dict. Sets are written in sorted order, so the same
+        level always produces the same dictionary.
+        """
+        return {
             "start_point": list(self.start_point),
             "end_point": list(self.end_point),
-            "exit_keys": [list(x) for x in self.original_exit_keys],
-            "key_sensors": [list(x) for x in self.original_key_sensors],
-            "guns": [list(x) for x in self.original_guns],
+            "exit_keys": [list(x) for x in sorted(self.original_exit_keys)],
+            "key_sensors": [
+                list(x) for x in sorted(self.original_key_sensors)
+            ],
+            "guns": [list(x) for x in sorted(self.original_guns)],
             "decorations": {
                 f"{x[0]},{x[1]}": y for x, y in self.decorations.items()
             },
@@ -223,6 +434,10 @@ class Level:
                 list(self.monster_start)
             ),
             "monster_wait": self.monster_wait,
+            "extra_monster_starts": [
+                list(self.monsters.to_coords(x))
+                for x in self.monsters.starts[1:]
+            ] if self.monster_start is not None else [],
             "edge_wall_texture_name": self.edge_wall_texture_name
         }
 
@@ -237,7 +452,7 @@ class Level:
             for x, point in enumerate(row):
                 if self.player_grid_coords == (x, y):
                     string += "PP"
-                elif self.monster_coords == (x, y):
+                elif self.monsters.is_occupied((x, y)):
                     string += "MM"
                 elif (x, y) in self.exit_keys:
                     string += "KK"
@@ -277,22 +492,199 @@ class Level:
         Change the texture of a wall or remove the wall entirely if PRESENCE
         is specified, or change the PLAYER_COLLIDE or MONSTER_COLLIDE status.
         """
+        if (index[1] in (PLAYER_COLLIDE, MONSTER_COLLIDE)
+                and not isinstance(value, bool)):
+            raise TypeError("Collision map entries must be bool")
         if index[1] == PRESENCE:
-            self.wall_map[index[0][1]][index[0][0]] = value
-        elif index[1] == PLAYER_COLLIDE:
-            if isinstance(value, bool):
-                self.collision_map[index[0][1]][index[0][0]] = (
-                    value, self.collision_map[index[0][1]][index[0][0]][1]
-                )
+            if value is True:
+                self._player_walls.add(index[0])
             else:
-                raise TypeError("Collision map entries must be bool")
-        elif index[1] == MONSTER_COLLIDE:
-            if isinstance(value, bool):
-                self.collision_map[index[0][1]][index[0][0]] = (
-                    self.collision_map[index[0][1]][index[0][0]][0], value
-                )
+                self._player_walls.discard(index[0])
+        # Stored before updating caches, as some may read from the level
+        self._store_tile(index[0], index[1], value)
+        if index[1] in self._visibility:
+            self._visibility[index[1]].invalidate(index[0])
+        if index[1] in self._collision_grids:
+            self._collision_grids[index[1]][
+                index[0][1] * self.dimensions[0] + index[0][0]
+            ] = bool(value)
+        if index[1] in self._hierarchical_pathfinders:
+            self._hierarchical_pathfinders[index[1]].update_tile(index[0])
+        if index[1] == MONSTER_COLLIDE:
+            self._monster_flow_field.update_tile(index[0])
+        if index[1] == PLAYER_COLLIDE:
+            self._solution_cache.clear()
+            self._spawn_flow_field.update_tile(index[0])
+            if self._free_tiles is not None:
+                self._update_free_tile(index[0], not value)
+        self._content_hash = None
+        self._generation += 1
+
+    def content_hash(self) -> str:
+        """
+        Get a SHA-256 hex digest of the serialized level, which will be
+        identical for any two levels with the same content. Changes made
+        through __setitem__ are reflected in the hash.
+        """
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(json.dumps(
+                self.to_json_dict(), sort_keys=True, separators=(',', ':')
+            ).encode()).hexdigest()
+        return self._content_hash
+
+    def is_wall(self, coord: Tuple[float, float]) -> bool:
+        """
+        Check whether there is a wall (including a player placed one) at the
+        specified coordinates. Equivalent to checking if PRESENCE is truthy,
+        but avoids building a texture tuple for storage that doesn't hold one.
+        """
+        return self.wall_map[
+            coord[1].__trunc__()][coord[0].__trunc__()] is not None
+
+    def get_wall_texture_names(self) -> Set[str]:
+        """
+        Get the name of every texture used by the walls of this level,
+        including the edge wall texture.
+        """
+        texture_names = {self.edge_wall_texture_name}
+        for row in self.wall_map:
+            for point in row:
+                if isinstance(point, tuple):
+                    texture_names.update(point)
+        return texture_names
+
+    def _is_segment_clear(self, start: Tuple[float, float],
+                          end: Tuple[float, float]) -> bool:
+        """
+        Check that a straight line between two in-bounds points does not
+        enter any tile with a player collider, by stepping through each tile
+        it crosses with DDA. The tile containing the start point is not
+        checked. A line passing exactly through a corner is only blocked if
+        both tiles beside that corner are.
+        """
+        collision_grid = self.get_collision_grid(PLAYER_COLLIDE)
+        width = self.dimensions[0]
+        tile_x, tile_y = start[0].__trunc__(), start[1].__trunc__()
+        end_x, end_y = end[0].__trunc__(), end[1].__trunc__()
+        delta_x, delta_y = end[0] - start[0], end[1] - start[1]
+        step_x = 1 if delta_x > 0 else -1
+        step_y = 1 if delta_y > 0 else -1
+        # Distance along the line (from 0 to 1) to the next tile boundary in
+        # each axis, and between consecutive boundaries in each axis.
+        if delta_x != 0:
+            next_x = (tile_x + (step_x > 0) - start[0]) / delta_x
+            gap_x = abs(1 / delta_x)
+        else:
+            next_x = gap_x = math.inf
+        if delta_y != 0:
+            next_y = (tile_y + (step_y > 0) - start[1]) / delta_y
+            gap_y = abs(1 / delta_y)
+        else:
+            next_y = gap_y = math.inf
+        # Every tile crossed brings the current tile one closer to the end
+        for _ in range(abs(end_x - tile_x) + abs(end_y - tile_y)):
+            if tile_x == end_x and tile_y == end_y:
+                break
+            if next_x == next_y:
+                if (collision_grid[tile_y * width + tile_x + step_x]
+                        and collision_grid[
+                            (tile_y + step_y) * width + tile_x]):
+                    return False
+                tile_x += step_x
+                tile_y += step_y
+                next_x += gap_x
+                next_y += gap_y
+            elif next_x < next_y:
+                tile_x += step_x
+                next_x += gap_x
             else:
-                raise TypeError("Collision map entries must be bool")
+                tile_y += step_y
+                next_y += gap_y
+            if collision_grid[tile_y * width + tile_x]:
+                return False
+        return True
+
+    def _store_tile(self, coord: Tuple[int, int], index_type: int,
+                    value: Optional[Union[Tuple[str, str, str, str], bool]]
+                    ) -> None:
+        """
+        Write a single wall or collision map entry. Values will have already
+        been validated by __setitem__, which should be used instead of this.
+        Subclasses storing the maps differently should override this.
+        """
+        if coord[1] in self._shared_rows:
+            # Copy on write, so that levels created by fork are unaffected
+            self.wall_map[coord[1]] = list(self.wall_map[coord[1]])
+            self.collision_map[coord[1]] = list(self.collision_map[coord[1]])
+            self._shared_rows.discard(coord[1])
+        if index_type == PRESENCE:
+            self.wall_map[coord[1]][coord[0]] = value
+        elif index_type == PLAYER_COLLIDE:
+            self.collision_map[coord[1]][coord[0]] = (
+                bool(value), self.collision_map[coord[1]][coord[0]][1]
+            )
+        elif index_type == MONSTER_COLLIDE:
+            self.collision_map[coord[1]][coord[0]] = (
+                self.collision_map[coord[1]][coord[0]][0], bool(value)
+            )
+
+    def _share_geometry(self) -> None:
+        """
+        Prepare the wall and collision maps to be shared between a level and
+        its fork (called on both), by giving this level its own list of rows
+        and marking every row as shared, so that each is copied the first
+        time it is changed.
+        Subclasses storing the maps differently should override this.
+        """
+        self.wall_map = list(self.wall_map)
+        self.collision_map = list(self.collision_map)
+        self._shared_rows = set(range(self.dimensions[1]))
+
+    def _create_caches(self) -> None:
+        """
+        Create empty versions of every cache derived from the level geometry.
+        Each is filled on first use.
+        """
+        # Maps (position, targets, maximum path count) to the paths found for
+        # them, least recently used first. Cleared whenever player collision
+        # changes, as any cached path could then be invalid.
+        self._solution_cache: OrderedDict[
+            Tuple[Tuple[int, int], FrozenSet[Tuple[int, int]], int],
+            List[List[Tuple[int, int]]]
+        ] = OrderedDict()
+        # Flat copies of the collision map for each collision type, created
+        # when first needed for path finding and then kept up to date.
+        self._collision_grids: Dict[int, bytearray] = {}
+        # Cluster graphs over each collision grid for path queries on large
+        # levels, created on first use and kept up to date by __setitem__.
+        self._hierarchical_pathfinders: Dict[int, HierarchicalPathfinder] = {}
+        # Leads the monster toward its targets, shared by every chaser.
+        # Searched again from the targets when they change tile, but only as
+        # far as the monsters that can see them.
+        self._monster_flow_field = pathfinding.FlowField()
+        # Every tile without a player collider in no particular order, with
+        # the position of each tile in the list, so that tiles can be added,
+        # removed, and randomly picked in O(1). Created on first use and then
+        # kept up to date by __setitem__.
+        self._free_tiles: Optional[List[Tuple[int, int]]] = None
+        self._free_tile_positions: Dict[Tuple[int, int], int] = {}
+        # Leads away from other players when choosing where to spawn
+        self._spawn_flow_field = pathfinding.FlowField()
+        # Calculated by content_hash when first needed, then kept until the
+        # level changes.
+        self._content_hash: Optional[str] = None
+        # Identify the current geometry of this level in the collection
+        # route cache without serializing it. The generation is increased by
+        # every change made through __setitem__.
+        self._geometry_id = next(_geometry_ids)
+        self._generation = 0
+
+        # Caches which tiles can be seen from each other. Sight is blocked by
+        # walls for PRESENCE, or by monster colliders for MONSTER_COLLIDE.
+        self._visibility: Dict[int, visibility.VisibilityIndex] = {
+            PRESENCE: visibility.VisibilityIndex(),
+            MONSTER_COLLIDE: visibility.VisibilityIndex()
+        }
 
     def move_player(self, vector: Tuple[float, float], has_gun: bool,
                     relative: bool = True, collision_check: bool = True,
@@ -325,13 +717,16 @@ class Level:
             target = vector
             # There are no alternate movements if we aren't moving relatively.
             alternate_targets = []
+        # Collision is checked along the entire line moved through, not just
+        # at the target, so large moves cannot pass through walls.
         if not self.is_coord_in_bounds(target) or (
-                self[target, PLAYER_COLLIDE] and collision_check):
+                collision_check
+                and not self._is_segment_clear(self.player_coords, target)):
             found_valid = False
             for alt_move in alternate_targets:
                 if self.is_coord_in_bounds(alt_move) and (
-                        not self[alt_move, PLAYER_COLLIDE]
-                        or not collision_check):
+                        not collision_check or self._is_segment_clear(
+                            self.player_coords, alt_move)):
                     target = alt_move
                     found_valid = True
                     events.add(ALTERNATE_COORD_CHOSEN)
@@ -371,127 +766,418 @@ class Level:
             self.guns.remove(grid_coords)
             events.add(PICKED_UP_GUN)
             events.add(PICKUP)
-        if grid_coords == self.monster_coords:
+        if self.monsters.is_occupied(grid_coords):
             events.add(MONSTER_CAUGHT)
         elif grid_coords == self.end_point and len(self.exit_keys) == 0:
             self.won = True
             events.add(WON)
         return events
 
-    def move_monster(self, coop: bool = False) -> bool:
+    def advance_player(self, velocity: Tuple[float, float], elapsed: float,
+                       has_gun: bool, collision_check: bool = True
+                       ) -> Set[int]:
+        """
+        Move the player at a velocity in units per second for the given
+        number of seconds, in fixed steps of FIXED_TIMESTEP, so movement is
+        the same regardless of frame rate. Time that doesn't fill a whole
+        step is carried over to the next call. Returns every event from
+        each step, as with move_player.
+        """
+        events: Set[int] = set()
+        self._unsimulated_time += elapsed
+        step_count = min(
+            math.floor(self._unsimulated_time / FIXED_TIMESTEP), MAX_TIMESTEPS
+        )
+        self._unsimulated_time = min(
+            self._unsimulated_time - step_count * FIXED_TIMESTEP,
+            FIXED_TIMESTEP
+        )
+        step_vector = (
+            velocity[0] * FIXED_TIMESTEP, velocity[1] * FIXED_TIMESTEP
+        )
+        if step_vector == (0.0, 0.0):
+            return events
+        for _ in range(step_count):
+            events.update(self.move_player(
+                step_vector, has_gun, True, collision_check
+            ))
+        return events
+
+    @property
+    def monster_coords(self) -> Optional[Tuple[int, int]]:
+        """
+        The grid coordinates of the first monster, or None if it isn't
+        spawned or the level has no monster.
+        """
+        if len(self.monsters) == 0:
+            return None
+        return self.monsters.get_coords(0)
+
+    @monster_coords.setter
+    def monster_coords(self, coords: Optional[Tuple[int, int]]) -> None:
+        if len(self.monsters) == 0:
+            if coords is None:
+                return
+            self.monsters.add(coords)
+        self.monsters.set_coords(0, coords)
+
+    def add_monster(self, start: Tuple[int, int]) -> int:
+        """
+        Add another monster to the level that will spawn at the given tile,
+        returning its index in the monsters attribute. Extra monsters share
+        the spawn delay of the first, so the level must already have one.
+        """
+        if self.monster_start is None:
+            raise ValueError("Extra monsters require a level with a monster")
+        if not self.is_coord_in_bounds(start):
+            raise ValueError("Out of bounds monster start coordinates")
+        if self[start, PRESENCE] or self[start, PLAYER_COLLIDE]:
+            raise ValueError(
+                "Monster start cannot be inside wall or player collider"
+            )
+        return self.monsters.add(start)
+
+    def move_monster(self, coop: bool = False,
+                     targets: Optional[Iterable[Tuple[int, int]]] = None
+                     ) -> bool:
         """
-        Moves the monster one space in a random available direction, unless
-        the player is in the unobstructed view of one of the cardinal
-        directions, in which case move toward the player instead.
-        If the monster is not spawned in yet, it will be spawned when this
-        function is called IF the player is 2 or more units away.
-        If the monster and the player occupy the same grid square, True will be
-        returned, else False will be.
+        Moves every monster one space in a random available direction, unless
+        a monster can see one of its targets, in which case it follows the
+        shortest path toward the nearest target instead. Targets default to
+        the player's grid position, or nobody in co-op, where the server
+        should give the grid position of every living player. All monsters
+        are moved in a single pass over flat arrays, sharing one flow field
+        and the cached sight of each target, so even hundreds of monsters
+        can be moved every tick.
+        If a monster is not spawned in yet, it will be spawned when this
+        function is called IF the player is 2 or more units away from its
+        start.
+        If any monster and the player occupy the same grid square, True will
+        be returned, else False will be.
         """
-        import raycasting  # Import is here to prevent circular import
-        last_monster_position = self.monster_coords
         if self.monster_start is None:
             return False
-        if (self.monster_coords is None and
-                (raycasting.no_sqrt_coord_distance(
-                    self.player_grid_coords, self.monster_start
-                ) >= 4 or coop)):
-            self.monster_coords = self.monster_start
-        elif self.monster_coords is not None:
-            # 0 — Not in line of sight.
-            # 1 — Line of sight on Y axis.
-            # 2 — Line of sight on X axis.
-            line_of_sight = 0
-            if not coop:
-                if self.player_grid_coords[0] == self.monster_coords[0]:
-                    min_y_coord = min(
-                        self.player_grid_coords[1], self.monster_coords[1]
-                    )
-                    max_y_coord = max(
-                        self.player_grid_coords[1], self.monster_coords[1]
-                    )
-                    collided = False
-                    for y_coord in range(min_y_coord, max_y_coord + 1):
-                        if self[(self.player_grid_coords[0], y_coord),
-                                MONSTER_COLLIDE]:
-                            collided = True
-                            break
-                    if not collided:
-                        line_of_sight = 1
-                elif self.player_grid_coords[1] == self.monster_coords[1]:
-                    min_x_coord = min(
-                        self.player_grid_coords[0], self.monster_coords[0]
-                    )
-                    max_x_coord = max(
-                        self.player_grid_coords[0], self.monster_coords[0]
-                    )
-                    collided = False
-                    for x_coord in range(min_x_coord, max_x_coord + 1):
-                        if self[(x_coord, self.player_grid_coords[1]),
-                                MONSTER_COLLIDE]:
-                            collided = True
-                            break
-                    if not collided:
-                        line_of_sight = 2
-            if line_of_sight == 1:
-                if self.player_grid_coords[1] > self.monster_coords[1]:
-                    self.monster_coords = (
-                        self.monster_coords[0], self.monster_coords[1] + 1
-                    )
-                else:
-                    self.monster_coords = (
-                        self.monster_coords[0], self.monster_coords[1] - 1
-                    )
-            elif line_of_sight == 2:
-                if self.player_grid_coords[0] > self.monster_coords[0]:
-                    self.monster_coords = (
-                        self.monster_coords[0] + 1, self.monster_coords[1]
-                    )
-                else:
-                    self.monster_coords = (
-                        self.monster_coords[0] - 1, self.monster_coords[1]
-                    )
-            else:
-                # Randomise order of each cardinal direction, then move to
-                # the first one available.
-                shuffled_vectors = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-                random.shuffle(shuffled_vectors)
-                for vector in shuffled_vectors:
-                    target = (
-                        self.monster_coords[0] + vector[0],
-                        self.monster_coords[1] + vector[1]
-                    )
-                    if (self.is_coord_in_bounds(target)
-                            and not self[target, MONSTER_COLLIDE]
-                            and self._last_monster_position != target):
-                        self.monster_coords = target
-                        break
-        self._last_monster_position = last_monster_position
-        if self.monster_coords in self.player_flags and random.random() < 0.25:
-            self.player_flags.remove(self.monster_coords)
-        return self.monster_coords == self.player_grid_coords
-
-    def find_possible_paths(self) -> List[List[Tuple[int, int]]]:
-        """
-        Finds all possible paths to the current target(s) from the player's
-        current position. The returned result is sorted by path length in
-        ascending order (i.e. the shortest path is first). Potentially very
-        computationally expensive.
-        """
-        targets = (
+        if targets is None:
+            targets = [] if coop else [self.player_grid_coords]
+        flow_field = self.get_monster_flow_field(targets)
+        # Visibility is symmetric, so a monster can see a target exactly
+        # when it is on a tile the target can see.
+        sight = [
+            self._visibility[MONSTER_COLLIDE].get_visible_set(
+                target, self.dimensions,
+                lambda coord: bool(self[coord, MONSTER_COLLIDE])
+            )
+            for target in flow_field.targets
+        ]
+        self.monsters.step(
+            self.get_collision_grid(MONSTER_COLLIDE), self.dimensions[1],
+            flow_field, sight
+        )
+        self.monsters.spawn_waiting(self.player_grid_coords, coop)
+        for flag in [
+                x for x in self.player_flags if self.monsters.is_occupied(x)]:
+            if random.random() < 0.25:
+                self.player_flags.remove(flag)
+        return self.monsters.is_occupied(self.player_grid_coords)
+
+    def despawn_monsters_at(self, coords: Tuple[int, int]) -> None:
+        """
+        Remove every monster on the given tile from the level, such as after
+        being shot or escaped from. They will spawn again later.
+        """
+        self.monsters.despawn_at(coords)
+
+    def get_monster_flow_field(self, targets: Iterable[Tuple[int, int]]
+                               ) -> pathfinding.FlowField:
+        """
+        Get the flow field leading through monster collision toward the
+        nearest of the given targets. Targets out of bounds or on a monster
+        collider are ignored. The field is shared and only searched as far
+        as the tiles it is queried for, so callers such as the monster and
+        compass can request it as often as they like.
+        """
+        self._monster_flow_field.update(
+            self.get_collision_grid(MONSTER_COLLIDE), self.dimensions, (
+                x for x in targets
+                if self.is_coord_in_bounds(x) and not self[x, MONSTER_COLLIDE]
+            )
+        )
+        return self._monster_flow_field
+
+    def is_visible(self, origin: Tuple[int, int], target: Tuple[int, int],
+                   index_type: int = PRESENCE) -> bool:
+        """
+        Determine whether the target tile can be seen from the centre of the
+        origin tile, with sight being blocked by either walls (PRESENCE) or
+        monster colliders (MONSTER_COLLIDE). The tiles visible from each
+        origin are cached until a tile that could affect them changes, so
+        repeated checks are O(1).
+        """
+        return self._visibility[index_type].is_visible(
+            origin, target, self.dimensions,
+            lambda coord: bool(self[coord, index_type])
+        )
+
+    def get_visible_tiles(self, origin: Tuple[int, int],
+                          index_type: int = PRESENCE
+                          ) -> List[Tuple[int, int]]:
+        """
+        Get every tile that can be seen from the centre of the origin tile,
+        with sight being blocked by either walls (PRESENCE) or monster
+        colliders (MONSTER_COLLIDE).
+        """
+        return self._visibility[index_type].get_visible_tiles(
+            origin, self.dimensions,
+            lambda coord: bool(self[coord, index_type])
+        )
+
+    def precompute_visibility(self, index_type: int = PRESENCE) -> None:
+        """
+        Calculate the tiles visible from every open tile ahead of time, so
+        that visibility checks never need to calculate anything during play.
+        """
+        self._visibility[index_type].precompute(
+            self.dimensions, lambda coord: bool(self[coord, index_type])
+        )
+
+    def get_collision_grid(self, index_type: int = PLAYER_COLLIDE
+                           ) -> bytearray:
+        """
+        Get the collision map for either PLAYER_COLLIDE or MONSTER_COLLIDE as
+        a flat bytearray indexed by (y * width + x), with 1 for tiles that
+        cannot be entered. The returned array is shared and kept up to date
+        by __setitem__, so it should not be modified.
+        """
+        collision_grid = self._collision_grids.get(index_type)
+        if (collision_grid is None or len(collision_grid)
+                != self.dimensions[0] * self.dimensions[1]):
+            collision_grid = self._build_collision_grid(index_type)
+            self._collision_grids[index_type] = collision_grid
+        return collision_grid
+
+    def _build_collision_grid(self, index_type: int) -> bytearray:
+        """
+        Create a new flat collision grid for get_collision_grid from the
+        level contents.
+        """
+        return bytearray(
+            bool(self[(x, y), index_type])
+            for y in range(self.dimensions[1])
+            for x in range(self.dimensions[0])
+        )
+
+    def find_path(self, start: Tuple[int, int], goal: Tuple[int, int],
+                  index_type: int = PLAYER_COLLIDE
+                  ) -> Optional[List[Tuple[int, int]]]:
+        """
+        Find a path between any two tiles through either PLAYER_COLLIDE or
+        MONSTER_COLLIDE, including both tiles, or None if there isn't one.
+        Uses hierarchical path finding, so is fast enough to be called per
+        player per tick even on very large levels, but paths on levels with
+        wide open areas may be up to around a fifth longer than the shortest
+        possible. Changing a tile only updates the part of the search graph
+        around it.
+        """
+        return self._get_pathfinder(index_type).find_path(start, goal)
+
+    def precompute_pathfinding(self, index_type: int = PLAYER_COLLIDE
+                               ) -> None:
+        """
+        Build the whole search graph used by find_path for either
+        PLAYER_COLLIDE or MONSTER_COLLIDE ahead of time, so that no path
+        query needs to extend it during play.
+        """
+        self._get_pathfinder(index_type).precompute()
+
+    def _get_pathfinder(self, index_type: int) -> HierarchicalPathfinder:
+        """
+        Get the hierarchical pathfinder for a collision type, creating it if
+        it doesn't exist or its collision grid has been replaced.
+        """
+        collision_grid = self.get_collision_grid(index_type)
+        pathfinder = self._hierarchical_pathfinders.get(index_type)
+        if (pathfinder is None
+                or pathfinder.collision_grid is not collision_grid):
+            pathfinder = HierarchicalPathfinder(
+                collision_grid, self.dimensions
+            )
+            self._hierarchical_pathfinders[index_type] = pathfinder
+        return pathfinder
+
+    def find_shortest_path(self) -> Optional[List[Tuple[int, int]]]:
+        """
+        Find the shortest path to the closest current target from the
+        player's current position, or None if no target can be reached. The
+        path starts with the player's position and ends with the target.
+        """
+        paths = self.find_possible_paths(1)
+        return paths[0] if len(paths) > 0 else None
+
+    def find_possible_paths(self, max_paths: int = 1
+                            ) -> List[List[Tuple[int, int]]]:
+        """
+        Find up to max_paths of the shortest paths to the current target(s)
+        from the player's current position, each starting with the player's
+        position and ending with a target. The returned result is sorted by
+        path length in ascending order (i.e. the shortest path is first).
+        Finding the shortest path is a single breadth first search, and each
+        alternative route costs at most one more search per tile of the
+        previous route. Results are cached by position and remaining
+        targets, so calling this every frame is inexpensive.
+        """
+        targets = frozenset(
             {self.end_point} if len(self.exit_keys) == 0 else self.exit_keys
         )
-        if self.player_grid_coords in self._solution_cache:
-            return [
-                x for x in self._solution_cache[self.player_grid_coords]
-                if x[-1] in targets
-            ]
-        result = sorted(
-            self._path_search([self.player_grid_coords], targets), key=len
+        cache_key = (self.player_grid_coords, targets, max_paths)
+        cached_paths = self._solution_cache.get(cache_key)
+        if cached_paths is not None:
+            self._solution_cache.move_to_end(cache_key)
+            return cached_paths
+        result = pathfinding.k_shortest_paths(
+            self.get_collision_grid(PLAYER_COLLIDE), self.dimensions,
+            self.player_grid_coords, targets, max_paths
         )
-        self._solution_cache[self.player_grid_coords] = result
+        self._solution_cache[cache_key] = result
+        if len(self._solution_cache) > SOLUTION_CACHE_SIZE:
+            self._solution_cache.popitem(last=False)
         return result
 
+    def plan_collection_route(self, from_player: bool = False
+                              ) -> Optional[pathfinding.CollectionRoute]:
+        """
+        Find the shortest route that collects every key before reaching the
+        end point, or None if that isn't possible. By default the route
+        starts at the start point and collects every original key, such as
+        for calculating a par time. If from_player is True, it instead starts
+        at the player's current position and only collects the keys that
+        remain, such as for guiding a bot player. The order of keys is exact
+        for up to pathfinding.HELD_KARP_STOP_LIMIT keys. Results are cached
+        until the level is next changed, so the returned route should not be
+        modified.
+        """
+        if from_player:
+            start, keys = self.player_grid_coords, frozenset(self.exit_keys)
+        else:
+            start, keys = self.start_point, self.original_exit_keys
+        cache_key = (self._geometry_id, self._generation, start, keys)
+        if cache_key in _collection_route_cache:
+            _collection_route_cache.move_to_end(cache_key)
+            return _collection_route_cache[cache_key]
+        route = pathfinding.plan_collection_route(
+            self.get_collision_grid(PLAYER_COLLIDE), self.dimensions,
+            start, keys, self.end_point
+        )
+        _collection_route_cache[cache_key] = route
+        if len(_collection_route_cache) > COLLECTION_ROUTE_CACHE_SIZE:
+            _collection_route_cache.popitem(last=False)
+        return route
+
+    def get_derived_data(self) -> DerivedLevelData:
+        """
+        Get the free tile, visibility, and path finding caches built so far.
+        The returned data shares its contents with this level, so should be
+        saved or copied before the level next changes.
+        """
+        pathfinders: Dict[int, HierarchicalPathfinder] = {}
+        for index_type, pathfinder in self._hierarchical_pathfinders.items():
+            # The collision grid is part of the level, so is left out
+            pathfinders[index_type] = copy.copy(pathfinder)
+            pathfinders[index_type].collision_grid = b""
+        return DerivedLevelData(
+            self._free_tiles, dict(self._visibility), pathfinders
+        )
+
+    def set_derived_data(self, data: DerivedLevelData) -> None:
+        """
+        Replace the free tile, visibility, and path finding caches with ones
+        from get_derived_data, which must have been called on a level with
+        the same geometry as this one. The data is used directly rather than
+        copied, so should not be given to more than one level.
+        """
+        if data.free_tiles is not None:
+            self._free_tiles = data.free_tiles
+            self._free_tile_positions = {
+                x: i for i, x in enumerate(data.free_tiles)
+            }
+        self._visibility.update(data.visibility)
+        for index_type, pathfinder in data.pathfinders.items():
+            pathfinder.collision_grid = self.get_collision_grid(index_type)
+            self._hierarchical_pathfinders[index_type] = pathfinder
+
+    def snapshot(self) -> LevelState:
+        """
+        Capture the current dynamic state of the level: the player, items,
+        flags, monster, player placed walls, and victory/death status. Takes
+        time proportional to the size of the state, not of the level.
+        """
+        return LevelState(
+            self.player_coords, self.player_grid_coords,
+            frozenset(self.exit_keys), frozenset(self.key_sensors),
+            frozenset(self.guns), frozenset(self.player_flags),
+            tuple(self.monsters.positions),
+            tuple(self.monsters.last_positions),
+            frozenset(self._player_walls), self.won, self.killed
+        )
+
+    def restore(self, state: LevelState) -> None:
+        """
+        Return the level to a state previously captured by snapshot. Player
+        placed walls that aren't in the state are removed, and those that are
+        in the state but missing are placed again, both along with their
+        player and monster colliders.
+        """
+        for wall in self._player_walls - state.player_walls:
+            self[wall, PRESENCE] = None
+            self[wall, PLAYER_COLLIDE] = False
+            self[wall, MONSTER_COLLIDE] = False
+        for wall in state.player_walls - self._player_walls:
+            self[wall, PRESENCE] = True
+            self[wall, PLAYER_COLLIDE] = True
+            self[wall, MONSTER_COLLIDE] = True
+        self.player_coords = state.player_coords
+        self.player_grid_coords = state.player_grid_coords
+        self.exit_keys = set(state.exit_keys)
+        self.key_sensors = set(state.key_sensors)
+        self.guns = set(state.guns)
+        self.player_flags = set(state.player_flags)
+        self.monsters.set_state(
+            state.monster_positions, state.last_monster_positions
+        )
+        self.won = state.won
+        self.killed = state.killed
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'Level':
+        """
+        Copy every attribute of the level, giving the copy a new identity in
+        the collection route cache, as changes made to either level after
+        copying would otherwise be counted toward the same geometry.
+        """
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        for name, value in self.__dict__.items():
+            setattr(copied, name, copy.deepcopy(value, memo))
+        copied._geometry_id = next(_geometry_ids)
+        copied._generation = 0
+        return copied
+
+    def fork(self) -> 'Level':
+        """
+        Create a new level with the same geometry and current state as this
+        one, for running many game instances from one loaded level. The two
+        levels share their wall and collision maps, with any part of them
+        being copied only when either level first changes it, so forking
+        takes time proportional to the height of the level rather than its
+        size. Caches derived from the geometry start empty in the new level.
+        """
+        self._share_geometry()
+        forked = copy.copy(self)
+        forked.monsters = self.monsters.copy()
+        forked._share_geometry()
+        forked._create_caches()
+        forked._player_walls = set(self._player_walls)
+        forked.restore(self.snapshot())
+        return forked
+
     def reset(self) -> None:
         """
         Reset this level to its original state
@@ -504,10 +1190,21 @@ class Level:
             self.start_point[0] + 0.5, self.start_point[1] + 0.5
         )
         self.player_grid_coords = self.start_point
-        self.monster_coords = None
+        self.monsters.despawn_all()
+        self._unsimulated_time = 0.0
         self.won = False
         self.killed = False
 
+    def evict_distant_chunks(self, keep_coords: Iterable[Tuple[float, float]]
+                             ) -> int:
+        """
+        Free the memory used by parts of the level far from all of the given
+        coordinates (usually those of every player), returning how many parts
+        were freed. Levels that are always held fully in memory have nothing
+        to free, so this does nothing unless overridden.
+        """
+        return 0
+
     def is_coord_in_bounds(self, coord: Tuple[float, float]) -> bool:
         """
         Checks if a coordinate in within the boundaries of the maze.
@@ -517,39 +1214,115 @@ class Level:
             and 0 <= coord[1] < self.dimensions[1]
         )
 
-    def randomise_player_coords(self) -> None:
+    def randomise_player_coords(
+            self, other_players: Optional[Iterable[Tuple[int, int]]] = None
+            ) -> None:
         """
         Move the player to a random valid position in the level. Used in
-        multiplayer for (re)spawning.
+        multiplayer for (re)spawning. Tiles are picked from an index of free
+        tiles, so this takes O(1) time regardless of how dense the level is.
+        If the grid coordinates of other players are given, the tile
+        furthest from them (by path distance) out of SPAWN_CANDIDATE_COUNT
+        random free tiles is chosen instead.
         """
-        new_coord = None
-        while new_coord is None or self[new_coord, PLAYER_COLLIDE]:
-            new_coord = (
-                random.randint(0, self.dimensions[0] - 1) + 0.5,
-                random.randint(0, self.dimensions[1] - 1) + 0.5
+        free_tiles = self.get_free_tiles()
+        if len(free_tiles) == 0:
+            return
+        other_players = list(other_players or [])
+        if len(other_players) > 0:
+            flow_field = self._spawn_flow_field
+            flow_field.update(
+                self.get_collision_grid(PLAYER_COLLIDE), self.dimensions,
+                (x for x in other_players if self.is_coord_in_bounds(x))
             )
-        self.move_player(new_coord, False, False, False, True)
+            # Tiles that other players can't reach at all are the safest
+            new_coord = max(
+                (
+                    random.choice(free_tiles)
+                    for _ in range(SPAWN_CANDIDATE_COUNT)
+                ),
+                key=lambda x: (
+                    flow_field.get_distance(x) == -1,
+                    flow_field.get_distance(x)
+                )
+            )
+        else:
+            new_coord = random.choice(free_tiles)
+        self.move_player(
+            (new_coord[0] + 0.5, new_coord[1] + 0.5), False, False, False, True
+        )
 
-    def _path_search(self, current_path: List[Tuple[int, int]],
-                     targets: Set[Tuple[int, int]]
-                     ) -> List[List[Tuple[int, int]]]:
+    def get_free_tiles(self) -> List[Tuple[int, int]]:
         """
-        Recursively find all possible paths to a list of targets. Use the
-        find_possible_paths method instead of this one for finding paths
-        to the player's target(s).
+        Get every tile that doesn't have a player collider, in no particular
+        order. The returned list is shared and kept up to date by
+        __setitem__, so it should not be modified.
         """
-        found_paths: List[List[Tuple[int, int]]] = []
-        for x_offset, y_offset in ((0, -1), (1, 0), (0, 1), (-1, 0)):
-            point = (
-                current_path[-1][0] + x_offset,
-                current_path[-1][1] + y_offset
-            )
-            if not self.is_coord_in_bounds(point) or self[
-                    point, PLAYER_COLLIDE] or point in current_path:
-                continue
-            if point in targets:
-                found_paths.append(current_path + [point])
-            found_paths += self._path_search(
-                current_path + [point], targets
-            )
-        return found_paths
+        if self._free_tiles is None:
+            self._free_tiles = []
+            self._free_tile_positions = {}
+            for y in range(self.dimensions[1]):
+                for x in range(self.dimensions[0]):
+                    if not self[(x, y), PLAYER_COLLIDE]:
+                        self._update_free_tile((x, y), True)
+        return self._free_tiles
+
+    def _update_free_tile(self, tile: Tuple[int, int], free: bool) -> None:
+        """
+        Add a tile to, or remove a tile from, the free tile index. Removal
+        swaps the last tile into the removed tile's place to avoid shifting
+        the rest of the list.
+        """
+        assert self._free_tiles is not None
+        position = self._free_tile_positions.get(tile)
+        if free and position is None:
+            self._free_tile_positions[tile] = len(self._free_tiles)
+            self._free_tiles.append(tile)
+        elif not free and position is not None:
+            last_tile = self._free_tiles.pop()
+            del self._free_tile_positions[tile]
+            if last_tile != tile:
+                self._free_tiles[position] = last_tile
+                self._free_tile_positions[last_tile] = position
+
+
+def get_json_format_version(json_dict: Dict[str, Any]) -> int:
+    """
+    Get the format version of a deserialized level JSON dictionary, raising
+    ValueError if it isn't supported. Dictionaries without a version are
+    from before versions were added, so are version 1.
+    """
+    format_version = json_dict.get('format_version', 1)
+    if format_version not in (1, 2):
+        raise ValueError(
+            f"Unsupported level format version: {format_version}"
+        )
+    return format_version
+
+
+def decode_run_length_row(row: Sequence[Optional[int]],
+                          values: Sequence[Any]) -> List[Any]:
+    """
+    Expand a run-length encoded row from a version 2 level JSON dictionary,
+    made up of alternating value indices (or None) and repeat counts, using
+    the given list of values for each index.
+    """
+    decoded: List[Any] = []
+    for index, count in zip(row[::2], row[1::2]):
+        decoded += [None if index is None else values[index]] * count
+    return decoded
+
+
+def decode_collision_row(row: Optional[Sequence[int]],
+                         wall_row: Sequence[Optional[int]]) -> List[Any]:
+    """
+    Expand a run-length encoded collision map row from a version 2 level
+    JSON dictionary. If the row is None, the player and monster collide with
+    exactly the walls in the encoded wall row at the same position.
+    """
+    if row is None:
+        row = [
+            x if i % 2 else 0 if x is None else 3
+            for i, x in enumerate(wall_row)
+        ]
+    return decode_run_length_row(row, JSON_COLLISION_VALUES)
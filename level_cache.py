@@ -0,0 +1,156 @@
+"""
+Contains the functions for keeping compiled levels in an on-disk cache, so
+that levels from a level JSON file only need to be parsed, validated, and
+have their derived caches (free tiles, visibility, and path finding graphs)
+built the first time they are loaded. Each level is stored as a single level
+binary level pack, which is memory mapped when loaded, alongside a pickle of
+its derived caches. Entries are named by a hash of the level's JSON and the
+cache format version, so a changed level or format simply misses the cache.
+A manifest named by the hash of the whole file lists the entries of every
+level in it, so an unchanged file doesn't need to be parsed at all.
+"""
+import hashlib
+import json
+import os
+import pickle
+import struct
+from typing import Any, Dict, List
+
+import level_pack
+import visibility
+from compact_level import CompactLevel
+from level import MONSTER_COLLIDE, PLAYER_COLLIDE, PRESENCE
+
+# Must be increased whenever the contents of cache entries change, including
+# the attributes of any class pickled as part of DerivedLevelData.
+CACHE_FORMAT_VERSION = 2
+DEFAULT_CACHE_DIRECTORY = "level_cache"
+# The largest level (in tiles) to calculate every visible tile for when
+# compiling. Larger levels only cache visibility as it is calculated, as
+# VisibilityIndex would not keep every tile's visible set anyway.
+VISIBILITY_PRECOMPUTE_MAX_TILES = visibility.VISIBLE_SET_CACHE_SIZE
+
+_MANIFEST_EXTENSION = ".manifest"
+_DERIVED_DATA_EXTENSION = ".pickle"
+# Raised by a cache entry that is missing, incomplete, or corrupt
+_CACHE_ERRORS = (
+    OSError, ValueError, KeyError, TypeError, EOFError, struct.error,
+    pickle.UnpicklingError
+)
+
+
+def load_cached_levels(path: str,
+                       cache_directory: str = DEFAULT_CACHE_DIRECTORY
+                       ) -> List[CompactLevel]:
+    """
+    Load the levels from a level JSON file, using the compiled version of
+    each from the cache directory if there is one, and compiling and caching
+    any that there isn't. Failing to write to the cache does not prevent the
+    levels from loading.
+    """
+    with open(path, 'rb') as file:
+        file_bytes = file.read()
+    manifest_path = os.path.join(
+        cache_directory, _hash_content(file_bytes) + _MANIFEST_EXTENSION
+    )
+    try:
+        with open(manifest_path, encoding="utf8") as file:
+            return [
+                _load_entry(cache_directory, x) for x in json.load(file)
+            ]
+    except _CACHE_ERRORS:
+        pass
+
+    json_dicts: List[Dict[str, Any]] = json.loads(file_bytes)
+    levels: List[CompactLevel] = []
+    keys: List[str] = []
+    for json_dict in json_dicts:
+        key = get_level_key(json_dict)
+        try:
+            levels.append(_load_entry(cache_directory, key))
+        except _CACHE_ERRORS:
+            levels.append(_compile_entry(cache_directory, key, json_dict))
+        keys.append(key)
+    try:
+        _write_atomic(manifest_path, json.dumps(keys).encode())
+    except OSError:
+        pass
+    return levels
+
+
+def get_level_key(json_dict: Dict[str, Any]) -> str:
+    """
+    Get the name of the cache entry for a deserialized level JSON dictionary.
+    Keys differ for any difference in the JSON content or cache format.
+    """
+    return _hash_content(json.dumps(
+        json_dict, sort_keys=True, separators=(',', ':')
+    ).encode())
+
+
+def _hash_content(content: bytes) -> str:
+    """
+    Get a SHA-256 hex digest of some content along with the versions of
+    every format used by the cache.
+    """
+    return hashlib.sha256(
+        f"{CACHE_FORMAT_VERSION}:{level_pack.PACK_VERSION}:".encode()
+        + content
+    ).hexdigest()
+
+
+def _load_entry(cache_directory: str, key: str) -> CompactLevel:
+    """
+    Load a compiled level and its derived caches from the cache directory.
+    """
+    entry_path = os.path.join(cache_directory, key)
+    with open(entry_path + _DERIVED_DATA_EXTENSION, 'rb') as file:
+        derived_data = pickle.load(file)
+    new_level = level_pack.LevelPackReader(
+        entry_path + level_pack.LEVEL_PACK_EXTENSION
+    ).load_level(0)
+    new_level.set_derived_data(derived_data)
+    return new_level
+
+
+def _compile_entry(cache_directory: str, key: str,
+                   json_dict: Dict[str, Any]) -> CompactLevel:
+    """
+    Create a level from a deserialized level JSON dictionary, build its
+    derived caches, and save both to the cache directory.
+    """
+    new_level = CompactLevel.from_json_dict(json_dict)
+    new_level.get_free_tiles()
+    new_level.precompute_pathfinding(PLAYER_COLLIDE)
+    new_level.precompute_pathfinding(MONSTER_COLLIDE)
+    if (new_level.dimensions[0] * new_level.dimensions[1]
+            <= VISIBILITY_PRECOMPUTE_MAX_TILES):
+        new_level.precompute_visibility(PRESENCE)
+        new_level.precompute_visibility(MONSTER_COLLIDE)
+    entry_path = os.path.join(cache_directory, key)
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        # The pickle is checked for first when loading, so must be written
+        # last to ensure a loaded entry always has its level pack.
+        level_pack.save_level_pack(
+            entry_path + level_pack.LEVEL_PACK_EXTENSION, [new_level]
+        )
+        _write_atomic(
+            entry_path + _DERIVED_DATA_EXTENSION, pickle.dumps(
+                new_level.get_derived_data(), pickle.HIGHEST_PROTOCOL
+            )
+        )
+    except OSError:
+        pass
+    return new_level
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    """
+    Write a file by writing a temporary file first, then moving it over the
+    destination, so that a partially written file is never read.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
@@ -13,6 +13,7 @@ from typing import Dict, List, Optional, Tuple
 
 import config_loader
 import level
+import level_pack
 import maze_levels
 import raycasting
 import screen_drawing
@@ -485,7 +486,10 @@ class LevelDesignerApp:
                 + "This will overwrite everything here."):
             return
         filepath = tkinter.filedialog.askopenfilename(
-            filetypes=[("JSON files", '*.json')]
+            filetypes=[
+                ("JSON files", '*.json'),
+                ("Level packs", '*' + level_pack.LEVEL_PACK_EXTENSION)
+            ]
         )
         if filepath == "":
             return
@@ -493,7 +497,7 @@ class LevelDesignerApp:
             tkinter.messagebox.showerror("Not found", "File does not exist")
             return
         try:
-            self.levels = maze_levels.load_level_json(filepath)
+            self.levels = maze_levels.load_levels(filepath)
             self.current_path = filepath
             self.window.wm_title(f"Level Designer - {filepath}")
             self.current_level = -1
@@ -521,17 +525,21 @@ class LevelDesignerApp:
 
     def save_file(self, filepath: Optional[str] = None) -> None:
         """
-        Prompt the user to provide a location to save a JSON file then do so.
+        Prompt the user to provide a location to save a JSON file or level
+        pack then do so.
         If filepath is given, the user file prompt will be skipped.
         """
         if filepath is None or filepath == "":
             filepath = tkinter.filedialog.asksaveasfilename(
-                filetypes=[("JSON files", '*.json')]
+                filetypes=[
+                    ("JSON files", '*.json'),
+                    ("Level packs", '*' + level_pack.LEVEL_PACK_EXTENSION)
+                ]
             )
         if filepath == "":
             return
         try:
-            maze_levels.save_level_json(filepath, self.levels)
+            maze_levels.save_levels(filepath, self.levels)
             self.window.wm_title(f"Level Designer - {filepath}")
             self.current_path = filepath
             self.unsaved_changes = False
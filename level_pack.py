@@ -0,0 +1,333 @@
+"""
+Contains the functions for saving levels to, and loading levels from, binary
+level packs. A pack starts with an index of where each level is in the file,
+followed by each level's metadata (including its texture palette) and its
+fixed width tile flag and face texture arrays, in the format used by
+CompactLevel. Packs are memory mapped when loaded, with the arrays used
+directly from the file, so opening a pack takes the same time regardless of
+how large its levels are.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from compact_level import CompactLevel, PLAYER_WALL_FLAG
+from level import Level, LevelState
+
+LEVEL_PACK_EXTENSION = ".mzpack"
+PACK_MAGIC = b"PYMZPACK"
+PACK_VERSION = 1
+# Number of levels kept loaded by LevelPackReader
+LEVEL_CACHE_SIZE = 4
+
+# Magic bytes, format version, and level count
+_PACK_HEADER = struct.Struct("<8sHxxI")
+# Offset and length in bytes of each level record
+_INDEX_ENTRY = struct.Struct("<QQ")
+# Width, height, bytes per face texture id, and metadata length in bytes
+_LEVEL_HEADER = struct.Struct("<IIBxxxI")
+# Every section of a level record starts on a multiple of this many bytes
+_ALIGNMENT = 8
+
+
+def save_level_pack(path: str, levels: List[Level]) -> None:
+    """
+    Serialize and save a list of levels as a binary level pack.
+    """
+    write_level_pack(path, [serialize_level(x) for x in levels])
+
+
+def write_level_pack(path: str, records: List[bytes]) -> None:
+    """
+    Save a list of level records, as created by serialize_level, as a binary
+    level pack. This allows levels to be serialized separately, such as by
+    multiple processes, before being written to a single pack. The pack is
+    written to a temporary file first, then moved over any existing file, so
+    levels still loaded from an old version of the pack are unaffected.
+    """
+    offset = _align(
+        _PACK_HEADER.size + _INDEX_ENTRY.size * len(records)
+    )
+    index = bytearray()
+    for record in records:
+        index += _INDEX_ENTRY.pack(offset, len(record))
+        offset += _align(len(record))
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(_PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(records)))
+        file.write(index)
+        file.write(_padding(file.tell()))
+        for record in records:
+            file.write(record)
+            file.write(_padding(len(record)))
+    os.replace(temp_path, path)
+
+
+def load_level_pack(path: str) -> List[CompactLevel]:
+    """
+    Load every level in a binary level pack as a CompactLevel. The file is
+    memory mapped rather than read, and each level's arrays are read only
+    views of the mapped file until the level is first changed. Use
+    LevelPackReader instead to only load levels as they are needed.
+    """
+    reader = LevelPackReader(path)
+    return [reader.load_level(x) for x in range(len(reader))]
+
+
+@dataclass(frozen=True)
+class LevelMetadata:
+    """
+    A summary of a level in a level pack, read without loading the level.
+    """
+    dimensions: Tuple[int, int]
+    exit_key_count: int
+    key_sensor_count: int
+    gun_count: int
+    monster_count: int
+    edge_wall_texture_name: str
+
+
+class LevelPackReader:
+    """
+    Opens a binary level pack, only loading each level when it is first
+    indexed. The pack header is checked on creation, but nothing else is
+    read until needed, so opening a pack takes the same time and memory
+    regardless of how many levels it holds.
+    The most recently indexed levels are kept, so indexing the same level
+    repeatedly returns the same instance. When a level is dropped from this
+    cache, its play state (as from Level.snapshot) is kept instead and
+    restored if it is loaded again, so the player's progress is never lost.
+    Changes to the level geometry other than player placed walls are lost.
+    """
+    def __init__(self, path: str, cache_size: int = LEVEL_CACHE_SIZE
+                 ) -> None:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < _PACK_HEADER.size:
+                raise ValueError("File is too small to be a level pack")
+            # The map stays open for as long as any level views it
+            pack_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pack_view = memoryview(pack_map)
+        magic, version, self._level_count = _PACK_HEADER.unpack_from(
+            self._pack_view
+        )
+        if magic != PACK_MAGIC:
+            raise ValueError("File is not a level pack")
+        if version != PACK_VERSION:
+            raise ValueError(f"Unsupported level pack version: {version}")
+        if (_PACK_HEADER.size + _INDEX_ENTRY.size * self._level_count
+                > len(self._pack_view)):
+            raise ValueError("Level pack is truncated")
+        self.cache_size = cache_size
+        # Maps level index to each loaded level, least recently used first
+        self._cache: OrderedDict[int, CompactLevel] = OrderedDict()
+        # The play state of levels that have been removed from the cache
+        self._saved_states: Dict[int, LevelState] = {}
+
+    def __len__(self) -> int:
+        return self._level_count
+
+    def __getitem__(self, index: int) -> CompactLevel:
+        """
+        Get the level at an index, loading it if it isn't already loaded.
+        """
+        index = self._check_index(index)
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        new_level = self.load_level(index)
+        saved_state = self._saved_states.pop(index, None)
+        if saved_state is not None:
+            new_level.restore(saved_state)
+        self._cache[index] = new_level
+        while len(self._cache) > self.cache_size:
+            old_index, old_level = self._cache.popitem(last=False)
+            self._saved_states[old_index] = old_level.snapshot()
+        return new_level
+
+    def load_level(self, index: int) -> CompactLevel:
+        """
+        Create a new instance of the level at an index in its original
+        state, without using or adding to the cache.
+        """
+        return _deserialize_level(
+            self._pack_view, *self._get_index_entry(self._check_index(index))
+        )
+
+    def get_metadata(self, index: int) -> LevelMetadata:
+        """
+        Get a summary of the level at an index, reading only its header and
+        metadata rather than loading the level.
+        """
+        offset, length = self._get_index_entry(self._check_index(index))
+        width, height, _, json_dict, _ = _read_level_header(
+            self._pack_view, offset, length
+        )
+        return LevelMetadata(
+            (width, height), len(json_dict['exit_keys']),
+            len(json_dict['key_sensors']), len(json_dict['guns']),
+            0 if json_dict['monster_start'] is None else
+            1 + len(json_dict['extra_monster_starts']),
+            json_dict['edge_wall_texture_name']
+        )
+
+    def _check_index(self, index: int) -> int:
+        """
+        Convert a negative level index to a positive one, raising IndexError
+        if it is out of range.
+        """
+        if index < 0:
+            index += self._level_count
+        if not 0 <= index < self._level_count:
+            raise IndexError("Level index out of range")
+        return index
+
+    def _get_index_entry(self, index: int) -> Tuple[int, int]:
+        """
+        Read the offset and length of a level record from the pack index.
+        """
+        return _INDEX_ENTRY.unpack_from(
+            self._pack_view, _PACK_HEADER.size + _INDEX_ENTRY.size * index
+        )
+
+
+def convert_json_to_pack(json_path: str, pack_path: str) -> None:
+    """
+    Convert a level JSON file to a binary level pack.
+    """
+    with open(json_path, encoding="utf8") as file:
+        json_dicts = json.load(file)
+    save_level_pack(
+        pack_path, [CompactLevel.from_json_dict(x) for x in json_dicts]
+    )
+
+
+def convert_pack_to_json(pack_path: str, json_path: str) -> None:
+    """
+    Convert a binary level pack to a level JSON file.
+    """
+    json_dicts = [x.to_json_dict() for x in load_level_pack(pack_path)]
+    with open(json_path, 'w', encoding="utf8") as file:
+        json.dump(json_dicts, file, separators=(',', ':'))
+
+
+def serialize_level(level: Level) -> bytes:
+    """
+    Convert a single level to a level record, made up of the level header,
+    metadata JSON, tile flags, then face texture ids, each aligned to
+    _ALIGNMENT bytes. Player placed walls are not saved.
+    """
+    tile_count = level.dimensions[0] * level.dimensions[1]
+    if (not isinstance(level, CompactLevel)
+            or len(level.tile_flags) != tile_count):
+        level = CompactLevel.from_json_dict(level.to_json_dict())
+    json_dict = level.contents_to_json_dict()
+    json_dict["texture_palette"] = level.texture_palette
+    metadata = json.dumps(json_dict, separators=(',', ':')).encode()
+    tile_flags = bytes(level.tile_flags).translate(bytes(
+        x & ~PLAYER_WALL_FLAG for x in range(256)
+    ))
+    face_textures = array(
+        'B' if level.face_textures.itemsize == 1 else 'H'
+    )
+    face_textures.frombytes(memoryview(level.face_textures).cast('B'))
+    if sys.byteorder != "little":
+        face_textures.byteswap()
+    record = bytearray(_LEVEL_HEADER.pack(
+        level.dimensions[0], level.dimensions[1],
+        face_textures.itemsize, len(metadata)
+    ))
+    for section in (metadata, tile_flags, face_textures.tobytes()):
+        record += _padding(len(record))
+        record += section
+    return bytes(record)
+
+
+def _read_level_header(pack_view: memoryview, offset: int, length: int
+                       ) -> Tuple[int, int, int, Dict[str, Any], int]:
+    """
+    Read the width, height, bytes per face texture id, and deserialized
+    metadata of the level record at the given offset in a level pack, along
+    with the offset of the tile flags that follow them.
+    """
+    if offset + length > len(pack_view):
+        raise ValueError("Level pack is truncated")
+    width, height, id_size, metadata_length = _LEVEL_HEADER.unpack_from(
+        pack_view, offset
+    )
+    metadata_start = offset + _align(_LEVEL_HEADER.size)
+    if metadata_start + metadata_length > offset + length:
+        raise ValueError("Level record is truncated")
+    json_dict: Dict[str, Any] = json.loads(
+        bytes(pack_view[metadata_start:metadata_start + metadata_length])
+    )
+    return (
+        width, height, id_size, json_dict,
+        metadata_start + _align(metadata_length)
+    )
+
+
+def _deserialize_level(pack_view: memoryview, offset: int, length: int
+                       ) -> CompactLevel:
+    """
+    Create a CompactLevel from the level record at the given offset in a
+    level pack, using views of the pack for its arrays.
+    """
+    width, height, id_size, json_dict, flags_start = _read_level_header(
+        pack_view, offset, length
+    )
+    tile_count = width * height
+    faces_start = flags_start + _align(tile_count)
+    if faces_start + tile_count * 4 * id_size > offset + length:
+        raise ValueError("Level record is truncated")
+    tile_flags = pack_view[flags_start:flags_start + tile_count]
+    face_textures: Any = pack_view[
+        faces_start:faces_start + tile_count * 4 * id_size
+    ].cast('B' if id_size == 1 else 'H')
+    if id_size != 1 and sys.byteorder != "little":
+        # Packs are always little endian, so must be copied to be swapped
+        face_textures = array('H', face_textures)
+        face_textures.byteswap()
+    new_level = CompactLevel.from_arrays(
+        (width, height), tile_flags, face_textures,
+        list(json_dict['texture_palette']),
+        *CompactLevel.contents_from_json_dict(json_dict),
+        json_dict['edge_wall_texture_name']
+    )
+    for monster_start in json_dict['extra_monster_starts']:
+        new_level.add_monster(tuple(monster_start))
+    return new_level
+
+
+def _align(size: int) -> int:
+    """
+    Round a size in bytes up to the next multiple of _ALIGNMENT.
+    """
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _padding(size: int) -> bytes:
+    """
+    Get the zero bytes needed after a section of the given size to align the
+    next section.
+    """
+    return bytes(_align(size) - size)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(
+            "Usage: level_pack.py <input path> <output path>\n"
+            + "Converts level JSON files to level packs, or level packs to "
+            + f"level JSON files if the input ends in {LEVEL_PACK_EXTENSION}"
+        )
+        sys.exit(1)
+    if sys.argv[1].lower().endswith(LEVEL_PACK_EXTENSION):
+        convert_pack_to_json(sys.argv[1], sys.argv[2])
+    else:
+        convert_json_to_pack(sys.argv[1], sys.argv[2])
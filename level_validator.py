@@ -0,0 +1,259 @@
+"""
+Contains the functions for validating every level in a level JSON file or
+binary level pack, and the command line tool for doing so. As well as the
+checks made whenever a level is created, every level is checked for items
+that cannot be reached from the start point, and for textures that don't
+exist. Levels are checked across a pool of processes, so the time taken falls
+with the number of CPU cores. Files without problems can also be converted to
+another format in the same pass.
+"""
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from glob import glob
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import level_pack
+import pathfinding
+from compact_level import CompactLevel
+from level import Level, PLAYER_COLLIDE
+
+# Found relative to this file rather than the working directory, so that
+# paths given on the command line still work as expected
+_TEXTURE_DIRECTORY = os.path.join(os.path.dirname(__file__), "textures")
+WALL_TEXTURE_DIRECTORY = os.path.join(_TEXTURE_DIRECTORY, "wall")
+DECORATION_TEXTURE_DIRECTORY = os.path.join(
+    _TEXTURE_DIRECTORY, "sprite", "decoration"
+)
+# Levels are sent to each worker process in about this many batches, so that
+# the cost of sending each batch is spread over many levels while still
+# leaving batches for idle workers to take.
+BATCHES_PER_PROCESS = 4
+
+# Raised when creating a level from invalid level JSON or a corrupt record
+_LEVEL_ERRORS = (
+    ValueError, TypeError, IndexError, AttributeError, struct.error
+)
+
+# Set in each worker process by _initialise_worker
+_worker_reader: Optional[level_pack.LevelPackReader] = None
+_worker_wall_textures: Set[str] = set()
+_worker_decoration_textures: Set[str] = set()
+_worker_output_pack: Optional[bool] = None
+
+
+@dataclass
+class LevelReport:
+    """
+    The result of validating a single level. problems is empty if the level
+    is valid, and dimensions is None if the level couldn't be loaded at all.
+    """
+    index: int
+    dimensions: Optional[Tuple[int, int]] = None
+    problems: List[str] = field(default_factory=list)
+
+
+def validate_level_file(path: str, output_path: Optional[str] = None,
+                        processes: Optional[int] = None
+                        ) -> List[LevelReport]:
+    """
+    Validate every level in a level JSON file, or a binary level pack if the
+    path ends with level_pack.LEVEL_PACK_EXTENSION, using a pool of the given
+    number of processes (one per CPU core by default). If an output path is
+    given and every level is valid, the levels are also saved there, as a
+    level pack if it ends with level_pack.LEVEL_PACK_EXTENSION, or as level
+    JSON otherwise.
+    """
+    tasks: List[Tuple[int, Optional[Dict[str, Any]]]]
+    if path.lower().endswith(level_pack.LEVEL_PACK_EXTENSION):
+        # Each worker opens the pack itself, so only indices need sending
+        pack_path: Optional[str] = path
+        tasks = [
+            (x, None) for x in range(len(level_pack.LevelPackReader(path)))
+        ]
+    else:
+        pack_path = None
+        with open(path, encoding="utf8") as file:
+            tasks = list(enumerate(json.load(file)))
+    output_pack = (
+        None if output_path is None else
+        output_path.lower().endswith(level_pack.LEVEL_PACK_EXTENSION)
+    )
+    if processes is None:
+        processes = os.cpu_count() or 1
+    with ProcessPoolExecutor(
+            processes, initializer=_initialise_worker, initargs=(
+                pack_path, get_texture_names(WALL_TEXTURE_DIRECTORY),
+                get_texture_names(DECORATION_TEXTURE_DIRECTORY), output_pack
+            )) as executor:
+        results = list(executor.map(
+            _check_level, tasks, chunksize=max(
+                1, len(tasks) // (processes * BATCHES_PER_PROCESS)
+            )
+        ))
+    reports = [x[0] for x in results]
+    if output_path is not None and not any(x.problems for x in reports):
+        if output_pack:
+            level_pack.write_level_pack(output_path, [x[1] for x in results])
+        else:
+            with open(output_path, 'w', encoding="utf8") as file:
+                json.dump(
+                    [x[1] for x in results], file, separators=(',', ':')
+                )
+    return reports
+
+
+def find_unreachable_items(level: Level) -> List[str]:
+    """
+    Get a description of every item (including the end point) that the
+    player cannot reach from the start point.
+    """
+    width = level.dimensions[0]
+    distances = pathfinding.bfs_distances(
+        level.get_collision_grid(PLAYER_COLLIDE), level.dimensions,
+        [level.start_point]
+    )
+    problems: List[str] = []
+    for item_name, tiles in (
+            ("End point", [level.end_point]),
+            ("Key", sorted(level.original_exit_keys)),
+            ("Key sensor", sorted(level.original_key_sensors)),
+            ("Gun", sorted(level.original_guns))):
+        for tile in tiles:
+            if distances[tile[1] * width + tile[0]] == -1:
+                problems.append(
+                    f"{item_name} at {tile} cannot be reached from the start"
+                    + " point"
+                )
+    return problems
+
+
+def find_missing_textures(level: Level, wall_textures: Set[str],
+                          decoration_textures: Set[str]) -> List[str]:
+    """
+    Get a description of every wall and decoration texture used by a level
+    that isn't in the given sets of texture names.
+    """
+    used_wall_textures = level.get_wall_texture_names()
+    return [
+        f"Wall texture '{x}' does not exist"
+        for x in sorted(used_wall_textures - wall_textures)
+    ] + [
+        f"Decoration texture '{x}' does not exist"
+        for x in sorted(set(level.decorations.values()) - decoration_textures)
+    ]
+
+
+def get_texture_names(directory: str) -> Set[str]:
+    """
+    Get the name of every texture in a directory, in the same form as they
+    are referred to by levels.
+    """
+    return {
+        os.path.split(x)[-1].split(".")[0]
+        for x in glob(os.path.join(directory, "*.png"))
+    }
+
+
+def _initialise_worker(pack_path: Optional[str], wall_textures: Set[str],
+                       decoration_textures: Set[str],
+                       output_pack: Optional[bool]) -> None:
+    """
+    Store the values shared by every level checked by a worker process.
+    """
+    global _worker_reader, _worker_wall_textures
+    global _worker_decoration_textures, _worker_output_pack
+    if pack_path is not None:
+        _worker_reader = level_pack.LevelPackReader(pack_path)
+    _worker_wall_textures = wall_textures
+    _worker_decoration_textures = decoration_textures
+    _worker_output_pack = output_pack
+
+
+def _check_level(task: Tuple[int, Optional[Dict[str, Any]]]
+                 ) -> Tuple[LevelReport, Any]:
+    """
+    Validate a level from either its index in the worker's level pack or a
+    deserialized level JSON dictionary. Returns the report, along with the
+    level converted to the output format (a level record or JSON dictionary)
+    if there is one.
+    """
+    index, json_dict = task
+    report = LevelReport(index)
+    try:
+        if json_dict is None:
+            assert _worker_reader is not None
+            new_level = _worker_reader.load_level(index)
+        else:
+            new_level = CompactLevel.from_json_dict(json_dict)
+    except KeyError as error:
+        report.problems.append(
+            f"Level could not be loaded: missing field {error}"
+        )
+        return report, None
+    except _LEVEL_ERRORS as error:
+        report.problems.append(f"Level could not be loaded: {error}")
+        return report, None
+    report.dimensions = new_level.dimensions
+    report.problems += find_unreachable_items(new_level)
+    report.problems += find_missing_textures(
+        new_level, _worker_wall_textures, _worker_decoration_textures
+    )
+    if _worker_output_pack is None:
+        return report, None
+    if _worker_output_pack:
+        return report, level_pack.serialize_level(new_level)
+    return report, new_level.to_json_dict()
+
+
+if __name__ == "__main__":
+    input_path: Optional[str] = None
+    kwargs: Dict[str, Any] = {}
+    report_path: Optional[str] = None
+    for arg in sys.argv[1:]:
+        arg_pair = arg.split("=")
+        if len(arg_pair) == 1 and input_path is None:
+            input_path = arg
+            continue
+        if len(arg_pair) == 2:
+            lower_key = arg_pair[0].lower()
+            if lower_key in ("--output", "-o"):
+                kwargs["output_path"] = arg_pair[1]
+                continue
+            if lower_key in ("--processes", "-p"):
+                kwargs["processes"] = int(arg_pair[1])
+                continue
+            if lower_key in ("--report", "-r"):
+                report_path = arg_pair[1]
+                continue
+        print(f"Unknown argument or missing value: '{arg}'")
+        sys.exit(1)
+    if input_path is None:
+        print(
+            "Usage: level_validator.py <input path> [--output=<path>]"
+            + " [--processes=<count>] [--report=<path>]\n"
+            + "Validates every level in a level JSON file or level pack,"
+            + " writing a JSON report to the report path or standard output."
+            + " If every level is valid and an output path is given, the"
+            + " levels are also saved there as a level pack if it ends in"
+            + f" {level_pack.LEVEL_PACK_EXTENSION}, or level JSON otherwise."
+        )
+        sys.exit(1)
+    level_reports = validate_level_file(input_path, **kwargs)
+    invalid_count = sum(1 for x in level_reports if x.problems)
+    report_json = json.dumps({
+        "path": input_path,
+        "level_count": len(level_reports),
+        "invalid_level_count": invalid_count,
+        "converted": "output_path" in kwargs and invalid_count == 0,
+        "levels": [asdict(x) for x in level_reports]
+    }, indent=4)
+    if report_path is None:
+        print(report_json)
+    else:
+        with open(report_path, 'w', encoding="utf8") as file:
+            file.write(report_json)
+    sys.exit(1 if invalid_count else 0)
@@ -17,6 +17,7 @@ import pygame
 
 import config_loader
 import level
+import level_cache
 import maze_levels
 import net_data
 import netcode
@@ -45,7 +46,9 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
 
     last_config_edit = os.path.getmtime(config_ini_path)
     cfg = config_loader.Config(config_ini_path)
-    levels = maze_levels.load_level_json(level_json_path)
+    levels = maze_levels.load_levels(
+        level_json_path, True, level_cache.DEFAULT_CACHE_DIRECTORY
+    )
     if is_multi:
         try:
             sock = netcode.create_client_socket()
@@ -168,12 +171,16 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
     # [None | (grid_x, grid_y, time_of_placement)]
     player_walls: List[Optional[Tuple[int, int, float]]] = [None] * len(levels)
 
+    # Wall textures for each level are resolved the first time it is drawn.
+    compiled_wall_textures: List[
+        Optional[resources.CompiledWallTextures]
+    ] = [None] * len(levels)
+    # The level whose textures were last requested to be loaded
+    textures_requested_level: Optional[int] = None
+
     # Used to draw level behind victory/reset screens without having to raycast
-    # during every new frame.
-    last_level_frame = [
-        pygame.Surface((cfg.viewport_width, cfg.viewport_height))
-        for _ in range(len(levels))
-    ]
+    # during every new frame. Each is created when its level is first shown.
+    last_level_frame: Dict[int, pygame.Surface] = {}
 
     # Used as both mouse and keyboard can be used to fire.
     def _fire_gun() -> None:
@@ -189,7 +196,7 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
             for sprite in hit_sprites:
                 if sprite.type == raycasting.MONSTER:
                     # Monster was hit by gun
-                    levels[current_level].monster_coords = None
+                    levels[current_level].despawn_monsters_at(sprite.tile)
                     break
             if is_multi:
                 shot_response = netcode.fire_gun(
@@ -217,6 +224,22 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
             cfg = config_loader.Config(config_ini_path)
         # Limit FPS and record time last frame took to render
         frame_time = clock.tick(cfg.frame_rate_limit) / 1000
+        if textures_requested_level != current_level:
+            # Load the textures of the current level first, then prefetch
+            # those of the next level while this one is being played.
+            textures_requested_level = current_level
+            resources.request_level_textures(levels[current_level])
+            if current_level + 1 < len(levels):
+                resources.request_level_textures(
+                    levels[current_level + 1], True
+                )
+        new_wall_textures = resources.finish_loaded_textures()
+        if new_wall_textures:
+            # Levels drawn with the placeholder in place of a texture that
+            # is now loaded swap in the loaded texture's slot.
+            for compiled in compiled_wall_textures:
+                if compiled is not None:
+                    compiled.update_loaded_textures(new_wall_textures)
         if is_multi:
             time_since_server_ping += frame_time
             if time_since_server_ping >= 0.04:
@@ -252,9 +275,10 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                     if ping_response_coop is not None:
                         lvl = levels[current_level]
                         (
-                            lvl.killed, lvl.monster_coords, other_players,
+                            lvl.killed, monster_coords_list, other_players,
                             item_coords
                         ) = ping_response_coop
+                        lvl.monsters.set_all_coords(monster_coords_list)
                         # Remove items no longer present on the server
                         lvl.exit_keys &= item_coords
                         lvl.key_sensors &= item_coords
@@ -281,7 +305,9 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                     pygame.event.set_grab(False)
                 elif is_multi and not is_coop and levels[current_level].killed:
                     netcode.respawn(sock, addr, player_key)
-                    levels[current_level].randomise_player_coords()
+                    levels[current_level].randomise_player_coords(
+                        [x.grid_pos for x in other_players]
+                    )
                 elif not is_reset_prompt_shown:
                     if monster_escape_clicks[current_level] >= 0:
                         if event.key == pygame.K_w:
@@ -289,7 +315,9 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                             if (monster_escape_clicks[current_level]
                                     >= cfg.monster_presses_to_escape):
                                 monster_escape_clicks[current_level] = -1
-                                levels[current_level].monster_coords = None
+                                levels[current_level].despawn_monsters_at(
+                                    levels[current_level].player_grid_coords
+                                )
                     if event.key == pygame.K_f:
                         if not (levels[current_level].won
                                 or levels[current_level].killed or is_multi):
@@ -523,11 +551,10 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
             if pressed_keys[pygame.K_RSHIFT] or pressed_keys[pygame.K_LSHIFT]:
                 if (not is_multi) or is_coop:
                     move_multiplier *= cfg.run_multiplier
-            # Ensure framerate does not affect speed values
+            # Ensure framerate does not affect speed values. Movement is
+            # simulated in fixed steps by the level so needs no scaling here.
             turn_speed_mod = frame_time * cfg.turn_speed
-            move_speed_mod = min(
-                frame_time * cfg.move_speed * move_multiplier, 1.0
-            )
+            move_speed_mod = cfg.move_speed * move_multiplier
             # A set of events that occurred due to player movement
             events: Set[int] = set()
             if (not levels[current_level].won
@@ -561,10 +588,13 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                 ]
                 movement_vector[0] *= move_speed_mod
                 movement_vector[1] *= move_speed_mod
-                events.update(levels[current_level].move_player(
-                    (movement_vector[0], movement_vector[1]),
-                    has_gun[current_level], True, cfg.enable_collision
+                events.update(levels[current_level].advance_player(
+                    (movement_vector[0], movement_vector[1]), frame_time,
+                    has_gun[current_level], cfg.enable_collision
                 ))
+                levels[current_level].evict_distant_chunks(
+                    [levels[current_level].player_coords]
+                )
                 has_started_level[current_level] = True
             if pressed_keys[pygame.K_RIGHT]:
                 old_direction = facing_directions[current_level]
@@ -621,6 +651,10 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                 monster_escape_clicks[current_level] = 0
                 display_map = False
 
+        if current_level not in last_level_frame:
+            last_level_frame[current_level] = pygame.Surface(
+                (cfg.viewport_width, cfg.viewport_height)
+            )
         # Victory screen
         if levels[current_level].won:
             if (not resources.audio_error_occurred
@@ -648,7 +682,7 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                 highscores, current_level, time_scores[current_level],
                 move_scores[current_level], frame_time, is_coop,
                 resources.victory_increment, resources.victory_next_block,
-                level_json_path
+                len(levels)
             )
         # Death screen
         elif levels[current_level].killed:
@@ -837,7 +871,11 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                 )
 
             if not display_map or cfg.enable_cheat_map:
-                columns, sprites = raycasting.get_columns_sprites(
+                columns, sprites = (
+                    raycasting.get_columns_sprites_spans
+                    if cfg.use_span_tracer else
+                    raycasting.get_columns_sprites
+                )(
                     cfg.display_columns, levels[current_level],
                     cfg.draw_maze_edge_as_wall,
                     facing_directions[current_level],
@@ -857,6 +895,12 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
             objects.sort(key=lambda x: x.euclidean_squared, reverse=True)
             # Used for displaying rays on cheat map, not used in rendering.
             ray_end_coords: List[Tuple[float, float]] = []
+            if cfg.textures_enabled and columns and (
+                    compiled_wall_textures[current_level] is None):
+                compiled_wall_textures[current_level] = (
+                    resources.compile_wall_textures(levels[current_level])
+                )
+            current_wall_textures = compiled_wall_textures[current_level]
             for collision_object in objects:
                 if isinstance(collision_object, raycasting.SpriteCollision):
                     # Sprites are just flat images scaled and blitted onto the
@@ -891,7 +935,8 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                         screen, cfg, collision_object.coordinate,
                         levels[current_level].player_coords,
                         camera_planes[current_level],
-                        facing_directions[current_level], selected_sprite
+                        facing_directions[current_level], selected_sprite,
+                        resources.get_mip_chain(selected_sprite)
                     )
                     if collision_object.type == raycasting.MONSTER:
                         # If the monster has been rendered, play the jumpscare
@@ -928,59 +973,44 @@ def maze_game(*, level_json_path: str = "maze_levels.json",
                                 == current_player_wall[:2]):
                             # Select appropriate player wall texture depending
                             # on how long the wall has left until breaking.
-                            both_textures = resources.player_wall_textures[
+                            texture_slot = resources.player_wall_slots[
                                 (
                                     (
                                         time_scores[current_level]
                                         - current_player_wall[2]
                                     ) / cfg.player_wall_time * len(
-                                        resources.player_wall_textures
+                                        resources.player_wall_slots
                                     )
                                 ).__trunc__()
                             ]
                         elif levels[current_level].is_coord_in_bounds(
                                 collision_object.tile):
-                            point = levels[current_level][
-                                collision_object.tile, level.PRESENCE
-                            ]
-                            if isinstance(point, tuple):
-                                texture_name = point[collision_object.side]
-                            else:
-                                # This should logically never happen,
-                                # but just in case — default to edge texture.
-                                texture_name = levels[
-                                    current_level
-                                ].edge_wall_texture_name
-                            try:
-                                both_textures = resources.wall_textures[
-                                    texture_name
-                                ]
-                            except KeyError:
-                                both_textures = resources.wall_textures[
-                                    "placeholder"
-                                ]
+                            assert current_wall_textures is not None
+                            texture_slot = (
+                                current_wall_textures.get_face_slot(
+                                    levels[current_level],
+                                    collision_object.tile,
+                                    collision_object.side
+                                )
+                            )
                         else:
                             # Maze edge was hit and we should render maze edges
                             # as walls at this point.
-                            try:
-                                both_textures = resources.wall_textures[
-                                    levels[
-                                        current_level
-                                    ].edge_wall_texture_name
-                                ]
-                            except KeyError:
-                                both_textures = resources.wall_textures[
-                                    "placeholder"
-                                ]
+                            assert current_wall_textures is not None
+                            texture_slot = current_wall_textures.edge
                         # Select either light or dark texture
                         # depending on side
-                        texture = both_textures[int(side_was_ns)]
                         screen_drawing.draw_textured_column(
                             screen, cfg, collision_object.coordinate,
                             side_was_ns, column_height,
                             collision_object.index,
-                            facing_directions[current_level], texture,
-                            camera_planes[current_level]
+                            facing_directions[current_level],
+                            resources.wall_atlas.surface,
+                            camera_planes[current_level],
+                            resources.wall_atlas.get_position(
+                                texture_slot, side_was_ns
+                            ),
+                            resources.wall_atlas.mip_surfaces
                         )
                     else:
                         screen_drawing.draw_untextured_column(
@@ -0,0 +1,364 @@
+"""
+Contains functions for generating random, always solvable maze levels from a
+seed. Mazes are carved into a flat bytearray of wall flags, which is turned
+into a CompactLevel with whole-array operations, so even very large levels
+are never held as nested lists.
+"""
+import random
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import maze_levels
+import pathfinding
+from compact_level import (
+    CompactLevel, MONSTER_COLLIDE_FLAG, PLAYER_COLLIDE_FLAG, WALL_FLAG
+)
+from level import Level
+
+# Maze carving algorithms
+BACKTRACKER = "backtracker"
+WILSON = "wilson"
+ELLER = "eller"
+
+# Repeated names are picked more often
+DEFAULT_WALL_TEXTURES = (
+    "red_brick", "red_brick", "red_brick", "red_brick", "red_brick",
+    "red_brick_crack1", "red_brick_crack2", "red_brick_mossy"
+)
+DEFAULT_DECORATION_TEXTURES = ("shrub", "skull")
+DEFAULT_MONSTER_WAIT = 60.0
+MONSTER_SPAWN_ATTEMPTS = 64
+
+# Flags for every tile that is part of a generated wall
+_WALL_TILE_FLAGS = WALL_FLAG | PLAYER_COLLIDE_FLAG | MONSTER_COLLIDE_FLAG
+
+
+def generate_level(dimensions: Tuple[int, int], seed: Optional[int] = None,
+                   algorithm: str = BACKTRACKER, key_count: int = 3,
+                   sensor_count: int = 0, gun_count: int = 1,
+                   decoration_count: int = 0,
+                   monster_wait: Optional[float] = DEFAULT_MONSTER_WAIT,
+                   wall_textures: Sequence[str] = DEFAULT_WALL_TEXTURES,
+                   decoration_textures: Sequence[
+                       str] = DEFAULT_DECORATION_TEXTURES,
+                   edge_wall_texture_name: str = "red_brick",
+                   compact: bool = True) -> Level:
+    """
+    Generate a random maze level with the given dimensions, which must both
+    be at least 3. The same seed, arguments, and Python version will always
+    give the same level. The player starts in the top left, and the exit is
+    placed on the tile furthest from it. Keys, key sensors, guns, and
+    decorations are placed on random distinct tiles, and the monster (unless
+    monster_wait is None) spawns at least halfway as far away as the exit.
+    Returns a CompactLevel unless compact is False, which should only be used
+    for small levels.
+    """
+    width, height = dimensions
+    if width < 3 or height < 3:
+        raise ValueError("Maze dimensions must both be at least 3")
+    rng = random.Random(seed)
+    walls = carve_maze(dimensions, rng, algorithm)
+    cell_width = (width - 1) // 2
+    cell_count = cell_width * ((height - 1) // 2)
+
+    start_point = (1, 1)
+    distances = pathfinding.bfs_distances(walls, dimensions, [start_point])
+    furthest = max(distances)
+    end_index = distances.index(furthest)
+    end_point = (end_index % width, end_index // width)
+    if furthest <= 0:
+        raise ValueError("Maze is too small to fit a start and end point")
+    # A carved maze is a spanning tree, so every open tile should already be
+    # reachable. Checked anyway, as a generated level must never be
+    # unsolvable.
+    if distances.count(-1) != walls.count(1):
+        raise RuntimeError("Generated maze is not fully connected")
+
+    item_count = key_count + sensor_count + gun_count + decoration_count
+    if item_count > cell_count - 2:
+        raise ValueError("Too many items to fit in maze of this size")
+    item_points: List[Tuple[int, int]] = []
+    for cell in rng.sample(range(cell_count), min(item_count + 2, cell_count)):
+        point = (2 * (cell % cell_width) + 1, 2 * (cell // cell_width) + 1)
+        if point not in (start_point, end_point):
+            item_points.append(point)
+    item_points = item_points[:item_count]
+    exit_keys = set(item_points[:key_count])
+    key_sensors = set(
+        item_points[key_count:key_count + sensor_count]
+    )
+    guns = set(item_points[
+        key_count + sensor_count:key_count + sensor_count + gun_count
+    ])
+    decorations = {
+        x: rng.choice(decoration_textures)
+        for x in item_points[key_count + sensor_count + gun_count:]
+    }
+
+    monster = None
+    if monster_wait is not None:
+        # Try random cells until one is far enough away, falling back to the
+        # furthest one tried, as small mazes may not have any.
+        monster_index = -1
+        for _ in range(MONSTER_SPAWN_ATTEMPTS):
+            cell = rng.randrange(cell_count)
+            index = (
+                (2 * (cell // cell_width) + 1) * width
+                + 2 * (cell % cell_width) + 1
+            )
+            if index in (end_index, width + 1):
+                continue
+            if (monster_index == -1
+                    or distances[index] > distances[monster_index]):
+                monster_index = index
+                if distances[index] * 2 >= furthest:
+                    break
+        if monster_index == -1:
+            raise ValueError("Maze is too small to fit a monster")
+        monster = (
+            monster_index % width, monster_index // width, monster_wait
+        )
+
+    tile_flags = walls.translate(bytes([0, _WALL_TILE_FLAGS]) + bytes(254))
+    texture_palette = list(dict.fromkeys(wall_textures))
+    # Every byte value maps to one texture, so random bytes give random
+    # textures weighted by how often each name appears in wall_textures.
+    texture_table = bytes(
+        texture_palette.index(wall_textures[x % len(wall_textures)])
+        for x in range(256)
+    )
+    faces = bytearray(width * height * 4)
+    for side in range(4):
+        faces[side::4] = rng.randbytes(width * height).translate(
+            texture_table
+        )
+    face_textures = array('B')
+    face_textures.frombytes(faces)
+
+    if compact:
+        return CompactLevel.from_arrays(
+            dimensions, tile_flags, face_textures, texture_palette,
+            start_point, end_point, exit_keys, key_sensors, guns,
+            decorations, monster, edge_wall_texture_name
+        )
+    wall_map: List[List[Optional[Any]]] = [
+        [
+            tuple(
+                texture_palette[x] for x in faces[
+                    (y * width + x_pos) * 4:(y * width + x_pos + 1) * 4
+                ]
+            ) if walls[y * width + x_pos] else None
+            for x_pos in range(width)
+        ]
+        for y in range(height)
+    ]
+    collision_map = [
+        [(bool(x), bool(x)) for x in walls[y * width:(y + 1) * width]]
+        for y in range(height)
+    ]
+    return Level(
+        dimensions, wall_map, collision_map, start_point, end_point,
+        exit_keys, key_sensors, guns, decorations, monster,
+        edge_wall_texture_name
+    )
+
+
+def carve_maze(dimensions: Tuple[int, int], rng: random.Random,
+               algorithm: str = BACKTRACKER) -> bytearray:
+    """
+    Carve a perfect maze (exactly one path between any two open tiles) with
+    the given algorithm, returning a flat bytearray indexed by
+    (y * width + x) with 1 for walls. Open cells are every tile with odd x
+    and y coordinates, with the tiles between them opened to join them. If a
+    dimension is even, the extra row or column is left as wall.
+    """
+    if algorithm == ELLER:
+        return bytearray().join(iter_eller_rows(dimensions, rng))
+    walls = bytearray(b"\x01") * (dimensions[0] * dimensions[1])
+    if algorithm == BACKTRACKER:
+        _carve_backtracker(walls, dimensions, rng)
+    elif algorithm == WILSON:
+        _carve_wilson(walls, dimensions, rng)
+    else:
+        raise ValueError(f"Unknown maze algorithm: '{algorithm}'")
+    return walls
+
+
+def iter_eller_rows(dimensions: Tuple[int, int], rng: random.Random
+                    ) -> Iterator[bytes]:
+    """
+    Carve a perfect maze with Eller's algorithm, yielding each row of tiles
+    as soon as it is complete, in the same format as carve_maze. Only the
+    current row of cells is kept in memory, so rows can be streamed straight
+    to disk for levels too large to build at once.
+    """
+    width, height = dimensions
+    cell_width = (width - 1) // 2
+    cell_height = (height - 1) // 2
+    invert = bytes([1, 0]) + bytes(254)
+    wall_row = b"\x01" * width
+    yield wall_row
+    # The set each cell in the current row belongs to, and the cells in the
+    # current row belonging to each set.
+    cell_sets = list(range(cell_width))
+    next_set = cell_width
+    for cell_y in range(cell_height):
+        last_row = cell_y == cell_height - 1
+        members: Dict[int, List[int]] = {}
+        for cell_x, cell_set in enumerate(cell_sets):
+            members.setdefault(cell_set, []).append(cell_x)
+        # Randomly join neighbouring cells in different sets, joining all of
+        # them on the last row so that the maze is fully connected.
+        joins = bytearray(cell_width - 1)
+        for cell_x in range(cell_width - 1):
+            left_set = cell_sets[cell_x]
+            right_set = cell_sets[cell_x + 1]
+            if left_set != right_set and (last_row or rng.random() < 0.5):
+                joins[cell_x] = 1
+                # Merge the smaller set into the larger
+                if len(members[left_set]) < len(members[right_set]):
+                    left_set, right_set = right_set, left_set
+                for member in members[right_set]:
+                    cell_sets[member] = left_set
+                members[left_set].extend(members.pop(right_set))
+        row = bytearray(wall_row)
+        row[1:2 * cell_width:2] = bytes(cell_width)
+        row[2:2 * cell_width - 1:2] = joins.translate(invert)
+        yield bytes(row)
+        if last_row:
+            break
+        # Every set must continue down at least once, or it would be cut off
+        drops = bytearray(cell_width)
+        for set_members in members.values():
+            drops[rng.choice(set_members)] = 1
+            for member in set_members:
+                if rng.random() < 0.3:
+                    drops[member] = 1
+        row = bytearray(wall_row)
+        row[1:2 * cell_width:2] = drops.translate(invert)
+        yield bytes(row)
+        for cell_x, dropped in enumerate(drops):
+            if not dropped:
+                cell_sets[cell_x] = next_set
+                next_set += 1
+    for _ in range(2 * cell_height, height):
+        yield wall_row
+
+
+def _get_cell_moves(index: int, width: int, cell_width: int,
+                    cell_height: int) -> List[int]:
+    """
+    Get the index offset to each cell next to the cell at a tile index.
+    """
+    x = index % width
+    y = index // width
+    moves = []
+    if y > 1:
+        moves.append(-2 * width)
+    if x < 2 * cell_width - 1:
+        moves.append(2)
+    if y < 2 * cell_height - 1:
+        moves.append(2 * width)
+    if x > 1:
+        moves.append(-2)
+    return moves
+
+
+def _carve_backtracker(walls: bytearray, dimensions: Tuple[int, int],
+                       rng: random.Random) -> None:
+    """
+    Carve a maze with an iterative recursive backtracker (depth first
+    search), which gives long winding corridors with few branches.
+    """
+    width, height = dimensions
+    cell_width = (width - 1) // 2
+    cell_height = (height - 1) // 2
+    start = width + 1
+    walls[start] = 0
+    stack = [start]
+    while stack:
+        index = stack[-1]
+        # A cell still being a wall means it hasn't been visited
+        options = [
+            x for x in _get_cell_moves(index, width, cell_width, cell_height)
+            if walls[index + x]
+        ]
+        if len(options) == 0:
+            stack.pop()
+            continue
+        move = options[rng.randrange(len(options))]
+        walls[index + move // 2] = 0
+        walls[index + move] = 0
+        stack.append(index + move)
+
+
+def _carve_wilson(walls: bytearray, dimensions: Tuple[int, int],
+                  rng: random.Random) -> None:
+    """
+    Carve a maze with Wilson's algorithm (loop erased random walks), which
+    picks uniformly from every possible maze, so has no bias toward long
+    corridors or short dead ends. Slower than the backtracker for large
+    levels, as the first walks can wander for a long time.
+    """
+    width, height = dimensions
+    cell_width = (width - 1) // 2
+    cell_height = (height - 1) // 2
+    cells = [
+        (2 * y + 1) * width + 2 * x + 1
+        for y in range(cell_height) for x in range(cell_width)
+    ]
+    walls[rng.choice(cells)] = 0
+    # The move last taken from each cell on the current walk. Revisiting a
+    # cell overwrites its move, which erases the loop.
+    walk_moves: Dict[int, int] = {}
+    for cell in cells:
+        if not walls[cell]:
+            continue
+        index = cell
+        while walls[index]:
+            moves = _get_cell_moves(index, width, cell_width, cell_height)
+            move = moves[rng.randrange(len(moves))]
+            walk_moves[index] = move
+            index += move
+        index = cell
+        while walls[index]:
+            move = walk_moves[index]
+            walls[index] = 0
+            walls[index + move // 2] = 0
+            index += move
+        walk_moves.clear()
+
+
+if __name__ == "__main__":
+    kwargs: Dict[str, Any] = {}
+    output_path = "generated_levels.json"
+    level_dimensions = (41, 41)
+    level_count = 1
+    for arg in sys.argv[1:]:
+        arg_pair = arg.split("=")
+        if len(arg_pair) == 2:
+            lower_key = arg_pair[0].lower()
+            if lower_key in ("--size", "-s"):
+                size = arg_pair[1].lower().split("x")
+                level_dimensions = (int(size[0]), int(size[-1]))
+                continue
+            if lower_key in ("--seed", "-e"):
+                kwargs["seed"] = int(arg_pair[1])
+                continue
+            if lower_key in ("--algorithm", "-a"):
+                kwargs["algorithm"] = arg_pair[1].lower()
+                continue
+            if lower_key in ("--count", "-c"):
+                level_count = int(arg_pair[1])
+                continue
+            if lower_key in ("--output", "-o"):
+                output_path = arg_pair[1]
+                continue
+        print(f"Unknown argument or missing value: '{arg}'")
+        sys.exit(1)
+    first_seed = kwargs.pop("seed", random.randrange(2 ** 32))
+    maze_levels.save_level_json(output_path, [
+        generate_level(level_dimensions, first_seed + x, **kwargs)
+        for x in range(level_count)
+    ])
@@ -1,19 +1,38 @@
 """
-Contains the methods for loading and saving to the level JSON file.
+Contains the methods for loading and saving to the level JSON file, or to
+binary level packs.
 """
 import json
+import level_cache
+import level_pack
+from chunked_level import ChunkedLevel
+from compact_level import CompactLevel
 from level import Level
-from typing import List
+from typing import List, Optional, Sequence
 
+# Compact levels with at least this many tiles are loaded as ChunkedLevel
+CHUNKED_LEVEL_MIN_TILES = 512 * 512
 
-def load_level_json(path: str) -> List[Level]:
+
+def load_level_json(path: str, compact: bool = False) -> List[Level]:
     """
     Load and deserialize a level JSON file. The file must be a list of levels
-    as created by the save_level_json function.
+    as created by the save_level_json function. If compact is True, levels
+    will be created as CompactLevel instances, which use far less memory but
+    don't allow their wall and collision maps to be modified directly. Very
+    large levels are created as ChunkedLevel instances instead, which only
+    convert each part of the level when it is first used.
     """
     with open(path, encoding="utf8") as file:
         json_dicts = json.load(file)
-    return [Level.from_json_dict(x) for x in json_dicts]
+    if not compact:
+        return [Level.from_json_dict(x) for x in json_dicts]
+    return [
+        ChunkedLevel.from_json_dict(x)
+        if x['dimensions'][0] * x['dimensions'][1] >= CHUNKED_LEVEL_MIN_TILES
+        else CompactLevel.from_json_dict(x)
+        for x in json_dicts
+    ]
 
 
 def save_level_json(path: str, levels: List[Level]) -> None:
@@ -22,4 +41,40 @@ def save_level_json(path: str, levels: List[Level]) -> None:
     """
     json_dicts = [x.to_json_dict() for x in levels]
     with open(path, 'w', encoding="utf8") as file:
-        json.dump(json_dicts, file)
+        json.dump(json_dicts, file, separators=(',', ':'))
+
+
+def load_levels(path: str, compact: bool = False,
+                cache_directory: Optional[str] = None) -> Sequence[Level]:
+    """
+    Load the levels from either a level JSON file, or a binary level pack if
+    the path ends with level_pack.LEVEL_PACK_EXTENSION. If compact is True,
+    levels from a pack are returned as a LevelPackReader, which only loads
+    each level when it is first indexed. Otherwise, every level is loaded
+    and converted to a Level instance.
+    If compact is True and a cache directory is given, levels from a JSON
+    file are loaded with level_cache, which keeps a compiled copy of each
+    level there so that it only needs to be parsed once.
+    """
+    if not path.lower().endswith(level_pack.LEVEL_PACK_EXTENSION):
+        if compact and cache_directory is not None:
+            return level_cache.load_cached_levels(path, cache_directory)
+        return load_level_json(path, compact)
+    reader = level_pack.LevelPackReader(path)
+    if compact:
+        return reader
+    return [
+        Level.from_json_dict(reader.load_level(x).to_json_dict())
+        for x in range(len(reader))
+    ]
+
+
+def save_levels(path: str, levels: List[Level]) -> None:
+    """
+    Save a list of levels as either a level JSON file, or a binary level pack
+    if the path ends with level_pack.LEVEL_PACK_EXTENSION.
+    """
+    if path.lower().endswith(level_pack.LEVEL_PACK_EXTENSION):
+        level_pack.save_level_pack(path, levels)
+    else:
+        save_level_json(path, levels)
@@ -0,0 +1,225 @@
+"""
+Contains the MonsterGroup class, which stores every monster in a level in
+flat arrays so that they can all be moved in a single step.
+"""
+import random
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pathfinding
+import visibility
+
+# Position of a monster that isn't currently in the level
+UNSPAWNED = -1
+
+
+class MonsterGroup:
+    """
+    Stores the start, current, and previous tile of each monster in a level
+    as flat tile indices (y * width + x) in parallel arrays, with UNSPAWNED
+    for monsters that aren't currently in the level. The number of monsters
+    on each tile is also tracked, so checking for a monster at a tile takes
+    O(1) time regardless of how many monsters there are.
+    """
+    def __init__(self, width: int) -> None:
+        self.width = width
+        self.starts = array('i')
+        self.positions = array('i')
+        self.last_positions = array('i')
+        # Maps each occupied tile index to the number of monsters on it
+        self._occupancy: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def copy(self) -> 'MonsterGroup':
+        """
+        Create an independent copy of this group.
+        """
+        group = MonsterGroup(self.width)
+        group.starts = array('i', self.starts)
+        group.positions = array('i', self.positions)
+        group.last_positions = array('i', self.last_positions)
+        group._occupancy = dict(self._occupancy)
+        return group
+
+    def add(self, start: Tuple[int, int]) -> int:
+        """
+        Add a new monster that will spawn at the given tile, returning its
+        index. The monster is not spawned in immediately.
+        """
+        self.starts.append(self.to_index(start))
+        self.positions.append(UNSPAWNED)
+        self.last_positions.append(UNSPAWNED)
+        return len(self.starts) - 1
+
+    def to_index(self, coords: Tuple[int, int]) -> int:
+        """
+        Convert grid coordinates to a flat tile index.
+        """
+        return coords[1] * self.width + coords[0]
+
+    def to_coords(self, index: int) -> Optional[Tuple[int, int]]:
+        """
+        Convert a flat tile index to grid coordinates, or None if it is
+        UNSPAWNED.
+        """
+        if index == UNSPAWNED:
+            return None
+        return (index % self.width, index // self.width)
+
+    def get_coords(self, monster: int) -> Optional[Tuple[int, int]]:
+        """
+        Get the grid coordinates of a monster, or None if it isn't spawned.
+        """
+        return self.to_coords(self.positions[monster])
+
+    def set_coords(self, monster: int,
+                   coords: Optional[Tuple[int, int]]) -> None:
+        """
+        Move a monster directly to the given grid coordinates, or despawn it
+        if they are None.
+        """
+        self._move(
+            monster, UNSPAWNED if coords is None else self.to_index(coords)
+        )
+
+    def get_all_coords(self) -> List[Optional[Tuple[int, int]]]:
+        """
+        Get the grid coordinates of every monster, with None for monsters
+        that aren't spawned.
+        """
+        return [self.to_coords(x) for x in self.positions]
+
+    def set_all_coords(self, all_coords: Sequence[Optional[Tuple[int, int]]]
+                       ) -> None:
+        """
+        Move every monster to the given coordinates (or despawn those given
+        None), adding monsters that start at their given coordinates if
+        there are more coordinates than monsters. Used by co-op clients to
+        mirror the server.
+        """
+        for monster, coords in enumerate(all_coords):
+            if monster >= len(self.starts):
+                self.add(coords if coords is not None else (0, 0))
+            self.set_coords(monster, coords)
+
+    def set_state(self, positions: Iterable[int],
+                  last_positions: Iterable[int]) -> None:
+        """
+        Replace the current and previous position of every monster with flat
+        tile indices, such as those from a level snapshot.
+        """
+        self.positions = array('i', positions)
+        self.last_positions = array('i', last_positions)
+        self._occupancy = {}
+        for position in self.positions:
+            if position != UNSPAWNED:
+                self._occupancy[position] = (
+                    self._occupancy.get(position, 0) + 1
+                )
+
+    def is_occupied(self, coords: Tuple[int, int]) -> bool:
+        """
+        Check whether there is at least one monster on the given tile.
+        """
+        return self.to_index(coords) in self._occupancy
+
+    def get_occupied_coords(self) -> List[Tuple[int, int]]:
+        """
+        Get the grid coordinates of every tile with a monster on it.
+        """
+        return [(x % self.width, x // self.width) for x in self._occupancy]
+
+    def despawn_at(self, coords: Tuple[int, int]) -> int:
+        """
+        Remove every monster on the given tile from the level, returning how
+        many there were. They will spawn again at their start later.
+        """
+        index = self.to_index(coords)
+        if index not in self._occupancy:
+            return 0
+        despawned = 0
+        for monster, position in enumerate(self.positions):
+            if position == index:
+                self._move(monster, UNSPAWNED)
+                self.last_positions[monster] = UNSPAWNED
+                despawned += 1
+        return despawned
+
+    def despawn_all(self) -> None:
+        """
+        Remove every monster from the level.
+        """
+        self.set_state(
+            [UNSPAWNED] * len(self.starts), [UNSPAWNED] * len(self.starts)
+        )
+
+    def spawn_waiting(self, player_coords: Tuple[int, int],
+                      force: bool) -> None:
+        """
+        Spawn every monster that isn't in the level at its start, as long as
+        the player is at least 2 units away from that start, or force is
+        True.
+        """
+        for monster, position in enumerate(self.positions):
+            if position != UNSPAWNED:
+                continue
+            start = self.starts[monster]
+            if force or (
+                    (start % self.width - player_coords[0]) ** 2
+                    + (start // self.width - player_coords[1]) ** 2 >= 4):
+                self._move(monster, start)
+                self.last_positions[monster] = UNSPAWNED
+
+    def step(self, collision_grid: Sequence[int], height: int,
+             flow_field: pathfinding.FlowField,
+             sight: Sequence[visibility.VisibleSet]) -> None:
+        """
+        Move every spawned monster one tile at once. Monsters on a tile
+        included in any of the sight sets follow the flow field toward its
+        nearest target, all others move in a random direction that doesn't
+        collide with the collision grid and isn't where they just were.
+        """
+        width = self.width
+        positions = self.positions
+        last_positions = self.last_positions
+        bottom_row = (height - 1) * width
+        for monster, position in enumerate(positions):
+            if position == UNSPAWNED:
+                continue
+            following = -1
+            if any((position % width, position // width) in x
+                   for x in sight):
+                following = flow_field.get_next_step_index(position)
+            if following == -1:
+                x = position % width
+                last_position = last_positions[monster]
+                options = [
+                    option for option, valid in (
+                        (position - width, position >= width),
+                        (position + 1, x < width - 1),
+                        (position + width, position < bottom_row),
+                        (position - 1, x > 0)
+                    ) if valid and not collision_grid[option]
+                    and option != last_position
+                ]
+                if len(options) > 0:
+                    following = random.choice(options)
+            last_positions[monster] = position
+            if following != -1:
+                self._move(monster, following)
+
+    def _move(self, monster: int, position: int) -> None:
+        """
+        Set the position of a monster, keeping tile occupancy up to date.
+        """
+        old_position = self.positions[monster]
+        if old_position != UNSPAWNED:
+            if self._occupancy[old_position] == 1:
+                del self._occupancy[old_position]
+            else:
+                self._occupancy[old_position] -= 1
+        if position != UNSPAWNED:
+            self._occupancy[position] = self._occupancy.get(position, 0) + 1
+        self.positions[monster] = position
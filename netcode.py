@@ -64,13 +64,13 @@ def ping_server(sock: socket.socket, addr: Tuple[str, int], player_key: bytes,
 def ping_server_coop(sock: socket.socket, addr: Tuple[str, int],
                      player_key: bytes, coords: Tuple[float, float],
                      ) -> Optional[Tuple[
-                            bool, Optional[Tuple[int, int]],
+                            bool, List[Optional[Tuple[int, int]]],
                             List[net_data.Player], Set[Tuple[int, int]]
                           ]]:
     """
     Tell the server where we currently are, and get whether we're dead, where
-    the monster is, and a list of where all other players are and what items
-    they've picked up.
+    every monster is (None if not spawned), and a list of where all other
+    players are and what items they've picked up.
     Returns None if a response doesn't arrive in a timely manner.
     """
     # Positions are sent as integers with 2 d.p of accuracy from the original
@@ -80,17 +80,22 @@ def ping_server_coop(sock: socket.socket, addr: Tuple[str, int],
     try:
         coords_size = net_data.Coords.byte_size
         player_list_bytes = sock.recvfrom(16384)[0]
-        if len(player_list_bytes) < coords_size + 2:
+        if len(player_list_bytes) < 4:
             raise Exception("Invalid packet for ping. Ignoring.")
         killed = bool(player_list_bytes[0])
-        monster_coords: Optional[Tuple[int, int]] = net_data.Coords.from_bytes(
-            player_list_bytes[1:coords_size + 1]
-        ).to_int_tuple()
-        if monster_coords == (-1, -1):
-            monster_coords = None
+        monster_count = int.from_bytes(player_list_bytes[1:3], "big")
+        monsters_end = monster_count * coords_size + 3
+        if len(player_list_bytes) < monsters_end + 1:
+            raise Exception("Invalid packet for ping. Ignoring.")
+        monster_coords: List[Optional[Tuple[int, int]]] = []
+        for i in range(monster_count):
+            coords = net_data.Coords.from_bytes(player_list_bytes[
+                i * coords_size + 3:(i + 1) * coords_size + 3
+            ]).to_int_tuple()
+            monster_coords.append(None if coords == (-1, -1) else coords)
         player_size = net_data.Player.byte_size
-        player_count = player_list_bytes[coords_size + 1]
-        offset_1 = coords_size + 2
+        player_count = player_list_bytes[monsters_end]
+        offset_1 = monsters_end + 1
         offset_2 = player_size * player_count + offset_1
         return killed, monster_coords, [
             net_data.Player.from_bytes(player_list_bytes[
@@ -0,0 +1,519 @@
+"""
+Contains the grid search functions used for finding paths through levels.
+All functions work on a flat collision grid, as created by
+Level.get_collision_grid, where the tile at (x, y) is at index
+(y * width + x) and a non-zero value means the tile cannot be entered.
+"""
+import heapq
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from typing import (
+    Collection, Deque, Dict, FrozenSet, Iterable, List, Optional, Sequence,
+    Set, Tuple
+)
+
+# The offsets of the four tiles that can be moved to from any tile
+CARDINAL_OFFSETS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# The most stops solve_visiting_order will find the exact best order for.
+# Held-Karp takes O(2^n * n^2) time, so above this a heuristic is used.
+HELD_KARP_STOP_LIMIT = 12
+
+
+@dataclass
+class CollectionRoute:
+    """
+    A route from a start tile that visits every stop and then finishes at an
+    end tile. waypoints holds the start tile, each stop in the order they
+    should be visited, then the end tile. length is the total number of moves
+    needed, and is_optimal is False if the order was found with a heuristic
+    and so may not be the shortest possible.
+    """
+    waypoints: List[Tuple[int, int]]
+    length: int
+    is_optimal: bool
+
+
+class FlowField:
+    """
+    A breadth first search distance field leading to a set of target tiles.
+    Any number of chasers can share one field, each following it toward
+    their nearest target in O(1) per step. When the set of target tiles
+    changes, the search is started again from the new targets, but only
+    continued as far as the tiles that are actually queried, so chasers
+    near their targets never cause the whole level to be searched. Once the
+    search has covered every reachable tile, changes to the collision of a
+    tile are repaired by update_tile in place, in the manner of Lifelong
+    Planning A*, only visiting the tiles whose distance was affected.
+    """
+    def __init__(self) -> None:
+        self.targets: FrozenSet[Tuple[int, int]] = frozenset()
+        self._collision_grid: Sequence[int] = bytearray()
+        self._dimensions = (0, 0)
+        # Any distance at or above this means the tile is unreachable, or
+        # hasn't been reached by the search yet
+        self._unreachable = 0
+        # The current distance of each tile, and the distance it should have
+        # based on its neighbours (its right-hand side value). Tiles where
+        # these differ are yet to be repaired. Expected distances are only
+        # created once the search is complete.
+        self._distances: Optional[array] = None
+        self._expected_distances: Optional[array] = None
+        self._target_indices: Set[int] = set()
+        # Tiles reached by the search whose neighbours haven't been searched
+        # yet, in breadth first order.
+        self._search_queue: Deque[int] = deque()
+
+    def update(self, collision_grid: Sequence[int],
+               dimensions: Tuple[int, int],
+               targets: Iterable[Tuple[int, int]]) -> bool:
+        """
+        Make sure the field leads to the given targets through the given
+        collision grid, starting the search again only if any of them differ
+        from before. Returns True if the search was started again.
+        """
+        targets = frozenset(targets)
+        if (self._distances is not None and targets == self.targets
+                and collision_grid is self._collision_grid
+                and dimensions == self._dimensions):
+            return False
+        self.targets = targets
+        self._collision_grid = collision_grid
+        self._dimensions = dimensions
+        self._unreachable = dimensions[0] * dimensions[1]
+        self._target_indices = {x[1] * dimensions[0] + x[0] for x in targets}
+        self._start_search()
+        return True
+
+    def update_tile(self, tile: Tuple[int, int]) -> None:
+        """
+        Repair the field after the collision of a tile has changed in the
+        collision grid it was last updated with. If the search is complete,
+        this costs time proportional to the number of tiles whose distance
+        changed, rather than the size of the level. Otherwise the search is
+        simply started again.
+        """
+        if self._distances is None:
+            return
+        if self._expected_distances is None:
+            self._start_search()
+            return
+        index = tile[1] * self._dimensions[0] + tile[0]
+        # Heap of (min(distance, expected distance), tile index)
+        queue: List[Tuple[int, int]] = []
+        self._update_expected_distance(index, queue)
+        for neighbour in self._get_neighbour_indices(index):
+            self._update_expected_distance(neighbour, queue)
+        distances = self._distances
+        expected_distances = self._expected_distances
+        while queue:
+            key, index = heapq.heappop(queue)
+            distance = distances[index]
+            expected = expected_distances[index]
+            if distance == expected or key != min(distance, expected):
+                # Already consistent, or a stale queue entry
+                continue
+            if distance > expected:
+                # Distance has decreased, which is final once popped.
+                distances[index] = expected
+            else:
+                # Distance has increased, so the tile must be re-evaluated
+                # after its neighbours are.
+                distances[index] = self._unreachable
+                self._update_expected_distance(index, queue)
+            for neighbour in self._get_neighbour_indices(index):
+                self._update_expected_distance(neighbour, queue)
+
+    def get_distance(self, tile: Tuple[int, int]) -> int:
+        """
+        Get the number of moves from a tile to the nearest target, or -1 if
+        no target can be reached from it.
+        """
+        if self._distances is None:
+            return -1
+        index = tile[1] * self._dimensions[0] + tile[0]
+        self._search_to(index)
+        distance = self._distances[index]
+        return -1 if distance >= self._unreachable else distance
+
+    def get_next_step(self, tile: Tuple[int, int]
+                      ) -> Optional[Tuple[int, int]]:
+        """
+        Get the neighbouring tile that is one move closer to the nearest
+        target, or None if the tile is a target or no target can be reached.
+        Ties are broken in north, east, south, west order.
+        """
+        following = self.get_next_step_index(
+            tile[1] * self._dimensions[0] + tile[0]
+        )
+        if following == -1:
+            return None
+        return (
+            following % self._dimensions[0], following // self._dimensions[0]
+        )
+
+    def get_next_step_index(self, index: int) -> int:
+        """
+        The same as get_next_step, but with tiles given as flat indices
+        (y * width + x), and -1 instead of None.
+        """
+        if self._distances is None:
+            return -1
+        self._search_to(index)
+        distance = self._distances[index]
+        if distance == 0 or distance >= self._unreachable:
+            return -1
+        for neighbour in self._get_neighbour_indices(index):
+            if self._distances[neighbour] == distance - 1:
+                return neighbour
+        return -1
+
+    def _start_search(self) -> None:
+        """
+        Forget every distance other than those of the targets, so that the
+        search continues outward from the targets as tiles are queried.
+        """
+        self._distances = array('i', [self._unreachable]) * (
+            self._dimensions[0] * self._dimensions[1]
+        )
+        self._expected_distances = None
+        self._search_queue = deque()
+        for index in self._target_indices:
+            self._distances[index] = 0
+            self._search_queue.append(index)
+
+    def _search_to(self, index: int) -> None:
+        """
+        Continue the breadth first search from the targets until it reaches
+        the tile at the given flat index, or every reachable tile has been
+        reached. Each tile's distance is final as soon as it is reached.
+        """
+        distances = self._distances
+        assert distances is not None
+        unreachable = self._unreachable
+        if distances[index] < unreachable:
+            return
+        queue = self._search_queue
+        collision_grid = self._collision_grid
+        width, height = self._dimensions
+        bottom_row = (height - 1) * width
+        while queue and distances[index] >= unreachable:
+            current = queue.popleft()
+            next_distance = distances[current] + 1
+            x = current % width
+            for neighbour, valid in (
+                    (current - width, current >= width),
+                    (current + 1, x < width - 1),
+                    (current + width, current < bottom_row),
+                    (current - 1, x > 0)):
+                if (valid and distances[neighbour] >= unreachable
+                        and not collision_grid[neighbour]):
+                    distances[neighbour] = next_distance
+                    queue.append(neighbour)
+        if not queue and self._expected_distances is None:
+            # Every reachable tile has been found, so the field can now be
+            # repaired in place rather than searched again.
+            self._expected_distances = array('i', distances)
+
+    def _update_expected_distance(self, index: int,
+                                  queue: List[Tuple[int, int]]) -> None:
+        """
+        Recalculate what the distance of a tile should be from the current
+        distances of its neighbours, queueing it for repair if that differs
+        from its current distance.
+        """
+        assert self._distances is not None
+        assert self._expected_distances is not None
+        if self._collision_grid[index]:
+            expected = self._unreachable
+        elif index in self._target_indices:
+            expected = 0
+        else:
+            expected = min(
+                [self._distances[x] for x in self._get_neighbour_indices(index)
+                 if not self._collision_grid[x]]
+                + [self._unreachable - 1]
+            ) + 1
+        self._expected_distances[index] = expected
+        if expected != self._distances[index]:
+            heapq.heappush(
+                queue, (min(expected, self._distances[index]), index)
+            )
+
+    def _get_neighbour_indices(self, index: int) -> List[int]:
+        """
+        Get the flat indices of the in-bounds tiles directly north, east,
+        south, or west of the tile at the given flat index.
+        """
+        width, height = self._dimensions
+        x = index % width
+        neighbours = []
+        if index >= width:
+            neighbours.append(index - width)
+        if x < width - 1:
+            neighbours.append(index + 1)
+        if index < (height - 1) * width:
+            neighbours.append(index + width)
+        if x > 0:
+            neighbours.append(index - 1)
+        return neighbours
+
+
+def get_neighbours(tile: Tuple[int, int], dimensions: Tuple[int, int]
+                   ) -> List[Tuple[int, int]]:
+    """
+    Get the in-bounds tiles that are directly north, east, south, or west of
+    the given tile.
+    """
+    return [
+        (tile[0] + x_offset, tile[1] + y_offset)
+        for x_offset, y_offset in CARDINAL_OFFSETS
+        if 0 <= tile[0] + x_offset < dimensions[0]
+        and 0 <= tile[1] + y_offset < dimensions[1]
+    ]
+
+
+def bfs_distances(collision_grid: Sequence[int], dimensions: Tuple[int, int],
+                  sources: Iterable[Tuple[int, int]]) -> array:
+    """
+    Find the number of moves from the nearest source tile to every tile with a
+    breadth first search. The result is a flat array in the same layout as
+    the collision grid, with -1 for tiles that cannot be reached.
+    """
+    width, height = dimensions
+    distances = array('i', [-1]) * (width * height)
+    queue: Deque[int] = deque()
+    for source in sources:
+        index = source[1] * width + source[0]
+        if distances[index] == -1:
+            distances[index] = 0
+            queue.append(index)
+    while queue:
+        index = queue.popleft()
+        next_distance = distances[index] + 1
+        x = index % width
+        for neighbour, valid in (
+                (index - width, index >= width),
+                (index + 1, x < width - 1),
+                (index + width, index < (height - 1) * width),
+                (index - 1, x > 0)):
+            if (valid and distances[neighbour] == -1
+                    and not collision_grid[neighbour]):
+                distances[neighbour] = next_distance
+                queue.append(neighbour)
+    return distances
+
+
+def bfs_path(collision_grid: Sequence[int], dimensions: Tuple[int, int],
+             start: Tuple[int, int], targets: Collection[Tuple[int, int]],
+             blocked_tiles: Collection[Tuple[int, int]] = (),
+             blocked_moves: Collection[
+                 Tuple[Tuple[int, int], Tuple[int, int]]
+             ] = ()) -> Optional[List[Tuple[int, int]]]:
+    """
+    Find the shortest path from the start tile to the closest of the target
+    tiles with a breadth first search, stopping as soon as a target is
+    reached. The path includes both the start and target tile, or is None if
+    no target can be reached. Tiles in blocked_tiles and moves (pairs of
+    from and to tiles) in blocked_moves will be avoided in addition to tiles
+    in the collision grid.
+    """
+    width = dimensions[0]
+    if start in targets:
+        return [start]
+    previous = {start: start}
+    queue: Deque[Tuple[int, int]] = deque([start])
+    while queue:
+        tile = queue.popleft()
+        for neighbour in get_neighbours(tile, dimensions):
+            if (neighbour in previous
+                    or collision_grid[neighbour[1] * width + neighbour[0]]
+                    or neighbour in blocked_tiles
+                    or (tile, neighbour) in blocked_moves):
+                continue
+            previous[neighbour] = tile
+            if neighbour in targets:
+                path = [neighbour]
+                while path[-1] != start:
+                    path.append(previous[path[-1]])
+                path.reverse()
+                return path
+            queue.append(neighbour)
+    return None
+
+
+def k_shortest_paths(collision_grid: Sequence[int],
+                     dimensions: Tuple[int, int], start: Tuple[int, int],
+                     targets: Collection[Tuple[int, int]], max_paths: int
+                     ) -> List[List[Tuple[int, int]]]:
+    """
+    Find up to max_paths of the shortest paths from the start tile to any of
+    the target tiles using Yen's algorithm. Paths never visit a tile more
+    than once, and are sorted by length in ascending order. Each additional
+    path costs at most one breadth first search per tile of the previous
+    path, so the cost is bounded regardless of how open the level is.
+    """
+    shortest = bfs_path(collision_grid, dimensions, start, targets)
+    if shortest is None or max_paths < 1:
+        return []
+    found_paths = [shortest]
+    # Heap of (path length, path) waiting to be accepted
+    candidates: List[Tuple[int, List[Tuple[int, int]]]] = []
+    seen: Set[Tuple[Tuple[int, int], ...]] = {tuple(shortest)}
+    while len(found_paths) < max_paths:
+        previous_path = found_paths[-1]
+        for spur_index in range(len(previous_path) - 1):
+            root_path = previous_path[:spur_index + 1]
+            # Prevent the spur from retaking a move already taken by a found
+            # path sharing this root, or revisiting any of the root's tiles.
+            blocked_moves = {
+                (path[spur_index], path[spur_index + 1])
+                for path in found_paths
+                if len(path) > spur_index + 1
+                and path[:spur_index + 1] == root_path
+            }
+            spur_path = bfs_path(
+                collision_grid, dimensions, root_path[-1], targets,
+                set(root_path[:-1]), blocked_moves
+            )
+            if spur_path is None:
+                continue
+            new_path = root_path[:-1] + spur_path
+            if tuple(new_path) not in seen:
+                seen.add(tuple(new_path))
+                heapq.heappush(candidates, (len(new_path), new_path))
+        if len(candidates) == 0:
+            break
+        found_paths.append(heapq.heappop(candidates)[1])
+    return found_paths
+
+
+def plan_collection_route(collision_grid: Sequence[int],
+                          dimensions: Tuple[int, int],
+                          start: Tuple[int, int],
+                          stops: Collection[Tuple[int, int]],
+                          end: Tuple[int, int]) -> Optional[CollectionRoute]:
+    """
+    Find the shortest route from the start tile that visits every stop in any
+    order before finishing at the end tile, or None if a stop or the end
+    cannot be reached. One breadth first search is run from the start and
+    from each stop to build a matrix of the distances between them, which
+    solve_visiting_order then uses to pick the order.
+    """
+    # Sorted so that equal inputs always give an identical route
+    nodes = [start] + sorted(stops) + [end]
+    width = dimensions[0]
+    distance_matrix: List[List[int]] = []
+    for node in nodes[:-1]:
+        distances = bfs_distances(collision_grid, dimensions, (node,))
+        row = [distances[other[1] * width + other[0]] for other in nodes]
+        if -1 in row:
+            return None
+        distance_matrix.append(row)
+    # Distances are symmetric, so the end's row can be taken from the others
+    distance_matrix.append([row[-1] for row in distance_matrix] + [0])
+    length, order = solve_visiting_order(distance_matrix)
+    return CollectionRoute(
+        [nodes[x] for x in order], length,
+        len(nodes) - 2 <= HELD_KARP_STOP_LIMIT
+    )
+
+
+def solve_visiting_order(distance_matrix: List[List[int]]
+                         ) -> Tuple[int, List[int]]:
+    """
+    Find the order to visit every node of a distance matrix in, starting at
+    the first node and finishing at the last. Returns the total distance and
+    the list of node indices in order, including the first and last. The
+    exact best order is found with Held-Karp dynamic programming if there
+    are no more than HELD_KARP_STOP_LIMIT nodes between the first and last,
+    otherwise a nearest neighbour order improved with 2-opt is used.
+    """
+    stop_count = len(distance_matrix) - 2
+    if stop_count <= HELD_KARP_STOP_LIMIT:
+        return _held_karp(distance_matrix)
+    return _nearest_neighbour_two_opt(distance_matrix)
+
+
+def _held_karp(distance_matrix: List[List[int]]) -> Tuple[int, List[int]]:
+    """
+    Find the exact shortest order to visit every node of a distance matrix,
+    starting at the first node and finishing at the last.
+    """
+    end = len(distance_matrix) - 1
+    stop_count = end - 1
+    if stop_count == 0:
+        return distance_matrix[0][end], [0, end]
+    # best[(visited mask, last stop)] = (distance, previous stop). Stop i is
+    # node i + 1 and is represented by bit i of the mask.
+    best: Dict[Tuple[int, int], Tuple[int, int]] = {
+        (1 << i, i): (distance_matrix[0][i + 1], -1)
+        for i in range(stop_count)
+    }
+    for mask in range(1, 1 << stop_count):
+        for last in range(stop_count):
+            entry = best.get((mask, last))
+            if entry is None:
+                continue
+            last_row = distance_matrix[last + 1]
+            for following in range(stop_count):
+                if mask >> following & 1:
+                    continue
+                key = (mask | 1 << following, following)
+                distance = entry[0] + last_row[following + 1]
+                existing = best.get(key)
+                if existing is None or distance < existing[0]:
+                    best[key] = (distance, last)
+    full_mask = (1 << stop_count) - 1
+    length, last = min(
+        (best[full_mask, i][0] + distance_matrix[i + 1][end], i)
+        for i in range(stop_count)
+    )
+    order = [end]
+    mask = full_mask
+    while last != -1:
+        order.append(last + 1)
+        mask, last = mask & ~(1 << last), best[mask, last][1]
+    order.append(0)
+    order.reverse()
+    return length, order
+
+
+def _nearest_neighbour_two_opt(distance_matrix: List[List[int]]
+                               ) -> Tuple[int, List[int]]:
+    """
+    Find a short, but not necessarily the shortest, order to visit every node
+    of a distance matrix, starting at the first node and finishing at the
+    last. The order is built by always moving to the closest unvisited node,
+    then improved by reversing sections of it while that shortens it.
+    """
+    end = len(distance_matrix) - 1
+    unvisited = set(range(1, end))
+    order = [0]
+    while unvisited:
+        current_row = distance_matrix[order[-1]]
+        following = min(unvisited, key=lambda x: (current_row[x], x))
+        unvisited.remove(following)
+        order.append(following)
+    order.append(end)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(order) - 2):
+            for j in range(i + 1, len(order) - 1):
+                # Change of distance from reversing order[i:j + 1]
+                change = (
+                    distance_matrix[order[i - 1]][order[j]]
+                    + distance_matrix[order[i]][order[j + 1]]
+                    - distance_matrix[order[i - 1]][order[i]]
+                    - distance_matrix[order[j]][order[j + 1]]
+                )
+                if change < 0:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+    length = sum(
+        distance_matrix[order[i]][order[i + 1]]
+        for i in range(len(order) - 1)
+    )
+    return length, order
@@ -2,8 +2,10 @@
 Contains functions related to the raycast rendering used to generate pseudo-3D
 graphics.
 """
+import math
+from collections import deque
 from dataclasses import dataclass
-from typing import List, Optional, Sequence, Tuple
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
 
 import level
 import net_data
@@ -27,6 +29,10 @@ EAST = 1
 SOUTH = 2
 WEST = 3
 
+# Wall faces and tile edges closer to the camera than this (measured along the
+# facing direction) are clipped before being projected onto the screen.
+NEAR_PLANE_DEPTH = 1e-4
+
 
 @dataclass
 class Collision:
@@ -70,7 +76,10 @@ class SpriteCollision(Collision):
 
 def get_first_collision(current_level: level.Level,
                         direction: Tuple[float, float],
-                        edge_is_wall: bool, players: Sequence[net_data.Player]
+                        edge_is_wall: bool, players: Sequence[net_data.Player],
+                        player_tiles: Optional[
+                            Dict[Tuple[int, int], List[int]]
+                        ] = None
                         ) -> Tuple[
                                 Optional[WallCollision], List[SpriteCollision]
                              ]:
@@ -80,7 +89,12 @@ def get_first_collision(current_level: level.Level,
     tuple, of which the first item will be None if no collision occurs before
     the edge of the wall map, or a WallCollision if a collision did occur.
     The second tuple item is always list of SpriteCollision.
+    player_tiles should be the result of index_players_by_tile for the given
+    players list. It will be created if not given, but should be passed in
+    when casting many rays with the same players.
     """
+    if player_tiles is None:
+        player_tiles = index_players_by_tile(players)
     # Prevent divide by 0
     if direction[0] == 0:
         direction = (1e-30, direction[1])
@@ -149,99 +163,22 @@ def get_first_collision(current_level: level.Level,
 
         if current_level.is_coord_in_bounds(current_tile):
             # Collision check
-            if current_level[current_tile, level.PRESENCE]:
+            if current_level.is_wall(current_tile):
                 tile_found = True
             else:
-                sprite_apparent_pos = (
-                    current_tile[0] + 0.5, current_tile[1] + 0.5
-                )
-                if current_tile in current_level.exit_keys:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, KEY
-                    ))
-                elif current_tile in current_level.key_sensors:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, KEY_SENSOR
-                    ))
-                elif current_tile in current_level.guns:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, GUN
-                    ))
-                elif current_tile in current_level.decorations:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, DECORATION
-                    ))
-                elif current_level.end_point == current_tile:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, END_POINT
-                        if len(current_level.exit_keys) > 0 else
-                        END_POINT_ACTIVE
-                    ))
-                elif current_level.monster_start == current_tile:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, MONSTER_SPAWN
-                    ))
-                elif current_level.start_point == current_tile:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, START_POINT
-                    ))
-                if current_level.monster_coords == current_tile:
-                    sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, MONSTER
-                    ))
-                if current_tile in current_level.player_flags:
+                sprites += _get_tile_sprites(current_level, current_tile)
+                for i in player_tiles.get(current_tile, ()):
+                    plr_pos = players[i].pos.to_tuple()
                     sprites.append(SpriteCollision(
-                        sprite_apparent_pos,
-                        no_sqrt_coord_distance(
-                            current_level.player_coords,
-                            sprite_apparent_pos
-                        ), current_tile, FLAG
+                        plr_pos, no_sqrt_coord_distance(
+                            current_level.player_coords, (
+                                current_level.player_coords[0]
+                                + direction[0] * distance,
+                                current_level.player_coords[1]
+                                + direction[1] * distance
+                            )
+                        ), current_tile, OTHER_PLAYER, i
                     ))
-                for i, plr in enumerate(players):
-                    if plr.grid_pos == current_tile:
-                        plr_pos = plr.pos.to_tuple()
-                        sprites.append(SpriteCollision(
-                            plr_pos, no_sqrt_coord_distance(
-                                current_level.player_coords, (
-                                    current_level.player_coords[0]
-                                    + direction[0] * distance,
-                                    current_level.player_coords[1]
-                                    + direction[1] * distance
-                                )
-                            ), current_tile, OTHER_PLAYER, i
-                        ))
         else:
             # Edge of wall map has been reached, yet no wall in sight.
             if edge_is_wall:
@@ -281,6 +218,9 @@ def get_columns_sprites(display_columns: int, current_level: level.Level,
     """
     columns: List[WallCollision] = []
     sprites: List[SpriteCollision] = []
+    # Used to prevent sprites hit by multiple rays being added more than once.
+    found_sprites: Set[Tuple[Tuple[float, float], int]] = set()
+    player_tiles = index_players_by_tile(players)
     for index in range(display_columns):
         camera_x = 2 * index / display_columns - 1
         cast_direction = (
@@ -288,7 +228,7 @@ def get_columns_sprites(display_columns: int, current_level: level.Level,
             direction[1] + camera_plane[1] * camera_x,
         )
         result, new_sprites = get_first_collision(
-            current_level, cast_direction, edge_is_wall, players
+            current_level, cast_direction, edge_is_wall, players, player_tiles
         )
         if result is None:
             columns.append(
@@ -301,12 +241,247 @@ def get_columns_sprites(display_columns: int, current_level: level.Level,
             result.index = index
             columns.append(result)
         for new in new_sprites:
-            if (new.coordinate, new.type) not in (
-                    (x.coordinate, x.type) for x in sprites):
+            if (new.coordinate, new.type) not in found_sprites:
+                found_sprites.add((new.coordinate, new.type))
                 sprites.append(new)
     return columns, sprites
 
 
+def get_columns_sprites_spans(display_columns: int,
+                              current_level: level.Level, edge_is_wall: bool,
+                              direction: Tuple[float, float],
+                              camera_plane: Tuple[float, float],
+                              players: List[net_data.Player]
+                              ) -> Tuple[
+                                  List[WallCollision], List[SpriteCollision]
+                              ]:
+    """
+    An alternative to get_columns_sprites that gives the same per-column
+    results without casting a ray for every column. Tiles are walked outward
+    from the player through tile edges that are visible on screen, and every
+    wall face bordering a walked tile is projected onto the range of columns
+    it spans, with the distance and collision coordinate interpolated across
+    that span. The cost is proportional to the number of visible wall faces
+    rather than the number of display columns.
+    """
+    player_tile = current_level.player_grid_coords
+    if (not current_level.is_coord_in_bounds(player_tile)
+            or current_level.is_wall(player_tile)):
+        # There are no open tiles to walk if the player is inside a wall
+        # (possible with collision disabled), so just raycast as normal.
+        return get_columns_sprites(
+            display_columns, current_level, edge_is_wall, direction,
+            camera_plane, players
+        )
+    player_x, player_y = current_level.player_coords
+    inverse_determinant = 1 / (
+        camera_plane[0] * direction[1] - direction[0] * camera_plane[1]
+    )
+    half_columns = display_columns / 2
+    # The closest wall distance found so far for each column, along with the
+    # collision coordinate, tile, and side that was hit.
+    depths = [float('inf')] * display_columns
+    hits: List[Optional[Tuple[Tuple[float, float], Tuple[int, int], int]]] = [
+        None
+    ] * display_columns
+
+    def project_edge(start: Tuple[float, float], end: Tuple[float, float],
+                     window: Tuple[int, int]
+                     ) -> Optional[Tuple[int, int, float, float, float,
+                                         float, float, float]]:
+        """
+        Project a tile edge onto the screen, clipping it against the near
+        plane. Returns None if no part of the edge is within the given window
+        of columns, otherwise the first and last columns covered, the screen
+        position of each (clipped) end, the inverse depth of each end, and
+        how far along the edge each end is.
+        """
+        start_x = start[0] - player_x
+        start_y = start[1] - player_y
+        end_x = end[0] - player_x
+        end_y = end[1] - player_y
+        start_camera = inverse_determinant * (
+            direction[1] * start_x - direction[0] * start_y
+        )
+        start_depth = inverse_determinant * (
+            camera_plane[0] * start_y - camera_plane[1] * start_x
+        )
+        end_camera = inverse_determinant * (
+            direction[1] * end_x - direction[0] * end_y
+        )
+        end_depth = inverse_determinant * (
+            camera_plane[0] * end_y - camera_plane[1] * end_x
+        )
+        if start_depth < NEAR_PLANE_DEPTH and end_depth < NEAR_PLANE_DEPTH:
+            # Edge is entirely behind the camera
+            return None
+        start_along = 0.0
+        end_along = 1.0
+        if start_depth < NEAR_PLANE_DEPTH:
+            start_along = (
+                (NEAR_PLANE_DEPTH - start_depth) / (end_depth - start_depth)
+            )
+            start_camera += start_along * (end_camera - start_camera)
+            start_depth = NEAR_PLANE_DEPTH
+        elif end_depth < NEAR_PLANE_DEPTH:
+            end_along = 1 - (
+                (NEAR_PLANE_DEPTH - end_depth) / (start_depth - end_depth)
+            )
+            end_camera += (1 - end_along) * (start_camera - end_camera)
+            end_depth = NEAR_PLANE_DEPTH
+        start_screen = start_camera / start_depth
+        end_screen = end_camera / end_depth
+        # Columns exactly on the boundary between two edges are given to both
+        # of them so that rounding errors can never leave a gap.
+        first_column = max(window[0], math.ceil(
+            (min(start_screen, end_screen) + 1) * half_columns - 1e-9
+        ))
+        last_column = min(window[1], math.floor(
+            (max(start_screen, end_screen) + 1) * half_columns + 1e-9
+        ))
+        if first_column > last_column:
+            return None
+        return (
+            first_column, last_column, start_screen, end_screen,
+            1 / start_depth, 1 / end_depth, start_along, end_along
+        )
+
+    def draw_face(projection: Tuple[int, int, float, float, float, float,
+                                    float, float],
+                  horizontal: bool, edge_position: Tuple[int, int],
+                  tile: Tuple[int, int], side: int) -> None:
+        """
+        Fill the projected span of a wall face into every column where it is
+        closer than any face found previously. Inverse depth and texture
+        position divided by depth are linear in screen space, so they are
+        interpolated rather than intersecting each column's ray separately.
+        """
+        (
+            first_column, last_column, start_screen, end_screen,
+            start_inverse, end_inverse, start_along, end_along
+        ) = projection
+        fixed_coord = edge_position[1] if horizontal else edge_position[0]
+        along_base = edge_position[0] if horizontal else edge_position[1]
+        start_over_depth = (along_base + start_along) * start_inverse
+        end_over_depth = (along_base + end_along) * end_inverse
+        screen_span = end_screen - start_screen
+        for index in range(first_column, last_column + 1):
+            if screen_span == 0:
+                fraction = 0.0
+            else:
+                fraction = min(1.0, max(0.0, (
+                    (2 * index / display_columns - 1 - start_screen)
+                    / screen_span
+                )))
+            depth = 1 / (
+                start_inverse + fraction * (end_inverse - start_inverse)
+            )
+            if depth >= depths[index]:
+                continue
+            along = depth * (
+                start_over_depth
+                + fraction * (end_over_depth - start_over_depth)
+            )
+            depths[index] = depth
+            hits[index] = (
+                (along, fixed_coord) if horizontal else (fixed_coord, along),
+                tile, side
+            )
+
+    # The range of columns (inclusive) through which each tile can be seen.
+    windows: Dict[Tuple[int, int], Tuple[int, int]] = {
+        player_tile: (0, display_columns - 1)
+    }
+    to_walk: Deque[Tuple[int, int]] = deque([player_tile])
+    queued: Set[Tuple[int, int]] = {player_tile}
+    while to_walk:
+        tile = to_walk.popleft()
+        queued.remove(tile)
+        window = windows[tile]
+        # Only edges facing away from the player are walked through, as
+        # anything on the other side of the remaining edges is either
+        # behind the player or has already been walked.
+        for neighbour, edge_start, edge_end, horizontal, side, facing in (
+                ((tile[0], tile[1] - 1), tile, (tile[0] + 1, tile[1]),
+                 True, SOUTH, player_y >= tile[1]),
+                ((tile[0] + 1, tile[1]), (tile[0] + 1, tile[1]),
+                 (tile[0] + 1, tile[1] + 1), False, WEST,
+                 player_x <= tile[0] + 1),
+                ((tile[0], tile[1] + 1), (tile[0], tile[1] + 1),
+                 (tile[0] + 1, tile[1] + 1), True, NORTH,
+                 player_y <= tile[1] + 1),
+                ((tile[0] - 1, tile[1]), tile, (tile[0], tile[1] + 1),
+                 False, EAST, player_x >= tile[0])):
+            if not facing:
+                continue
+            projection = project_edge(edge_start, edge_end, window)
+            if projection is None:
+                continue
+            if not current_level.is_coord_in_bounds(neighbour):
+                if edge_is_wall:
+                    draw_face(projection, horizontal, edge_start, neighbour,
+                              side)
+            elif current_level.is_wall(neighbour):
+                draw_face(projection, horizontal, edge_start, neighbour, side)
+            else:
+                new_window = (projection[0], projection[1])
+                old_window = windows.get(neighbour)
+                if old_window is not None:
+                    new_window = (
+                        min(old_window[0], new_window[0]),
+                        max(old_window[1], new_window[1])
+                    )
+                    if new_window == old_window:
+                        continue
+                windows[neighbour] = new_window
+                if neighbour not in queued:
+                    queued.add(neighbour)
+                    to_walk.append(neighbour)
+
+    columns: List[WallCollision] = []
+    for index, hit in enumerate(hits):
+        if hit is None:
+            columns.append(
+                WallCollision(
+                    (0.0, 0.0), float('inf'), (0, 0), float('inf'), NORTH,
+                    index
+                )
+            )
+        else:
+            coordinate, tile, side = hit
+            columns.append(WallCollision(
+                coordinate, no_sqrt_coord_distance(
+                    current_level.player_coords, coordinate
+                ), tile, depths[index], side, index
+            ))
+    sprites: List[SpriteCollision] = []
+    player_tiles = index_players_by_tile(players)
+    for tile in windows:
+        sprites += _get_tile_sprites(current_level, tile)
+        for i in player_tiles.get(tile, ()):
+            plr_pos = players[i].pos.to_tuple()
+            sprites.append(SpriteCollision(
+                plr_pos, no_sqrt_coord_distance(
+                    current_level.player_coords, plr_pos
+                ), tile, OTHER_PLAYER, i
+            ))
+    return columns, sprites
+
+
+def index_players_by_tile(players: Sequence[net_data.Player]
+                          ) -> Dict[Tuple[int, int], List[int]]:
+    """
+    Group the indices of a list of players by the grid tile that each of them
+    is in, so that the players in a tile a ray passes through can be found
+    without checking every player. Should be created once per frame (or shot)
+    and reused for every ray cast with the same players list.
+    """
+    player_tiles: Dict[Tuple[int, int], List[int]] = {}
+    for i, plr in enumerate(players):
+        player_tiles.setdefault(plr.grid_pos, []).append(i)
+    return player_tiles
+
+
 def no_sqrt_coord_distance(coord_a: Tuple[float, float],
                            coord_b: Tuple[float, float]) -> float:
     """
@@ -316,3 +491,55 @@ def no_sqrt_coord_distance(coord_a: Tuple[float, float],
     # (euclidean distance is never used for actual render distance — that would
     # cause fisheye)
     return (coord_b[0] - coord_a[0]) ** 2 + (coord_b[1] - coord_a[1]) ** 2
+
+
+def _get_tile_sprites(current_level: level.Level, tile: Tuple[int, int]
+                      ) -> List[SpriteCollision]:
+    """
+    Get every sprite (excluding other players) that is present on a
+    particular tile as SpriteCollision instances.
+    """
+    sprites: List[SpriteCollision] = []
+    sprite_apparent_pos = (tile[0] + 0.5, tile[1] + 0.5)
+    sprite_distance = no_sqrt_coord_distance(
+        current_level.player_coords, sprite_apparent_pos
+    )
+    if tile in current_level.exit_keys:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, KEY
+        ))
+    elif tile in current_level.key_sensors:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, KEY_SENSOR
+        ))
+    elif tile in current_level.guns:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, GUN
+        ))
+    elif tile in current_level.decorations:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, DECORATION
+        ))
+    elif current_level.end_point == tile:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile,
+            END_POINT if len(current_level.exit_keys) > 0 else
+            END_POINT_ACTIVE
+        ))
+    elif current_level.monster_start == tile:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, MONSTER_SPAWN
+        ))
+    elif current_level.start_point == tile:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, START_POINT
+        ))
+    if current_level.monsters.is_occupied(tile):
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, MONSTER
+        ))
+    if tile in current_level.player_flags:
+        sprites.append(SpriteCollision(
+            sprite_apparent_pos, sprite_distance, tile, FLAG
+        ))
+    return sprites
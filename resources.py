@@ -1,14 +1,22 @@
 """
 Contains most of the resources used by the game, including textures and sound effects.
 """
+import itertools
 import os
+import queue
+import threading
+from array import array
+from dataclasses import dataclass, field
 from glob import glob
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 import pygame
 
+import asset_pack
 import raycasting
 import screen_drawing
+import level
+from compact_level import CompactLevel
 from maze_game import TEXTURE_WIDTH, TEXTURE_HEIGHT, EmptySound
 
 # Change working directory to the directory where the script is located.
@@ -21,15 +29,28 @@ _: Any
 texture_cache: Dict[str, pygame.Surface] = {}
 sound_cache: Dict[str, Union[pygame.mixer.Sound, EmptySound]] = {}
 
+# Holds pre-decoded copies of textures and sounds, if one has been built with
+# asset_pack.py. Files are still used for anything the pack is missing or has
+# an outdated copy of.
+_asset_pack = asset_pack.open_asset_pack()
+
+def decode_image(image_path: str) -> pygame.Surface:
+    """
+    Decode an image from the asset pack, or from its file if the pack doesn't
+    have an up to date copy. The image still needs converting before use.
+    """
+    image = None if _asset_pack is None else _asset_pack.load_image(image_path)
+    return pygame.image.load(image_path) if image is None else image
+
 def load_texture(texture_path: str, use_alpha: bool = False) -> pygame.Surface:
     """Load a texture from a file and cache it for reuse."""
     if texture_path in texture_cache:
         return texture_cache[texture_path]
     try:
         texture = (
-            pygame.image.load(texture_path).convert_alpha()
+            decode_image(texture_path).convert_alpha()
             if use_alpha
-            else pygame.image.load(texture_path).convert()
+            else decode_image(texture_path).convert()
         )
         texture_cache[texture_path] = texture
         print(f"Loaded texture: {texture_path}")  # Debugging
@@ -44,9 +65,9 @@ def reload_texture(texture_path: str, use_alpha: bool = False) -> pygame.Surface
     """Force reload a texture, updating the cache."""
     try:
         texture = (
-            pygame.image.load(texture_path).convert_alpha()
+            decode_image(texture_path).convert_alpha()
             if use_alpha
-            else pygame.image.load(texture_path).convert()
+            else decode_image(texture_path).convert()
         )
         texture_cache[texture_path] = texture
         print(f"Reloaded texture: {texture_path}")  # Debugging
@@ -62,7 +83,9 @@ def load_sound(sound_path: str) -> Union[pygame.mixer.Sound, EmptySound]:
     if sound_path in sound_cache:
         return sound_cache[sound_path]
     try:
-        sound = pygame.mixer.Sound(sound_path)
+        sound = None if _asset_pack is None else _asset_pack.load_sound(sound_path)
+        if sound is None:
+            sound = pygame.mixer.Sound(sound_path)
         sound_cache[sound_path] = sound
         return sound
     except (FileNotFoundError, pygame.error):
@@ -79,23 +102,333 @@ _darkener = pygame.Surface((TEXTURE_WIDTH, TEXTURE_HEIGHT))
 _darkener.fill(screen_drawing.BLACK)
 _darkener.set_alpha(127)
 
-# Load wall textures
-wall_textures: Dict[str, Tuple[pygame.Surface, pygame.Surface]] = {}
-for texture_file in glob(os.path.join("textures", "wall", "*.png")):
-    texture_name = os.path.split(texture_file)[-1].split(".")[0]
-    light_texture = load_texture(texture_file)
-    dark_texture = light_texture.copy()
-    dark_texture.blit(_darkener, (0, 0))
-    wall_textures[texture_name] = (light_texture, dark_texture)
-
-# Add placeholder wall texture
-wall_textures["placeholder"] = (placeholder_texture, placeholder_texture.copy())
-
-# Load decoration textures
-decoration_textures: Dict[str, pygame.Surface] = {
-    os.path.split(x)[-1].split(".")[0]: load_texture(x, use_alpha=True)
-    for x in glob(os.path.join("textures", "sprite", "decoration", "*.png"))
-}
+# The number of textures side by side in each row of a TextureAtlas
+ATLAS_COLUMNS = 16
+# The number of times wall textures are halved in size for their mip chain,
+# the last of which is a single pixel
+MIP_LEVEL_COUNT = min(TEXTURE_WIDTH, TEXTURE_HEIGHT).bit_length() - 1
+
+
+def halve_texture(texture: pygame.Surface) -> pygame.Surface:
+    """
+    Create a copy of a texture at half the width and height (but no smaller
+    than a single pixel), averaging the pixels being combined so that the
+    texture doesn't shimmer when drawn at a distance.
+    """
+    half_size = (
+        max(1, texture.get_width() // 2), max(1, texture.get_height() // 2)
+    )
+    try:
+        return pygame.transform.smoothscale(texture, half_size)
+    except ValueError:
+        # Smooth scaling is only supported for 24 and 32 bit surfaces
+        return pygame.transform.scale(texture, half_size)
+
+
+# Maps sprite textures to their mip chain, as created by get_mip_chain
+_mip_chains: Dict[pygame.Surface, List[pygame.Surface]] = {}
+
+
+def get_mip_chain(texture: pygame.Surface) -> List[pygame.Surface]:
+    """
+    Get a list of copies of a texture, each half the size of the one before,
+    starting with half the size of the texture and ending with a single
+    pixel. The chain is created the first time it is requested, then kept.
+    """
+    mip_chain = _mip_chains.get(texture)
+    if mip_chain is None:
+        mip_chain = [halve_texture(texture)]
+        while mip_chain[-1].get_size() != (1, 1):
+            mip_chain.append(halve_texture(mip_chain[-1]))
+        _mip_chains[texture] = mip_chain
+    return mip_chain
+
+
+class TextureAtlas:
+    """
+    Stores the light and dark versions of many wall textures in a single
+    surface, so that every wall column is sampled from the same surface and
+    the dark version of each texture is drawn in place rather than copied.
+    Each texture is given a slot, numbered in the order textures are added.
+    Slots are laid out in rows of ATLAS_COLUMNS, with the dark version of
+    each row directly below the light version. mip_surfaces holds the mip
+    chain of the atlas, each with the same layout as the one before at half
+    the size. When the atlas is full every surface is replaced with a larger
+    one, with every slot kept in place, so the surfaces should not be kept
+    between frames.
+    """
+    def __init__(self) -> None:
+        self.surface = pygame.Surface(
+            (ATLAS_COLUMNS * TEXTURE_WIDTH, 2 * TEXTURE_HEIGHT)
+        ).convert()
+        self.mip_surfaces = [
+            pygame.Surface((
+                self.surface.get_width() >> x, self.surface.get_height() >> x
+            )).convert()
+            for x in range(1, MIP_LEVEL_COUNT + 1)
+        ]
+        self.slot_count = 0
+
+    def add(self, texture: pygame.Surface) -> int:
+        """
+        Draw a texture and its dark version into the next free slot, scaling
+        it to the texture size if needed, and return the slot.
+        """
+        if texture.get_size() != (TEXTURE_WIDTH, TEXTURE_HEIGHT):
+            texture = pygame.transform.scale(
+                texture, (TEXTURE_WIDTH, TEXTURE_HEIGHT)
+            )
+        slot = self.slot_count
+        x, y = self.get_position(slot, False)
+        if y + 2 * TEXTURE_HEIGHT > self.surface.get_height():
+            # Double the number of rows, keeping the existing rows in place
+            self.surface = _double_height(self.surface)
+            self.mip_surfaces = [
+                _double_height(x) for x in self.mip_surfaces
+            ]
+        self.surface.blit(texture, (x, y))
+        self.surface.blit(texture, (x, y + TEXTURE_HEIGHT))
+        self.surface.blit(_darkener, (x, y + TEXTURE_HEIGHT))
+        light_mip = texture
+        dark_mip = self.surface.subsurface(
+            x, y + TEXTURE_HEIGHT, TEXTURE_WIDTH, TEXTURE_HEIGHT
+        )
+        for mip_level, mip_surface in enumerate(self.mip_surfaces, 1):
+            light_mip = halve_texture(light_mip)
+            dark_mip = halve_texture(dark_mip)
+            mip_surface.blit(light_mip, (x >> mip_level, y >> mip_level))
+            mip_surface.blit(dark_mip, (
+                x >> mip_level, (y + TEXTURE_HEIGHT) >> mip_level
+            ))
+        self.slot_count += 1
+        return slot
+
+    @staticmethod
+    def get_position(slot: int, dark: bool) -> Tuple[int, int]:
+        """
+        Get the position in the atlas surface of the top left of the light or
+        dark version of the texture in a slot.
+        """
+        return (
+            slot % ATLAS_COLUMNS * TEXTURE_WIDTH,
+            (slot // ATLAS_COLUMNS * 2 + dark) * TEXTURE_HEIGHT
+        )
+
+
+def _double_height(surface: pygame.Surface) -> pygame.Surface:
+    """
+    Create a copy of a surface with twice the height, with the original
+    surface at the top.
+    """
+    new_surface = pygame.Surface(
+        (surface.get_width(), surface.get_height() * 2)
+    ).convert()
+    new_surface.blit(surface, (0, 0))
+    return new_surface
+
+
+# Holds every wall and player wall texture
+wall_atlas = TextureAtlas()
+PLACEHOLDER_SLOT = wall_atlas.add(placeholder_texture)
+
+# Wall and decoration textures are only loaded for the levels being played,
+# by a background thread, so are added to these as they become ready.
+# See request_level_textures.
+WALL_TEXTURE_DIRECTORY = os.path.join("textures", "wall")
+DECORATION_TEXTURE_DIRECTORY = os.path.join("textures", "sprite", "decoration")
+# Maps wall texture names to their slot in wall_atlas
+wall_texture_slots: Dict[str, int] = {}
+
+# Background texture loads with lower priorities are done first
+CURRENT_LEVEL_PRIORITY = 0
+PREFETCH_PRIORITY = 1
+# Stored in _requested_textures for textures that have finished loading
+_FINISHED = -1
+
+# (priority, order of request, texture directory, texture name)
+_texture_requests: "queue.PriorityQueue[Tuple[int, int, str, str]]" = (
+    queue.PriorityQueue()
+)
+# (texture directory, texture name, decoded image or None if not found)
+_decoded_textures: "queue.Queue[Tuple[str, str, Optional[pygame.Surface]]]" = (
+    queue.Queue()
+)
+# Maps (texture directory, texture name) to the priority it was last
+# requested with. Only used by the main thread.
+_requested_textures: Dict[Tuple[str, str], int] = {}
+_request_order = itertools.count()
+
+
+def _decode_requested_textures() -> None:
+    """
+    Decode requested textures one at a time, most urgent first, for
+    finish_loaded_textures to prepare. Runs forever on a background thread.
+    Converting surfaces to the display format isn't safe outside the main
+    thread, so is left to finish_loaded_textures.
+    """
+    decoded: Set[Tuple[str, str]] = set()
+    while True:
+        _, _, directory, texture_name = _texture_requests.get()
+        if (directory, texture_name) in decoded:
+            # Requested again with a higher priority before it was decoded
+            continue
+        decoded.add((directory, texture_name))
+        try:
+            image: Optional[pygame.Surface] = decode_image(
+                os.path.join(directory, texture_name + ".png")
+            )
+        except (FileNotFoundError, pygame.error):
+            image = None
+        _decoded_textures.put((directory, texture_name, image))
+
+
+threading.Thread(target=_decode_requested_textures, daemon=True).start()
+
+
+def request_level_textures(current_level: level.Level,
+                           prefetch: bool = False) -> None:
+    """
+    Queue every wall and decoration texture used by a level to be loaded in
+    the background, if it hasn't been already. Textures requested with
+    prefetch set to True, such as for the next level, are only loaded once
+    every other requested texture has been.
+    """
+    priority = PREFETCH_PRIORITY if prefetch else CURRENT_LEVEL_PRIORITY
+    for directory, texture_names in (
+            (WALL_TEXTURE_DIRECTORY, current_level.get_wall_texture_names()),
+            (DECORATION_TEXTURE_DIRECTORY,
+             set(current_level.decorations.values()))):
+        for texture_name in texture_names:
+            key = (directory, texture_name)
+            if _requested_textures.get(key, PREFETCH_PRIORITY + 1) > priority:
+                _requested_textures[key] = priority
+                _texture_requests.put(
+                    (priority, next(_request_order), directory, texture_name)
+                )
+
+
+def finish_loaded_textures() -> Set[str]:
+    """
+    Prepare every texture decoded in the background since the last call,
+    adding them to wall_atlas or decoration_textures. Should be called
+    every frame. Returns the names of the wall textures added, to be given
+    to the update_loaded_textures method of every CompiledWallTextures.
+    """
+    new_wall_textures: Set[str] = set()
+    while True:
+        try:
+            directory, texture_name, image = _decoded_textures.get_nowait()
+        except queue.Empty:
+            return new_wall_textures
+        _requested_textures[(directory, texture_name)] = _FINISHED
+        if image is None:
+            print(f"Texture not found: {texture_name}")
+        elif directory == WALL_TEXTURE_DIRECTORY:
+            wall_texture_slots[texture_name] = wall_atlas.add(image.convert())
+            new_wall_textures.add(texture_name)
+        else:
+            decoration_textures[texture_name] = image.convert_alpha()
+            get_mip_chain(decoration_textures[texture_name])
+
+
+@dataclass
+class CompiledWallTextures:
+    """
+    The wall_atlas slot of each texture in a level's texture palette, so that
+    drawing a column only requires the texture id of its face to be looked up
+    in slots, rather than every face of the level being resolved. Levels
+    without a texture palette of their own (any that aren't a CompactLevel)
+    have one built up in palette and texture_ids as their faces are drawn.
+    Textures that couldn't be found use the placeholder, as do those in
+    pending, which were still loading when they were resolved and are
+    replaced by update_loaded_textures once loaded.
+    """
+    palette: List[str]
+    slots: array
+    edge_name: str
+    edge: int
+    pending: Set[str]
+    texture_ids: Dict[str, int] = field(default_factory=dict)
+
+    def get_face_slot(self, current_level: level.Level,
+                      tile: Tuple[int, int], side: int) -> int:
+        """
+        Get the slot of the texture on one side of the wall at a tile, or of
+        the edge texture if the tile has no wall textures, such as a player
+        placed wall. Textures added to the level's palette since it was
+        compiled are resolved as they are first drawn.
+        """
+        if isinstance(current_level, CompactLevel):
+            texture_id = current_level.get_face_texture_id(tile, side)
+            if texture_id == -1:
+                return self.edge
+        else:
+            point = current_level[tile, level.PRESENCE]
+            if not isinstance(point, tuple):
+                return self.edge
+            texture_id = self.texture_ids.get(point[side], -1)
+            if texture_id == -1:
+                texture_id = len(self.palette)
+                self.palette.append(point[side])
+                self.texture_ids[point[side]] = texture_id
+        while texture_id >= len(self.slots):
+            self.slots.append(_resolve_wall_texture(
+                self.palette[len(self.slots)], self.pending
+            ))
+        return self.slots[texture_id]
+
+    def update_loaded_textures(self, texture_names: Set[str]) -> None:
+        """
+        Replace the placeholder with the real slot of each pending texture
+        that has just been added to wall_atlas, as returned by
+        finish_loaded_textures. Only the palette entries of those textures
+        are changed.
+        """
+        loaded_names = self.pending & texture_names
+        if not loaded_names:
+            return
+        self.pending -= loaded_names
+        for texture_id, texture_name in enumerate(
+                self.palette[:len(self.slots)]):
+            if texture_name in loaded_names:
+                self.slots[texture_id] = wall_texture_slots[texture_name]
+        if self.edge_name in loaded_names:
+            self.edge = wall_texture_slots[self.edge_name]
+
+
+def compile_wall_textures(current_level: level.Level) -> CompiledWallTextures:
+    """
+    Resolve the slot of every texture in a level's texture palette. This
+    takes time proportional to the size of the palette rather than the
+    level, so can be done whenever a level is loaded.
+    """
+    pending: Set[str] = set()
+    palette = (
+        current_level.texture_palette
+        if isinstance(current_level, CompactLevel) else []
+    )
+    return CompiledWallTextures(
+        palette,
+        array('H', (_resolve_wall_texture(x, pending) for x in palette)),
+        current_level.edge_wall_texture_name,
+        _resolve_wall_texture(current_level.edge_wall_texture_name, pending),
+        pending
+    )
+
+
+def _resolve_wall_texture(texture_name: str, pending: Set[str]) -> int:
+    """
+    Get the wall_atlas slot of a wall texture, or the placeholder if it isn't
+    loaded, adding its name to pending if it may still be loading.
+    """
+    if texture_name not in wall_texture_slots and _requested_textures.get(
+            (WALL_TEXTURE_DIRECTORY, texture_name)) != _FINISHED:
+        pending.add(texture_name)
+    return wall_texture_slots.get(texture_name, PLACEHOLDER_SLOT)
+
+
+# Decoration textures are loaded in the background by request_level_textures
+decoration_textures: Dict[str, pygame.Surface] = {}
 decoration_textures["placeholder"] = placeholder_texture
 
 # Load player textures
@@ -104,17 +437,17 @@ player_textures: List[pygame.Surface] = [
     for x in glob(os.path.join("textures", "sprite", "player", "*.png"))
 ]
 
-# Load player wall textures
-player_wall_textures: Dict[int, Tuple[pygame.Surface, pygame.Surface]] = {}
+# Load player wall textures into the wall atlas, mapping each degradation
+# stage to its slot
+player_wall_slots: Dict[int, int] = {}
 for texture_file in glob(os.path.join("textures", "player_wall", "*.png")):
     degradation_stage = int(os.path.split(texture_file)[-1].split(".")[0])
-    light_texture = load_texture(texture_file)
-    dark_texture = light_texture.copy()
-    dark_texture.blit(_darkener, (0, 0))
-    player_wall_textures[degradation_stage] = (light_texture, dark_texture)
+    player_wall_slots[degradation_stage] = wall_atlas.add(
+        load_texture(texture_file)
+    )
 
-if not player_wall_textures:
-    player_wall_textures[0] = (placeholder_texture, placeholder_texture.copy())
+if not player_wall_slots:
+    player_wall_slots[0] = PLACEHOLDER_SLOT
 
 # Load sky texture
 sky_texture = load_texture(os.path.join("textures", "sky.png"), use_alpha=True)
@@ -125,6 +458,10 @@ sprite_textures = {
     for x in glob(os.path.join("textures", "sprite", "*.png"))
 }
 
+# Build the mip chain of every sprite texture at load time
+for _ in (*sprite_textures.values(), *player_textures, placeholder_texture):
+    get_mip_chain(_)
+
 # Load HUD icons
 blank_icon = pygame.Surface((32, 32))
 hud_icons = {
@@ -5,11 +5,10 @@ loading/selection is handled in resources.py rather than here.
 """
 import math
 import random
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import pygame
 
-import maze_levels
 import net_data
 from config_loader import Config
 from level import Level
@@ -62,12 +61,11 @@ def draw_victory_screen(screen: pygame.Surface, cfg: Config,
                         ],
                         victory_next_block: Union[
                             pygame.mixer.Sound, EmptySound
-                        ], level_json_path: str) -> None:
+                        ], level_count: int) -> None:
     """
     Draw the victory screen seen after beating a level. Displays numerous
     scores to the player in a gradual animation.
     """
-    level_count = len(maze_levels.load_level_json(level_json_path))
     while len(total_time_on_screen) < level_count:
         total_time_on_screen.append(0.0)
     while len(victory_sounds_played) < level_count:
@@ -231,11 +229,18 @@ def draw_textured_column(screen: pygame.Surface, cfg: Config,
                          coord: Tuple[float, float], side_was_ns: bool,
                          column_height: int, index: int,
                          facing: Tuple[float, float], texture: pygame.Surface,
-                         camera_plane: Tuple[float, float]
+                         camera_plane: Tuple[float, float],
+                         texture_position: Tuple[int, int] = (0, 0),
+                         mip_chain: Sequence[pygame.Surface] = ()
                          ) -> None:
     """
     Takes a single column of pixels from the given texture and scales it to
-    the required height before drawing it to the screen.
+    the required height before drawing it to the screen. If the texture is
+    an atlas, texture_position is the top left of the texture to use in it.
+    mip_chain holds copies of the texture, each half the size of the one
+    before. Columns shorter than the texture are taken from the smallest
+    copy that is still at least as tall as the column, which avoids scaling
+    down more pixels than are drawn and stops distant walls shimmering.
     """
     # Determines how far along the texture we need to go by keeping only the
     # decimal part of the collision coordinate.
@@ -254,8 +259,22 @@ def draw_textured_column(screen: pygame.Surface, cfg: Config,
     # The location on the screen to start drawing the column
     draw_x = display_column_width * index
     draw_y = max(0, -column_height // 2 + cfg.viewport_height // 2)
+    mip_level = min(
+        len(mip_chain),
+        max(0, (TEXTURE_HEIGHT // max(1, column_height)).bit_length() - 1)
+    )
+    if mip_level > 0:
+        texture = mip_chain[mip_level - 1]
+        texture_position = (
+            texture_position[0] >> mip_level,
+            texture_position[1] >> mip_level
+        )
+        texture_x >>= mip_level
     # Get a single column of pixels
-    pixel_column = texture.subsurface(texture_x, 0, 1, TEXTURE_HEIGHT)
+    pixel_column = texture.subsurface(
+        texture_position[0] + texture_x, texture_position[1],
+        1, TEXTURE_HEIGHT >> mip_level
+    )
     if (column_height > cfg.viewport_height
             and column_height > cfg.texture_scale_limit):
         # Crop the column so we are only scaling pixels that will be within the
@@ -313,10 +332,14 @@ def draw_textured_column(screen: pygame.Surface, cfg: Config,
 def draw_sprite(screen: pygame.Surface, cfg: Config,
                 coord: Tuple[float, float], player_coords: Tuple[float, float],
                 camera_plane: Tuple[float, float], facing: Tuple[float, float],
-                texture: pygame.Surface) -> None:
+                texture: pygame.Surface,
+                mip_chain: Sequence[pygame.Surface] = ()) -> None:
     """
     Draw a transformed 2D sprite onto the screen. Provides the illusion of
-    an object being drawn in 3D space by scaling up and down.
+    an object being drawn in 3D space by scaling up and down. mip_chain
+    holds copies of the texture, each half the size of the one before, the
+    smallest of which that is still at least as large as the sprite is
+    scaled instead of the full texture.
     """
     display_column_width = cfg.viewport_width // cfg.display_columns
     filled_screen_width = display_column_width * cfg.display_columns
@@ -353,6 +376,11 @@ def draw_sprite(screen: pygame.Surface, cfg: Config,
     if (sprite_size[0] > cfg.sprite_scale_limit
             or sprite_size[1] > cfg.sprite_scale_limit):
         return
+    for mip_texture in mip_chain:
+        if (mip_texture.get_width() < sprite_size[0]
+                or mip_texture.get_height() < sprite_size[1]):
+            break
+        texture = mip_texture
     scaled_texture = pygame.transform.scale(texture, sprite_size)
     if cfg.fog_strength > 0:
         fog_overlay = pygame.Surface(sprite_size)
@@ -455,16 +483,28 @@ def draw_map(screen: pygame.Surface, cfg: Config, current_level: Level,
              player_wall: Optional[Tuple[int, int]]) -> None:
     """
     Draw a 2D map representing the current level. This will cover the screen
-    unless enable_cheat_map is True in the config.
-    """
-    tile_width = cfg.viewport_width // current_level.dimensions[0]
-    tile_height = cfg.viewport_height // current_level.dimensions[1]
-    x_offset = cfg.viewport_width if cfg.enable_cheat_map else 0
-    for y, row in enumerate(current_level.wall_map):
-        for x, point in enumerate(row):
+    unless enable_cheat_map is True in the config. Tiles are never drawn less
+    than a pixel wide, so on levels too large to fit, only the region around
+    the player is drawn.
+    """
+    width, height = current_level.dimensions
+    tile_width = max(1, cfg.viewport_width // width)
+    tile_height = max(1, cfg.viewport_height // height)
+    column_count = min(width, cfg.viewport_width // tile_width)
+    row_count = min(height, cfg.viewport_height // tile_height)
+    player_x, player_y = current_level.player_grid_coords
+    left = min(max(0, player_x - column_count // 2), width - column_count)
+    top = min(max(0, player_y - row_count // 2), height - row_count)
+    map_left = cfg.viewport_width if cfg.enable_cheat_map else 0
+    x_offset = map_left - left * tile_width
+    y_offset = -top * tile_height
+    previous_clip = screen.get_clip()
+    screen.set_clip((map_left, 0, cfg.viewport_width, cfg.viewport_height))
+    for y in range(top, top + row_count):
+        for x in range(left, left + column_count):
             if current_level.player_grid_coords == (x, y):
                 colour = BLUE
-            elif (current_level.monster_coords == (x, y)
+            elif (current_level.monsters.is_occupied((x, y))
                     and cfg.enable_cheat_map):
                 colour = DARK_RED
             elif player_wall is not None and player_wall == (x, y):
@@ -485,11 +525,11 @@ def draw_map(screen: pygame.Surface, cfg: Config, current_level: Level,
             elif current_level.end_point == (x, y) and cfg.enable_cheat_map:
                 colour = GREEN
             else:
-                colour = BLACK if point is not None else WHITE
+                colour = BLACK if current_level.is_wall((x, y)) else WHITE
             pygame.draw.rect(
                 screen, colour, (
                     tile_width * x + x_offset,
-                    tile_height * y, tile_width, tile_height
+                    tile_height * y + y_offset, tile_width, tile_height
                 )
             )
     # Raycast rays
@@ -500,33 +540,34 @@ def draw_map(screen: pygame.Surface, cfg: Config, current_level: Level,
                     current_level.player_coords[0]
                     * tile_width + x_offset,
                     current_level.player_coords[1]
-                    * tile_height
+                    * tile_height + y_offset
                 ),
                 (
                     ray_end[0] * tile_width + x_offset,
-                    ray_end[1] * tile_height
+                    ray_end[1] * tile_height + y_offset
                 ), 1
             )
     # Player direction
     pygame.draw.line(
         screen, DARK_RED, (
             current_level.player_coords[0] * tile_width + x_offset,
-            current_level.player_coords[1] * tile_height
+            current_level.player_coords[1] * tile_height + y_offset
         ),
         (
             current_level.player_coords[0] * tile_width + x_offset + facing[0]
             * min(tile_width, tile_height) // 2,
-            current_level.player_coords[1] * tile_height + facing[1]
-            * min(tile_width, tile_height) // 2
+            current_level.player_coords[1] * tile_height + y_offset
+            + facing[1] * min(tile_width, tile_height) // 2
         ), 3
     )
     # Exact player position
     pygame.draw.circle(
         screen, DARK_GREEN, (
             current_level.player_coords[0] * tile_width + x_offset,
-            current_level.player_coords[1] * tile_height
+            current_level.player_coords[1] * tile_height + y_offset
         ), min(tile_width, tile_height) / 8
     )
+    screen.set_clip(previous_clip)
 
 
 def draw_stats(screen: pygame.Surface, cfg: Config, monster_spawned: bool,
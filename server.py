@@ -7,6 +7,7 @@ import time
 from glob import glob
 from typing import Any, Dict
 
+import level_cache
 import maze_levels
 import net_data
 import raycasting
@@ -42,7 +43,9 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
     # Change working directory to the directory where the script is located.
     # This prevents issues with required files not being found.
     os.chdir(os.path.dirname(__file__))
-    levels = maze_levels.load_level_json(level_json_path)
+    levels = maze_levels.load_levels(
+        level_json_path, True, level_cache.DEFAULT_CACHE_DIRECTORY
+    )
     skin_count = len(
         glob(os.path.join("textures", "sprite", "player", "*.png"))
     )
@@ -70,9 +73,12 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
                 if (coop and time.time() - last_monster_move
                         >= MONSTER_MOVEMENT_WAIT):
                     last_monster_move = time.time()
-                    current_level.move_monster(True)
+                    current_level.move_monster(True, [
+                        plr.grid_pos for plr in players.values()
+                        if plr.hits_remaining > 0
+                    ])
                 for plr in players.values():
-                    if plr.grid_pos == current_level.monster_coords:
+                    if current_level.monsters.is_occupied(plr.grid_pos):
                         plr.hits_remaining = 0
                         # Hide dead players in level
                         plr.pos = net_data.Coords(-1, -1)
@@ -84,6 +90,10 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
                         players[player_key].pos.x_pos.__trunc__(),
                         players[player_key].pos.y_pos.__trunc__()
                     )
+                    current_level.evict_distant_chunks([
+                        plr.grid_pos for plr in players.values()
+                        if plr.hits_remaining > 0
+                    ])
                 if not coop:
                     player_bytes = (
                         players[player_key].hits_remaining.to_bytes(1, "big")
@@ -98,15 +108,19 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
                     current_level.exit_keys.discard(grid_pos)
                     current_level.key_sensors.discard(grid_pos)
                     current_level.guns.discard(grid_pos)
-                    if current_level.monster_coords is None:
-                        monster_coords = (-1, -1)
-                    else:
-                        monster_coords = current_level.monster_coords
+                    # Every monster is sent, with (-1, -1) for those that
+                    # aren't spawned, so clients keep the same indices.
                     player_bytes = (
                         (not bool(
                             players[player_key].hits_remaining
-                        )).to_bytes(1, "big") + bytes(
-                            net_data.Coords(*monster_coords)
+                        )).to_bytes(1, "big")
+                        + len(current_level.monsters).to_bytes(2, "big")
+                        + b"".join(
+                            bytes(net_data.Coords(
+                                *(coords if coords is not None else (-1, -1))
+                            ))
+                            for coords
+                            in current_level.monsters.get_all_coords()
                         ) + (len(players) - 1).to_bytes(1, "big")
                     )
                 for key, plr in players.items():
@@ -158,9 +172,11 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
                         (k, x) for k, x in players.items()
                         if x.hits_remaining > 0 and k != player_key
                     ]
+                    hittable_players = [x[1] for x in list_players]
                     _, hit_sprites = raycasting.get_first_collision(
                         current_level, facing.to_tuple(), False,
-                        [x[1] for x in list_players]
+                        hittable_players,
+                        raycasting.index_players_by_tile(hittable_players)
                     )
                     hit = False
                     for sprite in hit_sprites:
@@ -193,7 +209,7 @@ def maze_server(*, level_json_path: str = "maze_levels.json",
                         elif sprite.type == raycasting.MONSTER and coop:
                             # Monster was hit by gun
                             hit = True
-                            current_level.monster_coords = None
+                            current_level.despawn_monsters_at(sprite.tile)
                             sock.sendto(SHOT_KILLED.to_bytes(1, "big"), addr)
                             break
                     if not hit:
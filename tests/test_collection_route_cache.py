@@ -0,0 +1,38 @@
+"""
+Checks that collection routes cached for a level are never returned for a
+different version of its geometry, including for copies of the level.
+"""
+import copy
+import unittest
+
+import maze_generator
+import pathfinding
+from level import PLAYER_COLLIDE
+
+
+class CollectionRouteCacheTest(unittest.TestCase):
+    """
+    Plans routes on copies of a generated maze after changing each of them
+    differently.
+    """
+    def test_diverging_deep_copies_get_own_routes(self) -> None:
+        for compact in (False, True):
+            with self.subTest(compact=compact):
+                original = maze_generator.generate_level(
+                    (11, 11), seed=1, compact=compact
+                )
+                self.assertIsNotNone(original.plan_collection_route())
+                copied = copy.deepcopy(original)
+                # Unchanged collision, but still counts as a change
+                original[original.start_point, PLAYER_COLLIDE] = False
+                copied[copied.end_point, PLAYER_COLLIDE] = True
+                for test_level in (original, copied):
+                    expected = pathfinding.plan_collection_route(
+                        test_level.get_collision_grid(PLAYER_COLLIDE),
+                        test_level.dimensions, test_level.start_point,
+                        test_level.original_exit_keys, test_level.end_point
+                    )
+                    self.assertEqual(
+                        test_level.plan_collection_route(), expected
+                    )
+                self.assertIsNone(copied.plan_collection_route())
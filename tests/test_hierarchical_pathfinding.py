@@ -0,0 +1,116 @@
+"""
+Checks that paths found by HierarchicalPathfinder are valid, and never much
+longer than the shortest possible, as tiles in the level change.
+"""
+import random
+import unittest
+from typing import List, Optional, Sequence, Tuple
+
+import maze_generator
+import pathfinding
+from hierarchical_pathfinding import (
+    EXACT_SEARCH_TILES, HierarchicalPathfinder
+)
+from level import PLAYER_COLLIDE
+
+# Paths through open areas may be longer than the shortest possible, but
+# never by more than this many times the shortest length.
+MAX_PATH_LENGTH_RATIO = 1.25
+QUERY_COUNT = 300
+# Number of random tiles toggled between wall and floor before each query
+CHANGES_PER_QUERY = 2
+
+
+class HierarchicalPathfindingTest(unittest.TestCase):
+    """
+    Compares paths found by the pathfinder with those found by a breadth
+    first search of the whole level.
+    """
+    def test_generated_maze_paths_are_near_shortest(self) -> None:
+        test_level = maze_generator.generate_level((97, 97), seed=1)
+        collision_grid = bytearray(
+            test_level.get_collision_grid(PLAYER_COLLIDE)
+        )
+        self._check_paths(collision_grid, (97, 97), 16, random.Random(1))
+
+    def test_open_level_paths_are_near_shortest(self) -> None:
+        rng = random.Random(2)
+        for dimensions, cluster_size in (
+                ((120, 90), 4), ((90, 120), 8), ((150, 150), 16)):
+            collision_grid = bytearray(
+                rng.random() < 0.3
+                for _ in range(dimensions[0] * dimensions[1])
+            )
+            self._check_paths(collision_grid, dimensions, cluster_size, rng)
+
+    def test_small_level_paths_are_shortest(self) -> None:
+        rng = random.Random(3)
+        dimensions = (60, 60)
+        self.assertLessEqual(dimensions[0] * dimensions[1], EXACT_SEARCH_TILES)
+        collision_grid = bytearray(
+            rng.random() < 0.3 for _ in range(dimensions[0] * dimensions[1])
+        )
+        self._check_paths(collision_grid, dimensions, 8, rng, 1.0)
+
+    def _check_paths(self, collision_grid: bytearray,
+                     dimensions: Tuple[int, int], cluster_size: int,
+                     rng: random.Random,
+                     max_ratio: float = MAX_PATH_LENGTH_RATIO) -> None:
+        """
+        Make random queries, changing random tiles before each, and check
+        each path against the shortest path.
+        """
+        pathfinder = HierarchicalPathfinder(
+            collision_grid, dimensions, cluster_size
+        )
+        for _ in range(QUERY_COUNT):
+            for _ in range(CHANGES_PER_QUERY):
+                tile = (
+                    rng.randrange(dimensions[0]), rng.randrange(dimensions[1])
+                )
+                collision_grid[tile[1] * dimensions[0] + tile[0]] ^= 1
+                pathfinder.update_tile(tile)
+            start = _random_free_tile(collision_grid, dimensions, rng)
+            goal = _random_free_tile(collision_grid, dimensions, rng)
+            path = pathfinder.find_path(start, goal)
+            shortest = pathfinding.bfs_path(
+                collision_grid, dimensions, start, {goal}
+            )
+            if shortest is None:
+                self.assertIsNone(path)
+                continue
+            self.assertIsNotNone(path)
+            self._assert_valid_path(path, start, goal, collision_grid,
+                                    dimensions[0])
+            self.assertLessEqual(
+                len(path) - 1, (len(shortest) - 1) * max_ratio,
+                f"Path from {start} to {goal} is too long"
+            )
+
+    def _assert_valid_path(self, path: Optional[List[Tuple[int, int]]],
+                           start: Tuple[int, int], goal: Tuple[int, int],
+                           collision_grid: Sequence[int], width: int) -> None:
+        """
+        Check that a path goes from start to goal in single cardinal moves
+        without passing through any wall.
+        """
+        assert path is not None
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], goal)
+        for previous, tile in zip(path, path[1:]):
+            self.assertEqual(
+                abs(tile[0] - previous[0]) + abs(tile[1] - previous[1]), 1
+            )
+            self.assertFalse(collision_grid[tile[1] * width + tile[0]])
+
+
+def _random_free_tile(collision_grid: Sequence[int],
+                      dimensions: Tuple[int, int],
+                      rng: random.Random) -> Tuple[int, int]:
+    """
+    Pick a random tile that isn't a wall.
+    """
+    while True:
+        tile = (rng.randrange(dimensions[0]), rng.randrange(dimensions[1]))
+        if not collision_grid[tile[1] * dimensions[0] + tile[0]]:
+            return tile
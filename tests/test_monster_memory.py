@@ -0,0 +1,73 @@
+"""
+Checks that moving monsters for a long time on a large level doesn't keep
+growing the caches that monster sight and chasing are built from.
+"""
+import random
+import tracemalloc
+import unittest
+from typing import List, Tuple
+
+import maze_generator
+import visibility
+from level import Level, MONSTER_COLLIDE, PLAYER_COLLIDE
+
+LEVEL_DIMENSIONS = (501, 501)
+MONSTER_COUNT = 32
+# Each phase visits more target tiles than the visibility cache can hold
+WALK_STEPS = visibility.VISIBLE_SET_CACHE_SIZE // 2 + 500
+# Teleport the targets every this many steps, as respawning players do
+TELEPORT_INTERVAL = 4
+MAX_MEMORY_GROWTH = 8 * 1024 * 1024
+
+
+class MonsterMemoryTest(unittest.TestCase):
+    """
+    Walks two co-op players around a generated maze, moving every monster
+    each step.
+    """
+    def test_random_walk_memory_is_bounded(self) -> None:
+        rng = random.Random(1)
+        test_level = maze_generator.generate_level(LEVEL_DIMENSIONS, seed=1)
+        free_tiles = test_level.get_free_tiles()
+        for _ in range(MONSTER_COUNT):
+            test_level.add_monster(rng.choice(free_tiles))
+        targets = [rng.choice(free_tiles), rng.choice(free_tiles)]
+        tracemalloc.start()
+        try:
+            _walk(test_level, targets, rng)
+            baseline = tracemalloc.get_traced_memory()[0]
+            _walk(test_level, targets, rng)
+            growth = tracemalloc.get_traced_memory()[0] - baseline
+        finally:
+            tracemalloc.stop()
+        self.assertLessEqual(
+            len(test_level.get_derived_data().visibility[MONSTER_COLLIDE]),
+            visibility.VISIBLE_SET_CACHE_SIZE
+        )
+        self.assertLess(growth, MAX_MEMORY_GROWTH)
+
+
+def _walk(test_level: Level, targets: List[Tuple[int, int]],
+          rng: random.Random) -> None:
+    """
+    Move each target WALK_STEPS random steps, moving the monsters after
+    every step.
+    """
+    free_tiles = test_level.get_free_tiles()
+    for step in range(WALK_STEPS):
+        for index, (x, y) in enumerate(targets):
+            if step % TELEPORT_INTERVAL == 0:
+                targets[index] = rng.choice(free_tiles)
+                continue
+            moves = [
+                (x + x_offset, y + y_offset)
+                for x_offset, y_offset in ((0, -1), (1, 0), (0, 1), (-1, 0))
+                if not test_level[(x + x_offset, y + y_offset), PLAYER_COLLIDE]
+            ]
+            if moves:
+                targets[index] = rng.choice(moves)
+        test_level.move_monster(True, targets)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+Contains the VisibilityIndex class, which finds and caches the tiles of a level
+that can be seen from each other by using symmetric shadowcasting, and the
+VisibleSet class it stores them as.
+"""
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from fractions import Fraction
+from typing import Callable, List, Optional, Tuple
+
+# The tile transformations for the north, east, south, and west quadrants
+# respectively. Each maps (depth, column) to an (x, y) offset from the origin.
+_QUADRANTS = (
+    lambda depth, col: (col, -depth),
+    lambda depth, col: (depth, col),
+    lambda depth, col: (col, depth),
+    lambda depth, col: (-depth, col)
+)
+
+
+# The most origins whose visible tiles are kept by each VisibilityIndex
+VISIBLE_SET_CACHE_SIZE = 64 * 64
+
+
+@dataclass(frozen=True)
+class VisibleSet:
+    """
+    The tiles visible from a single origin, stored as a bitset covering only
+    the bounding box of those tiles, so that its size depends on how far can
+    be seen rather than on the size of the level. Bit
+    ((y - top) * box_width + (x - left)) is set for every visible tile.
+    """
+    left: int
+    top: int
+    box_width: int
+    bits: int
+
+    def __contains__(self, tile: Tuple[int, int]) -> bool:
+        x = tile[0] - self.left
+        y = tile[1] - self.top
+        if not 0 <= x < self.box_width or y < 0:
+            return False
+        return bool(self.bits >> (y * self.box_width + x) & 1)
+
+    def get_tiles(self) -> List[Tuple[int, int]]:
+        """
+        Get a list of the coordinates of every tile in the set.
+        """
+        bits = self.bits
+        tiles: List[Tuple[int, int]] = []
+        while bits:
+            lowest_bit = bits & -bits
+            index = lowest_bit.bit_length() - 1
+            tiles.append((
+                self.left + index % self.box_width,
+                self.top + index // self.box_width
+            ))
+            bits ^= lowest_bit
+        return tiles
+
+
+class VisibilityIndex:
+    """
+    Stores the set of tiles visible from the centre of each tile of a grid as
+    a VisibleSet. Opaque tiles that can be seen are included in the set.
+    Visibility is symmetric, so if tile A can see tile B, tile B can also see
+    tile A.
+    Sets are calculated on first request and then kept until a tile they
+    include changes, as only tiles that could see a changed tile can have
+    their visibility affected by it. Only the cache_size most recently used
+    sets are kept, so memory use stays bounded however many origins are
+    checked over time.
+    This class does not hold a reference to the level it is indexing, so the
+    level dimensions and a function to check if a tile is opaque must be given
+    whenever visibility may need to be calculated.
+    """
+    def __init__(self, cache_size: int = VISIBLE_SET_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self._dimensions: Optional[Tuple[int, int]] = None
+        # Maps each origin to its visible set, least recently used first
+        self._visible_sets: OrderedDict[Tuple[int, int], VisibleSet] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._visible_sets)
+
+    def get_visible_set(self, origin: Tuple[int, int],
+                        dimensions: Tuple[int, int],
+                        is_opaque: Callable[[Tuple[int, int]], bool]
+                        ) -> VisibleSet:
+        """
+        Get the set of tiles visible from the given origin tile, calculating
+        it if it is not already cached.
+        """
+        if self._dimensions != dimensions:
+            # The level was resized, so every set may have changed.
+            self._visible_sets = OrderedDict()
+            self._dimensions = dimensions
+        visible_set = self._visible_sets.get(origin)
+        if visible_set is not None:
+            self._visible_sets.move_to_end(origin)
+            return visible_set
+        visible_set = _shadowcast(origin, dimensions, is_opaque)
+        self._visible_sets[origin] = visible_set
+        while len(self._visible_sets) > self.cache_size:
+            self._visible_sets.popitem(last=False)
+        return visible_set
+
+    def is_visible(self, origin: Tuple[int, int], target: Tuple[int, int],
+                   dimensions: Tuple[int, int],
+                   is_opaque: Callable[[Tuple[int, int]], bool]) -> bool:
+        """
+        Determine whether the target tile can be seen from the origin tile.
+        """
+        return target in self.get_visible_set(origin, dimensions, is_opaque)
+
+    def get_visible_tiles(self, origin: Tuple[int, int],
+                          dimensions: Tuple[int, int],
+                          is_opaque: Callable[[Tuple[int, int]], bool]
+                          ) -> List[Tuple[int, int]]:
+        """
+        Get a list of the coordinates of every tile visible from the origin.
+        """
+        return self.get_visible_set(origin, dimensions, is_opaque).get_tiles()
+
+    def precompute(self, dimensions: Tuple[int, int],
+                   is_opaque: Callable[[Tuple[int, int]], bool]) -> None:
+        """
+        Calculate the visible set of every open tile ahead of time, so that
+        no calculation needs to take place during play. Only the last
+        cache_size sets are kept, so this should only be used on levels with
+        no more open tiles than that.
+        """
+        for y in range(dimensions[1]):
+            for x in range(dimensions[0]):
+                if not is_opaque((x, y)):
+                    self.get_visible_set((x, y), dimensions, is_opaque)
+
+    def invalidate(self, changed_tile: Tuple[int, int]) -> None:
+        """
+        Discard the visible set of every origin that could see a tile whose
+        opacity has changed. Origins that could not see the tile cannot be
+        affected by the change, so are kept.
+        """
+        for origin in [
+                origin for origin, visible_set in self._visible_sets.items()
+                if changed_tile in visible_set or origin == changed_tile]:
+            del self._visible_sets[origin]
+
+
+def _shadowcast(origin: Tuple[int, int], dimensions: Tuple[int, int],
+                is_opaque: Callable[[Tuple[int, int]], bool]) -> VisibleSet:
+    """
+    Find the set of tiles visible from the centre of the origin tile by
+    scanning each of the four cardinal quadrants row by row, narrowing the
+    range of visible slopes as opaque tiles are encountered. Tiles outside the
+    level are treated as opaque.
+    """
+    width, height = dimensions
+    visible_tiles = [origin]
+
+    for transform in _QUADRANTS:
+        # Each row to scan is (depth, start_slope, end_slope)
+        rows: List[Tuple[int, Fraction, Fraction]] = [
+            (1, Fraction(-1), Fraction(1))
+        ]
+        while rows:
+            depth, start_slope, end_slope = rows.pop()
+            previous_opaque: Optional[bool] = None
+            min_col = math.floor(depth * start_slope + Fraction(1, 2))
+            max_col = math.ceil(depth * end_slope - Fraction(1, 2))
+            for col in range(min_col, max_col + 1):
+                offset = transform(depth, col)
+                tile = (origin[0] + offset[0], origin[1] + offset[1])
+                in_bounds = 0 <= tile[0] < width and 0 <= tile[1] < height
+                opaque = not in_bounds or is_opaque(tile)
+                # Floor tiles are only visible if their centre is within the
+                # scanned slopes, which is what keeps visibility symmetric.
+                if in_bounds and (
+                        opaque or depth * start_slope <= col
+                        <= depth * end_slope):
+                    visible_tiles.append(tile)
+                if previous_opaque and not opaque:
+                    start_slope = Fraction(2 * col - 1, 2 * depth)
+                if previous_opaque is False and opaque:
+                    rows.append((
+                        depth + 1, start_slope,
+                        Fraction(2 * col - 1, 2 * depth)
+                    ))
+                previous_opaque = opaque
+            if previous_opaque is False:
+                rows.append((depth + 1, start_slope, end_slope))
+    left = min(x for x, _ in visible_tiles)
+    top = min(y for _, y in visible_tiles)
+    box_width = max(x for x, _ in visible_tiles) - left + 1
+    box_height = max(y for _, y in visible_tiles) - top + 1
+    bit_bytes = bytearray((box_width * box_height + 7) >> 3)
+    for x, y in visible_tiles:
+        index = (y - top) * box_width + x - left
+        bit_bytes[index >> 3] |= 1 << (index & 7)
+    return VisibleSet(
+        left, top, box_width, int.from_bytes(bit_bytes, "little")
+    )